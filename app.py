@@ -1,13 +1,75 @@
 from abc import ABC, abstractmethod
 
 import networkx as nx
+from netaddr import IPNetwork
 
-from utils_ports import find_ports_per_switch
+from group import Bucket, GroupIdAllocator, GroupType
+from utils_ports import find_ports_per_switch, get_neighbor_for_port, get_out_port_for_src
 from rule import Action, ActionType, Rule, MatchPattern
 
 
+# The tables of the multi-table pipeline, used when the controller runs in pipeline mode:
+# firewall ACL -> TE steering -> L2 destination forwarding
+FW_TABLE = 0
+TE_TABLE = 1
+L2_TABLE = 2
+
+
+# An IPv4 address, or a CIDR prefix (e.g., of aggregated rules, see rule_aggregation.py) as a masked match
+def ip_match(ip):
+    if '/' not in ip:
+        return ip
+    network = IPNetwork(ip)
+    return str(network.network), str(network.netmask)
+
+
+# Translates a MatchPattern to the OpenFlow match fields `kwargs` of OFPMatch
+def match_kwargs(match_pattern):
+    src_mac = match_pattern.src_mac
+    dst_mac = match_pattern.dst_mac
+    mac_proto = match_pattern.mac_proto
+    ip_proto = match_pattern.ip_proto
+    src_ip = match_pattern.src_ip
+    dst_ip = match_pattern.dst_ip
+    src_port = match_pattern.src_port
+    dst_port = match_pattern.dst_port
+    in_port = match_pattern.in_port
+    kwargs = {'eth_type': 0x800}
+
+    if src_mac:
+        kwargs['eth_src'] = src_mac
+    if dst_mac:
+        kwargs['eth_dst'] = dst_mac
+    if mac_proto:
+        kwargs['eth_type'] = mac_proto
+    if src_ip:
+        kwargs['ipv4_src'] = ip_match(src_ip)
+    if dst_ip:
+        kwargs['ipv4_dst'] = ip_match(dst_ip)
+    if in_port:
+        kwargs['in_port'] = in_port
+    if ip_proto:
+        kwargs['ip_proto'] = ip_proto
+        if ip_proto == 6:
+            if src_port:
+                kwargs['tcp_src'] = src_port
+            if dst_port:
+                kwargs['tcp_dst'] = dst_port
+        elif ip_proto == 17:
+            if src_port:
+                kwargs['udp_src'] = src_port
+            if dst_port:
+                kwargs['udp_dst'] = dst_port
+    return kwargs
+
+
 class NetworkApp(ABC):
-    def __init__(self, topo_file, json_file, of_controller, priority):
+    # A snapshot (see snapshot.py) saves the keyword arguments `SNAPSHOT_CONFIG` the app is created with,
+    # and the attributes `SNAPSHOT_STATE` its constructor does not rebuild; both are attributes of the same name
+    SNAPSHOT_CONFIG = ('topo_file', 'json_file', 'priority')
+    SNAPSHOT_STATE = ('rules', 'rules_by_dpid', 'rule_store', 'groups_by_dpid', 'group_store')
+
+    def __init__(self, topo_file, json_file, of_controller, priority, table_id=0):
         self.topo_file = topo_file
         self.topo = None
         if self.topo_file:
@@ -15,75 +77,156 @@ class NetworkApp(ABC):
         self.json_file = json_file
         self.of_controller = of_controller
         self.priority = priority
+        self.table_id = table_id # the app's table in pipeline mode; table 0 otherwise
         self.rules = [] # list of OpenFlow Rule objects to be sent to switches
+        self.rules_by_dpid = {} # index of `self.rules`: switch id -> list of Rule objects
+        # The rules the switches should hold: rule set name -> (switch id -> list of Rule objects)
+        # It is updated by `send_openflow_rules` and replayed to reconnecting switches
+        self.rule_store = {}
+        # The groups used by the rules, indexed and stored the same way as the rules
+        self.groups_by_dpid = {} # switch id -> (group id -> Group)
+        self.group_store = {}
+        # Group ids are shared by all the apps of a controller
+        self.group_ids = of_controller.group_ids if of_controller else GroupIdAllocator()
+        self._hop_distances = {} # destination switch -> (switch -> number of hops)
+        self._ecmp_next_hops = {} # (destination switch, metric) -> (switch -> next hops)
 
     # Send the `rule` to a specific Ryu's `datapath`
     # Notice that this function should be called by `self.send_openflow_rules`
-    # The goal is to translate our object model (Rule, Action, MatchPattern) to Ryu's:
-    # First, the function needs to translate the `match_pattern` to OpenFlow `kwargs`
-    #       of_match = ofp_parser.OFPMatch(**kwargs)
-    # Second, it needs to decide the action based on `action_type`` and `out_port`
-    #       of_actions = [...]
-    # Finally, it should call:
+    # The goal is to translate our object model (Rule, Action, MatchPattern) to Ryu's (see `translate_rule`),
+    # then call:
     #       self.of_controller.add_flow(datapath, match=of_match, actions=of_actions, priority=self.priority)
+    # If the controller has a `flowmod_cache`, the FlowMod is encoded once per distinct rule,
+    # and later sends of the same rule reuse the encoded bytes with a new xid
     def send_openflow_rules_to_dp(self, rule, datapath):
+        table_id = self.table_id if self.of_controller.pipeline else 0
+        cache = self.of_controller.flowmod_cache
+        if cache is None:
+            translated = self.translate_rule(rule, datapath)
+            if translated:
+                of_match, of_actions = translated
+                self.of_controller.add_flow(datapath, match=of_match, actions=of_actions, priority=self.priority,
+                                            table_id=table_id)
+            return
+
+        key = (datapath.ofproto.OFP_VERSION, table_id, self.priority, rule.match_pattern.key(), rule.action.key())
+        buf = cache.get(key)
+        if buf is None:
+            mod = self.build_rule_flow_mod(rule, datapath)
+            if mod is None:
+                return
+            buf = cache.put(key, mod)
+        cache.send(datapath, buf)
+
+    # Build the FlowMod of `rule` for `datapath` without sending it
+    # Reactive rules set `idle_timeout`, `flags` and `cookie` (see flow_lifecycle.py)
+    # Returns None if the action type is not supported
+    def build_rule_flow_mod(self, rule, datapath, idle_timeout=0, flags=0, cookie=0):
+        translated = self.translate_rule(rule, datapath)
+        if not translated:
+            return None
+        of_match, of_actions = translated
+        table_id = self.table_id if self.of_controller.pipeline else 0
+        return self.of_controller.build_flow_mod(datapath, match=of_match, actions=of_actions,
+                                                 priority=self.priority, table_id=table_id,
+                                                 idle_timeout=idle_timeout, flags=flags, cookie=cookie)
+
+    # Translate the `rule` to Ryu's (OFPMatch, list of actions) for `datapath`
+    # First, the `match_pattern` is translated to OpenFlow `kwargs`
+    #       of_match = ofp_parser.OFPMatch(**kwargs)
+    # Second, the actions are decided based on `action_type` and `out_port`
+    #       of_actions = [...]
+    # Returns None if the action type is not supported
+    def translate_rule(self, rule, datapath):
         ofp = datapath.ofproto
         ofp_parser = datapath.ofproto_parser
-        match_pattern = rule.match_pattern
-        src_mac = match_pattern.src_mac
-        dst_mac = match_pattern.dst_mac
-        mac_proto = match_pattern.mac_proto
-        ip_proto = match_pattern.ip_proto
-        src_ip = match_pattern.src_ip
-        dst_ip = match_pattern.dst_ip
-        src_port = match_pattern.src_port
-        dst_port = match_pattern.dst_port
-        in_port = match_pattern.in_port
-        kwargs = {'eth_type': 0x800}
-        
-        if src_mac:
-            kwargs['eth_src'] = src_mac
-        if dst_mac:
-            kwargs['eth_dst'] = dst_mac
-        if mac_proto:
-            kwargs['eth_type'] = mac_proto
-        if src_ip:
-            kwargs['ipv4_src'] = src_ip
-        if dst_ip:
-            kwargs['ipv4_dst'] = dst_ip
-        if in_port:
-            kwargs['in_port'] = in_port
-        if ip_proto:
-            kwargs['ip_proto'] = ip_proto
-            if ip_proto == 6:
-                if src_port:
-                    kwargs['tcp_src'] = src_port
-                if dst_port:
-                    kwargs['tcp_dst'] = dst_port
-            elif ip_proto == 17:
-                if src_port:
-                    kwargs['udp_src'] = src_port
-                if dst_port:
-                    kwargs['udp_dst'] = dst_port
-
-        of_match = ofp_parser.OFPMatch(**kwargs)
+        of_match = ofp_parser.OFPMatch(**match_kwargs(rule.match_pattern))
         if rule.action.action_type == ActionType.DROP:
-            self.of_controller.add_flow(datapath, match=of_match, actions=[], priority=self.priority)
+            return of_match, []
         elif rule.action.action_type == ActionType.CONTROLLER:
-            of_actions = [ofp_parser.OFPActionOutput(ofp.OFPP_CONTROLLER, ofp.OFPCML_NO_BUFFER)]
-            self.of_controller.add_flow(datapath, match=of_match, actions=of_actions, priority=self.priority)
+            return of_match, [ofp_parser.OFPActionOutput(ofp.OFPP_CONTROLLER, ofp.OFPCML_NO_BUFFER)]
         elif rule.action.action_type == ActionType.FORWARD:
-            of_actions = [ofp_parser.OFPActionOutput(rule.action.out_port)]
-            self.of_controller.add_flow(datapath, match=of_match, actions=of_actions, priority=self.priority)
+            return of_match, [ofp_parser.OFPActionOutput(rule.action.out_port)]
+        elif rule.action.action_type == ActionType.GROUP:
+            return of_match, [ofp_parser.OFPActionGroup(rule.action.group_id)]
+        return None
+
+    # Send the `group` to a specific Ryu's `datapath`
+    # A bucket of a fast-failover group watches its own `watch_port`
+    def send_group_to_dp(self, group, datapath):
+        group_type, buckets = self.translate_group(group, datapath)
+        self.of_controller.add_group(datapath, group_type, group.group_id, buckets)
+
+    # Translate the `group` to Ryu's (group type, list of OFPBucket) for `datapath`
+    def translate_group(self, group, datapath):
+        ofp = datapath.ofproto
+        ofp_parser = datapath.ofproto_parser
+        if group.group_type == GroupType.FAST_FAILOVER:
+            group_type = ofp.OFPGT_FF
+        else:
+            group_type = ofp.OFPGT_SELECT
+        buckets = []
+        for bucket in group.buckets:
+            watch_port = bucket.watch_port if bucket.watch_port else ofp.OFPP_ANY
+            actions = [ofp_parser.OFPActionOutput(bucket.out_port)]
+            buckets.append(ofp_parser.OFPBucket(weight=bucket.weight, watch_port=watch_port,
+                                                watch_group=ofp.OFPG_ANY, actions=actions))
+        return group_type, buckets
     
     # Send the OpenFlow rules in `self.rules` to corresponding switches
-    def send_openflow_rules(self):
-        for rule in self.rules:
-            dpid = rule.switch_id
-            if self.of_controller:
-                datapath = self.of_controller.datapaths.get(dpid, None)
-                if datapath:
+    # The rules replace the previous rules of the same `rule_set` in `self.rule_store`,
+    # so apps that provision several independent rule sets (e.g., TE objectives) keep all of them
+    # The groups of a switch are sent before its rules, as the rules may point to them
+    # A sharded controller routes the rules to the instances owning the switches instead (see sharding.py)
+    def send_openflow_rules(self, rule_set='default'):
+        self.store_rules(rule_set)
+        if not self.of_controller:
+            return
+        if self.of_controller.shard is not None:
+            self.of_controller.shard.route(self, rule_set)
+            return
+        for dpid, groups in self.groups_by_dpid.items():
+            datapath = self.of_controller.datapaths.get(dpid, None)
+            if datapath:
+                for group in groups.values():
+                    self.send_group_to_dp(group, datapath)
+        for dpid, rules in self.rules_by_dpid.items():
+            datapath = self.of_controller.datapaths.get(dpid, None)
+            if datapath:
+                for rule in rules:
                     self.send_openflow_rules_to_dp(rule, datapath)
+
+    # Store the rules in `self.rules` as the `rule_set` without sending them
+    # (e.g., when the controller sends a rule delta instead, see topology_reload.py)
+    def store_rules(self, rule_set='default'):
+        self.rule_store[rule_set] = {dpid: list(rules) for dpid, rules in self.rules_by_dpid.items()}
+        self.group_store[rule_set] = {dpid: list(groups.values()) for dpid, groups in self.groups_by_dpid.items()}
+
+    # Delete the `rule` from a specific Ryu's `datapath`
+    def delete_rule_from_dp(self, rule, datapath):
+        translated = self.translate_rule(rule, datapath)
+        if not translated:
+            return
+        ofp = datapath.ofproto
+        ofp_parser = datapath.ofproto_parser
+        table_id = self.table_id if self.of_controller.pipeline else 0
+        mod = ofp_parser.OFPFlowMod(datapath=datapath, table_id=table_id, command=ofp.OFPFC_DELETE_STRICT,
+                                    priority=self.priority, out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY,
+                                    match=translated[0])
+        datapath.send_msg(mod)
+
+    # Replay the stored groups and rules of a single switch, e.g., when it reconnects
+    # Returns the number of rules sent
+    def send_openflow_rules_for_dp(self, datapath):
+        for groups_by_dpid in self.group_store.values():
+            for group in groups_by_dpid.get(datapath.id, []):
+                self.send_group_to_dp(group, datapath)
+        count = 0
+        for rules_by_dpid in self.rule_store.values():
+            for rule in rules_by_dpid.get(datapath.id, []):
+                self.send_openflow_rules_to_dp(rule, datapath)
+                count += 1
+        return count
     
     # Given a `path` and a `match_pattern` for every switch along the path:
     # Calculate the list of OpenFlow rules representing this path
@@ -103,9 +246,151 @@ class NetworkApp(ABC):
             rules.append(rule)
         return rules
 
+    # Replace the FORWARD action of `rule` with a fast-failover group towards `dst_switch`:
+    # the primary bucket is the rule's `out_port`, and the backup bucket is a loop-free alternate next hop,
+    # i.e., a neighbour that is not farther from `dst_switch` (in hops) than the rule's switch.
+    # Such a neighbour never forwards the pkts back, so a link failure is repaired in the data plane.
+    # Rules without an alternate next hop are left unchanged.
+    # The backup is a per-hop alternate, not a precomputed link-disjoint backup path: it protects against the failure
+    # of the primary link only, and the pkts follow the shortest paths of the alternate from there.
+    def add_fast_failover(self, rule, dst_switch):
+        switch = str(rule.switch_id)
+        out_port = rule.action.out_port
+        primary = get_neighbor_for_port(self.topo, switch, out_port)
+        if rule.action.action_type != ActionType.FORWARD or primary is None:
+            return rule
+        backup = self.loop_free_alternate(switch, primary, self.hop_distances(str(dst_switch)))
+        if backup is None:
+            return rule
+        backup_port = get_out_port_for_src(self.topo, switch, backup)
+        buckets = [Bucket(out_port, watch_port=out_port), Bucket(backup_port, watch_port=backup_port)]
+        group = self.group_ids.get_group(rule.switch_id, GroupType.FAST_FAILOVER, buckets)
+        self.add_group(group)
+        rule.action = Action(ActionType.GROUP, group_id=group.group_id)
+        return rule
+
+    # The loop-free alternate of `primary` at `switch` for the hop distances `dist` to the destination,
+    # None if there is none
+    def loop_free_alternate(self, switch, primary, dist):
+        alternates = [n for n in self.topo.neighbors(switch) if n != primary and dist[n] <= dist[switch]]
+        if not alternates:
+            return None
+        return min(alternates, key=lambda n: (dist[n], n))
+
+    # All equal-cost next hops from every switch towards `dst_switch`
+    # The cost is the number of hops, or the sum of the edge attribute `metric` (e.g., 'delay')
+    # Returns a dict of switch -> sorted list of next-hop switches ([] for `dst_switch` itself)
+    def ecmp_next_hops(self, dst_switch, metric=None):
+        if (dst_switch, metric) in self._ecmp_next_hops:
+            return self._ecmp_next_hops[dst_switch, metric]
+        dist = nx.single_source_dijkstra_path_length(self.topo, dst_switch, weight=metric or (lambda u, v, d: 1))
+        next_hops = {}
+        for switch in dist:
+            next_hops[switch] = sorted(n for n in self.topo.neighbors(switch)
+                                       if dist[switch] == self._edge_cost(switch, n, metric) + dist[n])
+        self._ecmp_next_hops[dst_switch, metric] = next_hops
+        return next_hops
+
+    def _edge_cost(self, u, v, metric):
+        if metric is None:
+            return 1
+        return self.topo.edges[u, v].get(metric, 1)
+
+    # The action spreading the pkts at `switch` over `next_hops`:
+    # a FORWARD action for one next hop, otherwise a SELECT group with one bucket per next hop
+    # Bucket weights are proportional to the edge `bw` if `bw_weights` is True, otherwise equal
+    # Every bucket watches its port, so the switch stops selecting buckets of failed links
+    def ecmp_action(self, switch, next_hops, bw_weights=False):
+        if len(next_hops) == 1:
+            return Action(ActionType.FORWARD, out_port=get_out_port_for_src(self.topo, switch, next_hops[0]))
+        buckets = []
+        for next_hop in next_hops:
+            out_port = get_out_port_for_src(self.topo, switch, next_hop)
+            weight = int(self.topo.edges[switch, next_hop].get('bw', 1)) if bw_weights else 1
+            buckets.append(Bucket(out_port, watch_port=out_port, weight=weight))
+        group = self.group_ids.get_group(int(switch), GroupType.SELECT, buckets)
+        self.add_group(group)
+        return Action(ActionType.GROUP, group_id=group.group_id)
+
+    # The number of hops from every switch to `dst_switch`
+    def hop_distances(self, dst_switch):
+        if dst_switch not in self._hop_distances:
+            self._hop_distances[dst_switch] = nx.single_source_shortest_path_length(self.topo, dst_switch)
+        return self._hop_distances[dst_switch]
+
     def add_rule(self, rule):
         self.rules.append(rule)
-    
+        self.rules_by_dpid.setdefault(rule.switch_id, []).append(rule)
+
+    def add_group(self, group):
+        self.groups_by_dpid.setdefault(group.switch_id, {})[group.group_id] = group
+
+    def clear_rules(self):
+        self.rules = []
+        self.rules_by_dpid = {}
+        self.groups_by_dpid = {}
+
+    # Replace the topology, e.g., when the controller reloads it; the cached paths are dropped
+    def set_topology(self, topo, topo_file=None):
+        self.topo = topo
+        self.topo_file = topo_file or self.topo_file
+        self._hop_distances = {}
+        self._ecmp_next_hops = {}
+
+    # Returns a copy of `rule` whose ports are renumbered from `old_topo` to `self.topo`
+    # A port keeps leading to the same neighbour; the groups of the rule are looked up in `old_groups`
+    # (switch id, group id) -> Group, and replaced by groups with renumbered buckets
+    # Returns None if a port of the rule leads to a link that no longer exists
+    def remap_rule(self, rule, old_topo, old_groups):
+        switch = str(rule.switch_id)
+
+        def remap(port):
+            if port is None or port == 1:
+                return port
+            neighbor = get_neighbor_for_port(old_topo, switch, port)
+            if neighbor is None or not self.topo.has_edge(switch, neighbor):
+                return None
+            return get_out_port_for_src(self.topo, switch, neighbor)
+
+        pattern = MatchPattern(**rule.match_pattern.__dict__)
+        pattern.in_port = remap(rule.match_pattern.in_port)
+        if rule.match_pattern.in_port is not None and pattern.in_port is None:
+            return None
+        action = rule.action
+        if action.action_type == ActionType.FORWARD:
+            out_port = remap(action.out_port)
+            if out_port is None:
+                return None
+            action = Action(ActionType.FORWARD, out_port=out_port)
+        elif action.action_type == ActionType.GROUP:
+            old_group = old_groups[rule.switch_id, action.group_id]
+            buckets = []
+            for bucket in old_group.buckets:
+                out_port = remap(bucket.out_port)
+                if out_port is None:
+                    return None
+                watch_port = remap(bucket.watch_port) if bucket.watch_port else bucket.watch_port
+                buckets.append(Bucket(out_port, watch_port=watch_port, weight=bucket.weight))
+            group = self.group_ids.get_group(rule.switch_id, old_group.group_type, buckets)
+            self.add_group(group)
+            action = Action(ActionType.GROUP, group_id=group.group_id)
+        return Rule(switch_id=rule.switch_id, match_pattern=pattern, action=action)
+
+    # All the stored groups of the app: (switch id, group id) -> Group
+    def stored_groups(self):
+        return {(group.switch_id, group.group_id): group
+                for groups_by_dpid in self.group_store.values()
+                for groups in groups_by_dpid.values() for group in groups}
+
+    # Apps are pickled in controller snapshots (see snapshot.py) without their controller and path caches;
+    # the controller is attached again when the snapshot is restored
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['of_controller'] = None
+        state['_hop_distances'] = {}
+        state['_ecmp_next_hops'] = {}
+        return state
+
     @abstractmethod
     def to_json(self, json_file):
         pass
@@ -1,6 +1,7 @@
 import json
 
-from app import NetworkApp
+from app import NetworkApp, FW_TABLE
+from fw_placement import place_firewall_rules
 from rule import Action, ActionType, Rule, MatchPattern
 from utils_json import DefaultEncoder
 
@@ -8,31 +9,77 @@ def parse_action(d):
     if 'action_type' in d:
         return {
             'action_type': getattr(ActionType, d['action_type']),
-            'out_port': d.get('out_port', None)
+            'out_port': d.get('out_port', None),
+            'group_id': d.get('group_id', None)
             }
     return d
 
 
 class FirewallApp(NetworkApp):
-    def __init__(self, json_file, of_controller=None, priority=3):
-        super(FirewallApp, self).__init__(None, json_file, of_controller, priority)
+    SNAPSHOT_STATE = NetworkApp.SNAPSHOT_STATE + ('placement', 'policy')
+
+    # `topo_file` is only needed to place switch-agnostic rules (rules whose `switch_id` is null)
+    def __init__(self, json_file, of_controller=None, priority=3, topo_file=None):
+        super(FirewallApp, self).__init__(topo_file, json_file, of_controller, priority, FW_TABLE)
+        self.placement = None
+        self.policy = None # the rules before placement, if the policy has switch-agnostic rules
 
     # Translates the firewall policy file in `self.json_file` to a list of Rule objects `self.rules`
     def from_json(self):
         with open('%s'% self.json_file) as f:
             rules = json.load(f, object_hook=parse_action)
-            # TODO: complete
+        self.clear_rules()
+        for rule in rules:
+            pattern = MatchPattern(**rule['match_pattern'])
+            action = Action(**rule['action'])
+            self.add_rule(Rule(switch_id=rule['switch_id'], match_pattern=pattern, action=action))
 
     # Writes the firewall policy to a JSON file
     def to_json(self, json_file):
         with open('%s'% json_file, 'w', encoding='utf-8') as f:
             json.dump(self.rules, f, ensure_ascii=False, indent=4, cls=DefaultEncoder)
 
-    # This function calls `send_openflow_rules` only.
-    # This is because the policy is the actual OpenFlow rules to be sent.
-    def calculate_firewall_rules(self):
+    # The switch-specific rules of the policy are the actual OpenFlow rules to be sent.
+    # Switch-agnostic rules are first placed in the topology (see `place_rules`).
+    def calculate_firewall_rules(self, reserved=None):
+        if any(rule.switch_id is None for rule in self.rules):
+            self.place_rules(reserved)
         self.send_openflow_rules()
 
-    # BONUS: Used to react to changes in the network (the controller notifies the App)
+    # Replaces the switch-agnostic rules in `self.rules` by their placement in the topology,
+    # within the `table_capacity` of the switches minus the `reserved` entries (switch id -> entries)
+    def place_rules(self, reserved=None):
+        assert self.topo is not None, 'Switch-agnostic firewall rules need a topology'
+        reserved = dict(reserved or {})
+        self.policy = list(self.rules)
+        fixed = [rule for rule in self.rules if rule.switch_id is not None]
+        for rule in fixed:
+            reserved[rule.switch_id] = reserved.get(rule.switch_id, 0) + 1
+        self.placement = place_firewall_rules(self.topo, [rule for rule in self.rules if rule.switch_id is None],
+                                              reserved)
+        self.clear_rules()
+        for rule in fixed + self.placement.rules:
+            self.add_rule(rule)
+        return self.placement
+
+    # Moves the rules to a new topology (see topology_reload.py)
+    # A placed policy is placed again if the switches, their capacities, or the links (for the covers) changed;
+    # otherwise the rules of the removed switches are dropped and the others renumbered
     def on_notified(self, **kwargs):
-        pass
\ No newline at end of file
+        topo, diff, old_topo = kwargs['topo'], kwargs['diff'], kwargs['old_topo']
+        old_groups = self.stored_groups()
+        self.set_topology(topo, kwargs.get('topo_file'))
+        rules = [rule for rules in self.rule_store.get('default', {}).values() for rule in rules]
+        self.clear_rules()
+        if self.policy is not None and (diff.structural() or diff.node_attr_changed('table_capacity')):
+            for rule in self.policy:
+                if rule.switch_id is None or str(rule.switch_id) in topo:
+                    self.add_rule(rule)
+            self.place_rules(kwargs.get('reserved'))
+        else:
+            for rule in rules:
+                if str(rule.switch_id) in topo:
+                    rule = self.remap_rule(rule, old_topo, old_groups)
+                    if rule is not None:
+                        self.add_rule(rule)
+        self.store_rules()
\ No newline at end of file
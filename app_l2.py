@@ -1,12 +1,27 @@
 import networkx as nx
 
-from app import NetworkApp
+from app import NetworkApp, L2_TABLE
 from rule import Action, ActionType, Rule, MatchPattern
 from utils_net import mn_get_host_mac
+from utils_ports import get_neighbor_for_port
 
 class L2ConnectivityApp(NetworkApp):
-    def __init__(self, topo_file, of_controller=None, priority=1):
-        super(L2ConnectivityApp, self).__init__(topo_file, None, of_controller, priority)
+    SNAPSHOT_CONFIG = ('topo_file', 'priority', 'fast_failover', 'ecmp', 'ecmp_metric', 'bw_weights', 'reactive')
+
+    # If `fast_failover` is True, every rule forwards through a fast-failover group with a backup next hop
+    # If `ecmp` is True, pkts are spread over all equal-cost next hops instead (see `calculate_destination_rules`)
+    # If `reactive` is True, no rule is installed ahead of the traffic: the controller installs the rule of a switch
+    # towards a destination on the first packet-in (see `reactive_rule` and flow_lifecycle.py)
+    def __init__(self, topo_file, of_controller=None, priority=1, fast_failover=False,
+                 ecmp=False, ecmp_metric=None, bw_weights=False, reactive=False):
+        super(L2ConnectivityApp, self).__init__(topo_file, None, of_controller, priority, L2_TABLE)
+        self.fast_failover = fast_failover
+        self.ecmp = ecmp
+        self.ecmp_metric = ecmp_metric
+        self.bw_weights = bw_weights
+        self.reactive = reactive
+        self.reactive_rules = {} # destination switch -> (switch -> Rule), calculated on demand
+        self.recomputed = [] # the destinations recomputed by the last `on_notified`
 
     # This function calculates the L2 connectivity rules based on the shortest path per each switch pair
     # The *shortest* refers to the minimum number of links between the switch pair
@@ -14,24 +29,158 @@ class L2ConnectivityApp(NetworkApp):
     # To calculate a shortest path, check the function `networkx.shortest_path` in the networkx package
     # The function should call `self.send_openflow_rules()` at the end
     def calculate_connectivity_rules(self):
-        self.rules = []
-        
+        self.clear_rules()
+        self.reactive_rules = {}
+        if not self.reactive:
+            self._add_destination_rules({n2: self.calculate_destination_rules(n2) for n2 in self.destinations()})
+        self.send_openflow_rules()
+
+    # The rule of switch `dpid` for the pkts destined to `dst_mac`, in reactive mode
+    # Returns None if `dst_mac` is not the host of a switch reachable from `dpid`
+    def reactive_rule(self, dpid, dst_mac):
+        n2 = str(int(dst_mac.replace(':', ''), 16))
+        if n2 not in self.topo or mn_get_host_mac(n2) != dst_mac:
+            return None
+        if n2 not in self.reactive_rules:
+            self.reactive_rules[n2] = self.calculate_destination_rules(n2)
+        return self.reactive_rules[n2].get(str(dpid))
+
+    # The destinations whose rules this app calculates: all the switches, or only the switches
+    # of its partition when the controller is sharded (the other instances calculate the rest)
+    def destinations(self):
+        shard = self.of_controller.shard if self.of_controller else None
+        return [n2 for n2 in self.topo.nodes() if shard is None or shard.owns(int(n2))]
+
+    # The rules forwarding the pkts destined to the host of `n2`: a dict of switch -> Rule
+    # If `self.ecmp` is True, the pkts are forwarded over all equal-cost paths instead
+    # The cost is the number of links, or the sum of the edge attribute `self.ecmp_metric` (e.g., 'delay')
+    # A switch with several next hops to a destination forwards through a SELECT group;
+    # destinations with the same next hops at a switch share one group
+    def calculate_destination_rules(self, n2):
+        pattern = MatchPattern(dst_mac=mn_get_host_mac(n2))
+        rules = {}
+        if self.ecmp:
+            for n1, next_hops in self.ecmp_next_hops(n2, self.ecmp_metric).items():
+                if n1 == n2:
+                    action = Action(action_type=ActionType.FORWARD, out_port=1)
+                else:
+                    action = self.ecmp_action(n1, next_hops, self.bw_weights)
+                rules[n1] = Rule(switch_id=int(n1), match_pattern=MatchPattern(**pattern.__dict__), action=action)
+            return rules
+
+        action = Action(action_type=ActionType.FORWARD, out_port=1)
+        rules[n2] = Rule(switch_id=int(n2), match_pattern=MatchPattern(**pattern.__dict__), action=action)
+        reachable = self.hop_distances(n2)
         for n1 in self.topo.nodes():
-            pattern = MatchPattern(dst_mac=mn_get_host_mac(n1))
-            action = Action(action_type=ActionType.FORWARD, out_port=1)
-            rule = Rule(switch_id=int(n1), match_pattern=pattern, action=action)
-            self.add_rule(rule)
+            if n1 != n2 and n1 in reachable:
+                path = nx.shortest_path(self.topo, source=n1, target=n2)
+                rule = self.calculate_rules_for_path(path, pattern, include_in_port=False)[0]
+                if self.fast_failover:
+                    self.add_fast_failover(rule, n2)
+                rules[n1] = rule
+        return rules
+
+    # Adds the rules of every destination (a dict of destination -> (switch -> Rule)):
+    # first the rules to the local hosts, then the rules of every switch to the other destinations
+    def _add_destination_rules(self, rules_per_destination):
+        nodes = list(self.topo.nodes())
+        for n1 in nodes:
+            if n1 in rules_per_destination.get(n1, {}):
+                self.add_rule(rules_per_destination[n1][n1])
+        for n1 in nodes:
+            for n2 in nodes:
+                if n1 != n2 and n1 in rules_per_destination.get(n2, {}):
+                    self.add_rule(rules_per_destination[n2][n1])
+
+    # Moves the rules to a new topology (see topology_reload.py)
+    # Only the destinations whose forwarding may change are recomputed; the rules of the others
+    # are kept, with their ports renumbered at switches whose neighbours changed
+    # In reactive mode there is nothing to recompute: the reactive flows are flushed instead
+    def on_notified(self, **kwargs):
+        topo, diff, old_topo = kwargs['topo'], kwargs['diff'], kwargs['old_topo']
+        self.reactive_rules = {}
+        if self.reactive:
+            self.set_topology(topo, kwargs.get('topo_file'))
+            self.recomputed = []
+            self._flush_reactive_flows()
+            return
+        old_rules = {}
+        for rules in self.rule_store.get('default', {}).values():
+            for rule in rules:
+                old_rules[rule.switch_id, rule.match_pattern.dst_mac] = rule
+        old_groups = self.stored_groups()
+        self.set_topology(topo, kwargs.get('topo_file'))
+
+        self.clear_rules()
+        self.recomputed = []
+        rules_per_destination = {}
+        for n2 in self.destinations():
+            rules = None
+            if not self._destination_affected(n2, old_topo, old_rules, old_groups, diff):
+                rules = self._remap_destination_rules(n2, old_topo, old_rules, old_groups)
+            if rules is None:
+                rules = self.calculate_destination_rules(n2)
+                self.recomputed.append(n2)
+            rules_per_destination[n2] = rules
+        self._add_destination_rules(rules_per_destination)
+        self.store_rules()
 
+    # The reactive flows follow the old paths; they are installed again by the next packet-ins
+    def _flush_reactive_flows(self):
+        if self.of_controller is None:
+            return
+        reactive_flows = self.of_controller.reactive_flows
+        for dpid in list(reactive_flows.entries):
+            datapath = self.of_controller.datapaths.get(dpid)
+            if datapath is not None:
+                reactive_flows.flush(datapath)
+
+    # A destination is affected if a switch has no rule for it, or its next hop (or backup next hop)
+    # is not the one the new topology gives
+    # ECMP next hops depend on all the costs, so any change of the link costs affects every destination
+    def _destination_affected(self, n2, old_topo, old_rules, old_groups, diff):
+        if diff.added_nodes:
+            return True
+        if self.ecmp:
+            return (diff.structural() or (self.ecmp_metric and diff.edge_attr_changed(self.ecmp_metric))
+                    or (self.bw_weights and diff.edge_attr_changed('bw')))
+        if not diff.structural():
+            return False
+
+        dst_mac = mn_get_host_mac(n2)
+        dist = self.hop_distances(n2)
         for n1 in self.topo.nodes():
-            for n2 in self.topo.nodes():
-                if n1 != n2:
-                    pattern = MatchPattern(dst_mac=mn_get_host_mac(n2))
-                    path = nx.shortest_path(self.topo, source=n1, target=n2)
-                    rules = self.calculate_rules_for_path(path, pattern, include_in_port=False)
-                    self.add_rule(rules[0])
-        
-        self.send_openflow_rules()
-    
+            rule = old_rules.get((int(n1), dst_mac))
+            if rule is None or n1 not in dist:
+                return True
+            if n1 == n2:
+                continue
+            ports = [rule.action.out_port]
+            if rule.action.action_type == ActionType.GROUP:
+                ports = [bucket.out_port for bucket in old_groups[rule.switch_id, rule.action.group_id].buckets]
+            next_hop = get_neighbor_for_port(old_topo, n1, ports[0])
+            if next_hop not in dist or not self.topo.has_edge(n1, next_hop) or dist[next_hop] != dist[n1] - 1:
+                return True
+            if self.fast_failover:
+                backup = get_neighbor_for_port(old_topo, n1, ports[1]) if len(ports) > 1 else None
+                if backup != self.loop_free_alternate(n1, next_hop, dist):
+                    return True
+        return False
+
+    # The rules of destination `n2` renumbered to the new topology, None if a rule is missing or invalid
+    def _remap_destination_rules(self, n2, old_topo, old_rules, old_groups):
+        dst_mac = mn_get_host_mac(n2)
+        rules = {}
+        for n1 in self.topo.nodes():
+            rule = old_rules.get((int(n1), dst_mac))
+            if rule is None:
+                continue
+            rule = self.remap_rule(rule, old_topo, old_groups)
+            if rule is None:
+                return None
+            rules[n1] = rule
+        return rules
+
     # This function has no implementation
     def from_json(self):
         pass
@@ -39,7 +188,3 @@ class L2ConnectivityApp(NetworkApp):
     # This function has no implementation
     def to_json(self, json_file):
         pass
-    
-    # BONUS: Used to react to changes in the network (the controller notifies the App)
-    def on_notified(self, **kwargs):
-        pass
\ No newline at end of file
@@ -2,17 +2,44 @@ import json
 
 import networkx as nx
 
-from app import NetworkApp
-from rule import MatchPattern
+from app import NetworkApp, TE_TABLE
+from rule import Action, ActionType, MatchPattern, Rule
+from rule_aggregation import aggregate_rules
 from te_objs import PassByPathObjective, MinLatencyObjective, MaxBandwidthObjective
 from utils_json import DefaultEncoder
+from utils_ports import get_in_port_for_dst
+
+# Returns a copy of `match_pattern` matching the traffic in the reverse direction
+def reverse_match_pattern(match_pattern):
+    pattern = MatchPattern(**match_pattern.__dict__)
+    pattern.src_mac, pattern.dst_mac = match_pattern.dst_mac, match_pattern.src_mac
+    pattern.src_ip, pattern.dst_ip = match_pattern.dst_ip, match_pattern.src_ip
+    pattern.src_port, pattern.dst_port = match_pattern.dst_port, match_pattern.src_port
+    return pattern
 
 class TEApp(NetworkApp):
-    def __init__(self, topo_file, json_file, of_controller=None, priority=2):
-        super(TEApp, self).__init__(topo_file, json_file, of_controller, priority)
+    SNAPSHOT_CONFIG = NetworkApp.SNAPSHOT_CONFIG + ('fast_failover', 'ecmp', 'bw_weights', 'aggregate')
+    SNAPSHOT_STATE = NetworkApp.SNAPSHOT_STATE + ('pass_by_paths_obj', 'min_latency_obj', 'max_bandwidth_obj',
+                                                  'objective_rules', 'aggregations')
+
+    # If `fast_failover` is True, the rules along a path forward through fast-failover groups,
+    # whose backup next hops lead to the last switch of the path; pkts on a backup next hop leave the TE path
+    # and continue with the L2 rules
+    # If `ecmp` is True, min-latency traffic is spread over all the min-latency paths (see `_add_ecmp_rules`)
+    # If `aggregate` is True, the rules of all the objectives of a rule set are aggregated (see `_aggregate_rules`)
+    def __init__(self, topo_file, json_file, of_controller=None, priority=2, fast_failover=False,
+                 ecmp=False, bw_weights=False, aggregate=False):
+        super(TEApp, self).__init__(topo_file, json_file, of_controller, priority, TE_TABLE)
+        self.fast_failover = fast_failover
+        self.ecmp = ecmp
+        self.bw_weights = bw_weights
+        self.aggregate = aggregate
         self.pass_by_paths_obj = [] # a list of PassByPathObjective objects 
         self.min_latency_obj = [] # a list of MinLatencyObjective objects
         self.max_bandwidth_obj = [] # a list of MaxBandwidthObjective objects
+        self.objective_rules = {} # (rule set, objective index) -> list of Rule objects of the objective
+        self.aggregations = {} # rule set -> Aggregation of its rules
+        self.recomputed = [] # the (rule set, objective index) recomputed by the last `on_notified`
     
     def add_pass_by_path_obj(self, pass_by_obj):
         self.pass_by_paths_obj.append(pass_by_obj)
@@ -30,8 +57,20 @@ class TEApp(NetworkApp):
     #       self.max_bandwidth_obj
     def from_json(self):
         with open('%s'% self.json_file) as f:
-            # TODO: complete
-            pass
+            json_dict = json.load(f)
+
+        self.pass_by_paths_obj = []
+        self.min_latency_obj = []
+        self.max_bandwidth_obj = []
+        for obj in json_dict.get('pass_by_paths', []):
+            pattern = MatchPattern(**obj['match_pattern'])
+            self.add_pass_by_path_obj(PassByPathObjective(pattern, obj['switches'], obj['symmetric']))
+        for obj in json_dict.get('min_latency', []):
+            pattern = MatchPattern(**obj['match_pattern'])
+            self.add_min_latency_obj(MinLatencyObjective(pattern, obj['src_switch'], obj['dst_switch'], obj['symmetric']))
+        for obj in json_dict.get('max_bandwidth', []):
+            pattern = MatchPattern(**obj['match_pattern'])
+            self.add_max_bandwidth_obj(MaxBandwidthObjective(pattern, obj['src_switch'], obj['dst_switch'], obj['symmetric']))
     
     # Translates the TE objectives to the `json_file`
     def to_json(self, json_file):
@@ -50,8 +89,11 @@ class TEApp(NetworkApp):
     #   handle traffic in reverse direction when `symmetric` is True 
     #   call `self.send_openflow_rules()` at the end
     def provision_pass_by_paths(self):
-        self.rules = []
-        # TODO: complete
+        self.clear_rules()
+        for index, obj in enumerate(self.pass_by_paths_obj):
+            self._provision_objective('pass_by_paths', index, obj)
+        self._aggregate_rules('pass_by_paths')
+        self.send_openflow_rules('pass_by_paths')
 
     # This function translates the objectives in `self.min_latency_obj` to a list of Rules in `self.rules`
     # It should: 
@@ -60,8 +102,11 @@ class TEApp(NetworkApp):
     #   handle traffic in reverse direction when `symmetric` is True 
     #   call `self.send_openflow_rules()` at the end
     def provision_min_latency_paths(self):
-        self.rules = []
-        # TODO: complete
+        self.clear_rules()
+        for index, obj in enumerate(self.min_latency_obj):
+            self._provision_objective('min_latency', index, obj)
+        self._aggregate_rules('min_latency')
+        self.send_openflow_rules('min_latency')
 
     # BONUS: 
     # This function translates the objectives in `self.max_bandwidth_obj` to a list of Rules in `self.rules`
@@ -73,6 +118,126 @@ class TEApp(NetworkApp):
     def provision_max_bandwidth_paths(self):
         pass
     
-    # BONUS: Used to react to changes in the network (the controller notifies the App)
+    # Adds the rules of the objective `obj` of `rule_set`, and keeps them in `self.objective_rules`
+    # A pass-by path over missing links, or a min-latency objective without path, has no rules
+    def _provision_objective(self, rule_set, index, obj):
+        start = len(self.rules)
+        if rule_set == 'pass_by_paths':
+            path = [str(sw) for sw in obj.switches]
+            if nx.is_path(self.topo, path):
+                self._add_rules_for_path(path, obj.match_pattern, obj.symmetric)
+        else:
+            src_switch, dst_switch = str(obj.src_switch), str(obj.dst_switch)
+            if self.ecmp:
+                if dst_switch in self.topo and src_switch in self.ecmp_next_hops(dst_switch, 'delay'):
+                    self._add_ecmp_rules(src_switch, dst_switch, obj.match_pattern)
+                    if obj.symmetric:
+                        self._add_ecmp_rules(dst_switch, src_switch, reverse_match_pattern(obj.match_pattern))
+            else:
+                try:
+                    path = nx.shortest_path(self.topo, source=src_switch, target=dst_switch, weight='delay')
+                    self._add_rules_for_path(path, obj.match_pattern, obj.symmetric)
+                except (nx.NetworkXNoPath, nx.NodeNotFound):
+                    pass
+        self.objective_rules[rule_set, index] = self.rules[start:]
+
+    # Adds the rules of `path` for `match_pattern`
+    # If `symmetric` is True, the reversed path is added as well, with the src/dst fields swapped
+    def _add_rules_for_path(self, path, match_pattern, symmetric):
+        pattern = MatchPattern(**match_pattern.__dict__)
+        for rule in self.calculate_rules_for_path(path, pattern):
+            self._add_te_rule(rule, path[-1])
+        if symmetric:
+            pattern = reverse_match_pattern(match_pattern)
+            for rule in self.calculate_rules_for_path(list(reversed(path)), pattern):
+                self._add_te_rule(rule, path[0])
+
+    # Adds the rules spreading the `match_pattern` traffic over all the min-latency paths from `src_switch`
+    # to `dst_switch`; every switch on these paths forwards to all its next hops on them.
+    # As pkts may enter a switch from several paths, a switch has one rule per port the traffic enters from:
+    # the host port at `src_switch`, the ports of its previous hops elsewhere. The previous hops of a switch
+    # in the two directions of a symmetric objective differ, so the rules of the directions never collide.
+    def _add_ecmp_rules(self, src_switch, dst_switch, match_pattern):
+        next_hops = self.ecmp_next_hops(dst_switch, 'delay')
+        in_ports = {src_switch: [1]}
+        switches = [src_switch]
+        order = []
+        while switches:
+            switch = switches.pop()
+            order.append(switch)
+            for next_hop in next_hops[switch]:
+                if next_hop not in in_ports:
+                    in_ports[next_hop] = []
+                    switches.append(next_hop)
+                in_ports[next_hop].append(get_in_port_for_dst(self.topo, switch, next_hop))
+
+        for switch in order:
+            if switch == dst_switch:
+                action = Action(ActionType.FORWARD, out_port=1)
+            else:
+                action = self.ecmp_action(switch, next_hops[switch], self.bw_weights)
+            for in_port in sorted(in_ports[switch]):
+                pattern = MatchPattern(**match_pattern.__dict__)
+                pattern.in_port = in_port
+                self.add_rule(Rule(switch_id=int(switch), match_pattern=pattern, action=action))
+
+    # Replaces the rules in `self.rules` by their aggregation: objectives sharing path segments and differing
+    # only in their IPs get fewer, wider rules, and the rules of overlapping objectives are kept once
+    # `self.objective_rules` keeps the rules of every objective as calculated; the groups are unchanged
+    def _aggregate_rules(self, rule_set):
+        if not self.aggregate:
+            return
+        aggregation = aggregate_rules(self.topo, self.rules)
+        self.aggregations[rule_set] = aggregation
+        self.rules = []
+        self.rules_by_dpid = {}
+        for rule in aggregation.rules:
+            self.add_rule(rule)
+
+    def _add_te_rule(self, rule, dst_switch):
+        if self.fast_failover:
+            self.add_fast_failover(rule, dst_switch)
+        self.add_rule(rule)
+
+    # Moves the provisioned objectives to a new topology (see topology_reload.py)
+    # Only the objectives whose paths may change are recomputed; the rules of the others
+    # are kept, with their ports renumbered at switches whose neighbours changed
     def on_notified(self, **kwargs):
-        pass
\ No newline at end of file
+        topo, diff, old_topo = kwargs['topo'], kwargs['diff'], kwargs['old_topo']
+        old_groups = self.stored_groups()
+        self.set_topology(topo, kwargs.get('topo_file'))
+        self.recomputed = []
+        for rule_set, objectives in (('pass_by_paths', self.pass_by_paths_obj), ('min_latency', self.min_latency_obj)):
+            if rule_set not in self.rule_store:
+                continue
+            self.clear_rules()
+            for index, obj in enumerate(objectives):
+                old_rules = self.objective_rules.get((rule_set, index), [])
+                rules = None
+                if not self._objective_affected(rule_set, old_rules, diff):
+                    rules = [self.remap_rule(rule, old_topo, old_groups) for rule in old_rules]
+                if rules is None or None in rules:
+                    self._provision_objective(rule_set, index, obj)
+                    self.recomputed.append((rule_set, index))
+                    continue
+                for rule in rules:
+                    self.add_rule(rule)
+                self.objective_rules[rule_set, index] = rules
+            self._aggregate_rules(rule_set)
+            self.store_rules(rule_set)
+
+    # An objective is affected if its path may change, i.e., if its rules use a link that is gone or slower,
+    # or if a new or faster link may give a shorter min-latency path
+    # Backup next hops depend on all the hop distances, so any new or removed link affects protected objectives
+    def _objective_affected(self, rule_set, old_rules, diff):
+        if self.fast_failover and diff.structural():
+            return True
+        if rule_set == 'pass_by_paths':
+            return False
+        if self.ecmp and self.bw_weights and diff.edge_attr_changed('bw'):
+            return True
+        if diff.added_nodes or diff.added_edges or diff.edges_with_changed_attr('delay', increased=False):
+            return True
+        switches = {str(rule.switch_id) for rule in old_rules}
+        slower = diff.edges_with_changed_attr('delay') | diff.removed_edges
+        return any(u in switches and v in switches for u, v in slower)
\ No newline at end of file
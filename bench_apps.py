@@ -0,0 +1,283 @@
+"""
+Offline benchmark of the L2, TE and Firewall apps on large synthetic topologies.
+The apps send their rules to a mock `of_controller`; no Ryu or Mininet is needed.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import networkx as nx
+
+from app_fw import FirewallApp
+from app_l2 import L2ConnectivityApp
+from app_te import TEApp
+from generate_large_topology import generate_topology
+from group import GroupIdAllocator
+from rule import Action, ActionType, Rule, MatchPattern
+from te_objs import PassByPathObjective, MinLatencyObjective
+from utils_net import mn_get_host_ip
+
+RESULTS_FILE = './bench_results.jsonl'
+# The arguments changing the work of the apps: a result is compared to the last one with the same values
+OPTIONS = ('pipeline', 'ecmp', 'fast_failover', 'fw_placement', 'no_aggregate', 'table_capacity',
+           'objectives', 'fw_rules', 'seed')
+
+# name -> (generator kind, generator parameters)
+TOPOLOGIES = {
+    'fat_tree_4': ('fat_tree', {'k': 4}),
+    'fat_tree_8': ('fat_tree', {'k': 8}),
+    'leaf_spine_4x32': ('leaf_spine', {'spines': 4, 'leaves': 32}),
+    'isp_100': ('isp', {'n': 100}),
+    'scale_free_100': ('scale_free', {'n': 100}),
+}
+
+
+class MockParser:
+    """
+    Mimics the parts of Ryu's `ofproto_v1_3_parser` used by the apps.
+    Matches and actions are kept as plain Python objects.
+    """
+    @staticmethod
+    def OFPMatch(**kwargs):
+        return kwargs
+
+    @staticmethod
+    def OFPActionOutput(port, max_len=0xffe5):
+        return ('output', port)
+
+    @staticmethod
+    def OFPActionGroup(group_id):
+        return ('group', group_id)
+
+    @staticmethod
+    def OFPBucket(weight=0, watch_port=None, watch_group=None, actions=None):
+        return ('bucket', weight, watch_port, actions)
+
+
+class MockOFProto:
+    """
+    Mimics the constants of Ryu's `ofproto_v1_3` used by the apps.
+    """
+    OFPP_CONTROLLER = 0xfffffffd
+    OFPP_ANY = 0xffffffff
+    OFPCML_NO_BUFFER = 0xffff
+    OFPG_ANY = 0xffffffff
+    OFPGT_SELECT = 1
+    OFPGT_FF = 3
+
+
+class MockDatapath:
+    def __init__(self, dpid):
+        self.id = dpid
+        self.ofproto = MockOFProto
+        self.ofproto_parser = MockParser
+
+
+class MockController:
+    """
+    A mock `of_controller` with one datapath per switch in `graph`.
+    `add_flow` only counts the flows sent to each datapath and table.
+    """
+    def __init__(self, graph, pipeline=False):
+        self.pipeline = pipeline
+        self.flowmod_cache = None # the mock parser cannot serialize
+        self.shard = None
+        self.datapaths = {int(node): MockDatapath(int(node)) for node in graph.nodes()}
+        self.flows_per_dpid = {dpid: 0 for dpid in self.datapaths}
+        self.flows_per_table = {}
+        self.group_ids = GroupIdAllocator()
+        self.groups_sent = 0
+
+    def add_flow(self, datapath, match, actions, priority, hard_timeout=0, table_id=0, goto_table=None,
+                 idle_timeout=0, flags=0, cookie=0):
+        self.flows_per_dpid[datapath.id] += 1
+        self.flows_per_table[table_id] = self.flows_per_table.get(table_id, 0) + 1
+
+    def add_group(self, datapath, group_type, group_id, buckets):
+        self.groups_sent += 1
+
+    def flows_sent(self):
+        return sum(self.flows_per_dpid.values())
+
+
+def random_te_objectives(graph, count, rng):
+    """ Creates `count` pass-by-path and `count` min-latency objectives between random switch pairs
+    """
+    nodes = sorted(graph.nodes(), key=int)
+    pass_by_paths = []
+    min_latency = []
+    for _ in range(count):
+        src, dst = rng.sample(nodes, 2)
+        pattern = MatchPattern(ip_proto=6, src_ip=mn_get_host_ip(src), dst_ip=mn_get_host_ip(dst))
+        switches = [int(sw) for sw in nx.shortest_path(graph, source=src, target=dst)]
+        pass_by_paths.append(PassByPathObjective(pattern, switches, symmetric=rng.random() < 0.5))
+
+        src, dst = rng.sample(nodes, 2)
+        pattern = MatchPattern(ip_proto=17, src_ip=mn_get_host_ip(src), dst_ip=mn_get_host_ip(dst))
+        min_latency.append(MinLatencyObjective(pattern, int(src), int(dst), symmetric=rng.random() < 0.5))
+    return pass_by_paths, min_latency
+
+
+def random_firewall_rules(graph, count, rng, switch_agnostic=False):
+    """ Creates `count` drop rules on random switches, or without a switch if `switch_agnostic`
+    """
+    nodes = sorted(graph.nodes(), key=int)
+    rules = []
+    for _ in range(count):
+        switch_id = None if switch_agnostic else int(rng.choice(nodes))
+        pattern = MatchPattern(ip_proto=rng.choice([6, 17]), dst_ip=mn_get_host_ip(rng.choice(nodes)),
+                               dst_port=rng.choice([22, 53, 80, 443, 8080]))
+        rules.append(Rule(switch_id=switch_id, match_pattern=pattern, action=Action(ActionType.DROP)))
+    return rules
+
+
+def stored_rule_count(app):
+    return sum(len(rules) for rules_by_dpid in app.rule_store.values() for rules in rules_by_dpid.values())
+
+
+def measure(func):
+    """ Runs `func` and returns its (wall time in seconds, peak traced memory in bytes)
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def bench_l2(topo_file, graph, args, rng, work_dir):
+    controller = MockController(graph, args.pipeline)
+    app = L2ConnectivityApp(topo_file, controller, fast_failover=args.fast_failover,
+                            ecmp=args.ecmp, bw_weights=args.ecmp)
+    return app, controller, app.calculate_connectivity_rules
+
+
+def bench_te(topo_file, graph, args, rng, work_dir):
+    controller = MockController(graph, args.pipeline)
+    app = TEApp(topo_file, os.path.join(work_dir, 'te.json'), controller, fast_failover=args.fast_failover,
+                ecmp=args.ecmp, bw_weights=args.ecmp, aggregate=not args.no_aggregate)
+    app.pass_by_paths_obj, app.min_latency_obj = random_te_objectives(graph, args.objectives, rng)
+    app.to_json(app.json_file)
+
+    def run():
+        app.from_json()
+        app.provision_pass_by_paths()
+        app.provision_min_latency_paths()
+    return app, controller, run
+
+
+def bench_fw(topo_file, graph, args, rng, work_dir):
+    controller = MockController(graph, args.pipeline)
+    app = FirewallApp(os.path.join(work_dir, 'firewall.json'), controller, topo_file=topo_file)
+    for rule in random_firewall_rules(graph, args.fw_rules, rng, args.fw_placement):
+        app.add_rule(rule)
+    app.to_json(app.json_file)
+
+    def run():
+        app.from_json()
+        app.calculate_firewall_rules()
+    return app, controller, run
+
+
+def run_benchmark(name, kind, params, app_name, args, work_dir):
+    rng = random.Random(args.seed)
+    graph = generate_topology(kind, seed=args.seed, table_capacity=args.table_capacity, **params)
+    topo_file = os.path.join(work_dir, '%s.graphml' % name)
+    nx.write_graphml(graph, topo_file)
+    # The apps read the graphml file, so the objectives use the same (string) node ids
+    graph = nx.read_graphml(topo_file)
+
+    if app_name == 'l2':
+        app, controller, run = bench_l2(topo_file, graph, args, rng, work_dir)
+    elif app_name == 'te':
+        app, controller, run = bench_te(topo_file, graph, args, rng, work_dir)
+    else:
+        app, controller, run = bench_fw(topo_file, graph, args, rng, work_dir)
+
+    elapsed, peak = measure(run)
+    rules = stored_rule_count(app)
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'topology': name,
+        'app': app_name,
+        'options': {option: getattr(args, option) for option in OPTIONS},
+        'switches': graph.number_of_nodes(),
+        'links': graph.number_of_edges(),
+        'rules': rules,
+        'rules_saved': sum(aggregation.saved() for aggregation in getattr(app, 'aggregations', {}).values()),
+        'rules_unplaced': len(app.placement.unplaced) if getattr(app, 'placement', None) else 0,
+        'flows_sent': controller.flows_sent(),
+        'max_flows_per_switch': max(controller.flows_per_dpid.values()),
+        'flows_per_table': controller.flows_per_table,
+        'groups_sent': controller.groups_sent,
+        'wall_time_s': elapsed,
+        'peak_mem_kb': peak / 1024.0,
+        'rules_per_s': rules / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def result_key(result):
+    return (result['topology'], result['app'], tuple(sorted(result['options'].items())))
+
+
+# The results recorded without their options are not compared
+def load_previous_results(results_file):
+    previous = {}
+    if os.path.exists(results_file):
+        with open(results_file) as f:
+            for line in f:
+                result = json.loads(line)
+                if 'options' in result:
+                    previous[result_key(result)] = result
+    return previous
+
+
+def print_results(results, previous):
+    header = '%-18s %-4s %8s %9s %10s %12s %12s %9s' % ('Topology', 'App', 'Switches', 'Rules', 'Time (s)',
+                                                       'Peak (KB)', 'Rules/s', 'vs. last')
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        last = previous.get(result_key(result))
+        change = '-'
+        if last and last['wall_time_s'] > 0:
+            change = '%+.1f%%' % (100.0 * (result['wall_time_s'] - last['wall_time_s']) / last['wall_time_s'])
+        print('%-18s %-4s %8d %9d %10.4f %12.1f %12.0f %9s' % (result['topology'], result['app'], result['switches'],
+                                                             result['rules'], result['wall_time_s'],
+                                                             result['peak_mem_kb'], result['rules_per_s'], change))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the SDN apps on synthetic topologies')
+    parser.add_argument('--topologies', nargs='+', choices=sorted(TOPOLOGIES), default=['fat_tree_4', 'isp_100'])
+    parser.add_argument('--apps', nargs='+', choices=['l2', 'te', 'fw'], default=['l2', 'te', 'fw'])
+    parser.add_argument('--objectives', type=int, default=50, help='number of TE objectives of each type')
+    parser.add_argument('--fw-rules', type=int, default=200, help='number of firewall rules')
+    parser.add_argument('--fw-placement', action='store_true', help='place switch-agnostic firewall rules in the topology')
+    parser.add_argument('--table-capacity', type=int, help='flow table capacity of every switch')
+    parser.add_argument('--fast-failover', action='store_true', help='protect the L2 and TE rules with fast-failover groups')
+    parser.add_argument('--ecmp', action='store_true', help='spread the L2 and min-latency traffic with bw-weighted select groups')
+    parser.add_argument('--pipeline', action='store_true', help='install the rules in the multi-table pipeline')
+    parser.add_argument('--no-aggregate', action='store_true', help='install the TE rules of every objective as calculated')
+    parser.add_argument('--seed', type=int, default=471)
+    parser.add_argument('--results', default=RESULTS_FILE, help='JSON lines file tracking the results across runs')
+    args = parser.parse_args()
+
+    previous = load_previous_results(args.results)
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name in args.topologies:
+            kind, params = TOPOLOGIES[name]
+            for app_name in args.apps:
+                results.append(run_benchmark(name, kind, params, app_name, args, work_dir))
+
+    print_results(results, previous)
+    with open(args.results, 'a') as f:
+        for result in results:
+            f.write(json.dumps(result) + '\n')
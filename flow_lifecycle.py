@@ -0,0 +1,204 @@
+"""
+The lifecycle of the flows the controller installs.
+
+Proactive rules are calculated by the apps ahead of the traffic (their `rule_store`); they are permanent and
+replayed to reconnecting switches. Reactive rules are installed on a packet-in, for the traffic that missed
+the tables (see the `reactive` mode of L2ConnectivityApp). A reactive entry carries a cookie with the
+REACTIVE_COOKIE bit, expires after `idle_timeout` seconds without traffic, and is reported back by its switch
+in a FlowRemoved message (OFPFF_SEND_FLOW_REM).
+
+`ReactiveFlows` keeps the controller's view of the reactive entries of every switch. The packet counters of
+the entries are polled with flow stats requests restricted to the reactive cookies, and when a switch
+approaches its `table_capacity` (a node attribute of the topology, unlimited if absent), its least recently
+hit reactive entries are evicted before a new one is installed.
+"""
+import time
+
+from rule import ActionType
+
+REACTIVE_COOKIE = 1 << 63
+COOKIE_MASK = (1 << 64) - 1
+IDLE_TIMEOUT = 10 # seconds
+# A switch above HIGH_WATER of its capacity gets its reactive entries evicted down to LOW_WATER
+HIGH_WATER = 0.95
+LOW_WATER = 0.9
+
+
+def is_reactive(cookie):
+    return bool(cookie & REACTIVE_COOKIE)
+
+
+def _match_key(table_id, priority, match):
+    return (table_id, priority, tuple(sorted(match.items())))
+
+
+class ReactiveEntry:
+    """
+    A reactive entry of a switch as the controller sees it.
+    `last_hit` is the last time its packet count was seen increasing, its install time until then.
+    """
+    def __init__(self, cookie, table_id, priority, match, now, packet_count=0):
+        self.cookie = cookie
+        self.table_id = table_id
+        self.priority = priority
+        self.match = match
+        self.packet_count = packet_count
+        self.installed = now
+        self.last_hit = now
+
+
+class ReactiveFlows:
+    """
+    The reactive entries of the switches of `of_controller`: their installation, eviction, and the
+    FlowRemoved messages and flow stats that keep them in sync.
+    If `evict` is False, a full switch rejects the new entries instead.
+    """
+    def __init__(self, of_controller, idle_timeout=IDLE_TIMEOUT, evict=True):
+        self.of_controller = of_controller
+        self.idle_timeout = idle_timeout
+        self.evict = evict
+        self.entries = {} # dpid -> (cookie -> ReactiveEntry)
+        self.cookies = {} # dpid -> ((table id, priority, match key) -> cookie)
+        self.polls = {} # dpid -> (xid, request time, cookies seen in the replies)
+        self.next_cookie = 1
+        self.installs = 0
+        self.evictions = 0
+        self.removals = 0
+
+    # The entries of a switch: the proactive rules of the apps, the table-miss entries and the reactive entries
+    def occupancy(self, dpid):
+        proactive = sum(len(rules_by_dpid.get(dpid, [])) for app in self.of_controller.apps()
+                        for rules_by_dpid in app.rule_store.values())
+        table_miss = 3 if self.of_controller.pipeline else 1
+        return proactive + table_miss + len(self.entries.get(dpid, {}))
+
+    def install(self, app, rule, datapath):
+        """ Installs the reactive `rule` of `app` at `datapath` (with its group, if it forwards through one),
+        after evicting entries if the switch is near its capacity
+
+        Returns:
+            The number of entries evicted
+        """
+        evicted = self.make_room(app, datapath) if self.evict else 0
+        if rule.action.action_type == ActionType.GROUP and \
+                rule.action.group_id not in self.of_controller.groups_installed.get(datapath.id, set()):
+            app.send_group_to_dp(app.groups_by_dpid[rule.switch_id][rule.action.group_id], datapath)
+
+        cookie = REACTIVE_COOKIE | self.next_cookie
+        self.next_cookie += 1
+        mod = app.build_rule_flow_mod(rule, datapath, idle_timeout=self.idle_timeout,
+                                      flags=datapath.ofproto.OFPFF_SEND_FLOW_REM, cookie=cookie)
+        if mod is None:
+            return evicted
+        datapath.send_msg(mod)
+        self._track(datapath.id, ReactiveEntry(cookie, mod.table_id, mod.priority, mod.match, time.time()))
+        self.installs += 1
+        return evicted
+
+    # An entry replacing one with the same match replaces it in the view as well
+    def _track(self, dpid, entry):
+        entries = self.entries.setdefault(dpid, {})
+        key = _match_key(entry.table_id, entry.priority, entry.match)
+        old_cookie = self.cookies.setdefault(dpid, {}).get(key)
+        if old_cookie is not None:
+            entries.pop(old_cookie, None)
+        entries[entry.cookie] = entry
+        self.cookies[dpid][key] = entry.cookie
+
+    def _untrack(self, dpid, cookie):
+        entry = self.entries.get(dpid, {}).pop(cookie, None)
+        if entry is not None:
+            self.cookies[dpid].pop(_match_key(entry.table_id, entry.priority, entry.match), None)
+        return entry
+
+    # Evicts the least recently hit reactive entries of a switch above HIGH_WATER of its `table_capacity`
+    def make_room(self, app, datapath):
+        node = str(datapath.id)
+        capacity = app.topo.nodes[node].get('table_capacity') if app.topo is not None and node in app.topo else None
+        if capacity is None:
+            return 0
+        occupancy = self.occupancy(datapath.id) + 1
+        if occupancy <= capacity * HIGH_WATER:
+            return 0
+        count = occupancy - int(capacity * LOW_WATER)
+        # Entries last hit in the same poll are evicted by their packet count
+        entries = sorted(self.entries.get(datapath.id, {}).values(),
+                         key=lambda e: (e.last_hit, e.packet_count, e.installed))
+        for entry in entries[:count]:
+            self.delete(datapath, entry)
+        self.evictions += min(count, len(entries))
+        return min(count, len(entries))
+
+    def delete(self, datapath, entry):
+        ofp = datapath.ofproto
+        ofp_parser = datapath.ofproto_parser
+        self._untrack(datapath.id, entry.cookie)
+        mod = ofp_parser.OFPFlowMod(datapath=datapath, cookie=entry.cookie, cookie_mask=COOKIE_MASK,
+                                    table_id=entry.table_id, command=ofp.OFPFC_DELETE_STRICT,
+                                    priority=entry.priority, out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY,
+                                    match=entry.match)
+        datapath.send_msg(mod)
+
+    # Deletes all the reactive entries of a switch, e.g., when the topology changes under them
+    def flush(self, datapath):
+        ofp = datapath.ofproto
+        ofp_parser = datapath.ofproto_parser
+        self.entries.pop(datapath.id, None)
+        self.cookies.pop(datapath.id, None)
+        mod = ofp_parser.OFPFlowMod(datapath=datapath, cookie=REACTIVE_COOKIE, cookie_mask=REACTIVE_COOKIE,
+                                    table_id=ofp.OFPTT_ALL, command=ofp.OFPFC_DELETE,
+                                    out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY, match=ofp_parser.OFPMatch())
+        datapath.send_msg(mod)
+
+    # A reactive entry expired or was deleted; returns True if it was in the view
+    def on_flow_removed(self, dpid, cookie):
+        if not is_reactive(cookie) or self._untrack(dpid, cookie) is None:
+            return False
+        self.removals += 1
+        return True
+
+    def request_stats(self, datapath):
+        """ Requests the counters of the reactive entries of `datapath`
+        """
+        ofp = datapath.ofproto
+        msg = datapath.ofproto_parser.OFPFlowStatsRequest(datapath, 0, ofp.OFPTT_ALL, ofp.OFPP_ANY, ofp.OFPG_ANY,
+                                                          REACTIVE_COOKIE, REACTIVE_COOKIE)
+        datapath.set_xid(msg)
+        self.polls[datapath.id] = (msg.xid, time.time(), set())
+        datapath.send_msg(msg)
+
+    def on_flow_stats(self, dpid, xid, body, more=False):
+        """ Updates the view of a switch with a reply to `request_stats`
+        The entries installed before the request and missing from the complete reply were removed
+        without a FlowRemoved (e.g., it was lost), and are dropped from the view
+
+        Returns:
+            True if the reply answers `request_stats`
+        """
+        poll = self.polls.get(dpid)
+        if poll is None or poll[0] != xid:
+            return False
+        _xid, requested, seen = poll
+        now = time.time()
+        entries = self.entries.get(dpid, {})
+        for stats in body:
+            seen.add(stats.cookie)
+            entry = entries.get(stats.cookie)
+            if entry is not None and stats.packet_count > entry.packet_count:
+                entry.packet_count = stats.packet_count
+                entry.last_hit = now
+        if not more:
+            del self.polls[dpid]
+            for cookie in [cookie for cookie, entry in entries.items()
+                           if cookie not in seen and entry.installed < requested]:
+                self._untrack(dpid, cookie)
+        return True
+
+    # Takes the reactive entries of the flow `stats` of a switch into the view, e.g., after a warm restart
+    def adopt(self, dpid, stats):
+        now = time.time()
+        for flow in stats:
+            if is_reactive(flow.cookie):
+                self._track(dpid, ReactiveEntry(flow.cookie, flow.table_id, flow.priority, flow.match, now,
+                                                flow.packet_count))
+                self.next_cookie = max(self.next_cookie, (flow.cookie & ~REACTIVE_COOKIE) + 1)
@@ -0,0 +1,68 @@
+"""
+A cache of serialized FlowMod messages, so re-installing an identical rule skips building and encoding it again.
+"""
+import struct
+from collections import OrderedDict
+
+# The xid is the last field of the OpenFlow header: version (B), type (B), length (H), xid (I)
+XID_OFFSET = 4
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+
+class FlowModCache:
+    """
+    Maps a canonical rule key to the serialized bytes of its FlowMod.
+    The key must hold everything that is encoded in the FlowMod (OpenFlow version, table, priority, match, actions),
+    so a changed rule gets a new key and never reuses a stale encoding.
+    The cache holds at most `max_bytes` of encodings; the least recently used entries are evicted first.
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # key -> bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        buf = self.entries.get(key)
+        if buf is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return buf
+
+    def put(self, key, msg):
+        """ Serializes `msg` (with xid 0) and stores its bytes under `key`
+
+        Returns:
+            The serialized bytes
+        """
+        if msg.xid is None:
+            msg.set_xid(0)
+        msg.serialize()
+        buf = bytes(msg.buf)
+        self.invalidate(key)
+        self.entries[key] = buf
+        self.size += len(buf)
+        while self.size > self.max_bytes and self.entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+        return buf
+
+    def invalidate(self, key):
+        buf = self.entries.pop(key, None)
+        if buf is not None:
+            self.size -= len(buf)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def send(self, datapath, buf):
+        """ Sends a copy of the cached `buf` to `datapath` with the next xid of the datapath patched in
+        """
+        datapath.xid = (datapath.xid + 1) & datapath.ofproto.MAX_XID
+        msg = bytearray(buf)
+        struct.pack_into('!I', msg, XID_OFFSET, datapath.xid)
+        datapath.send(bytes(msg))
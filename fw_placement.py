@@ -0,0 +1,166 @@
+"""
+Places switch-agnostic firewall rules in a topology, with as few entries as possible within the switches'
+table capacities.
+
+Every switch has a host on port 1 (see utils_ports.py), so the traffic of the hosts enters the network at every
+switch. A rule matching the traffic of one host (by its `src_ip` or `dst_ip`) is placed once, at that host's
+switch, which is on the path of all that traffic. A rule matching the traffic of all the hosts is placed at
+a vertex cover of the links: any path between two hosts crosses a link, so it crosses a switch of the cover.
+"""
+from rule import ActionType, MatchPattern, Rule
+from utils_net import mn_get_host_ip
+
+MATCH_FIELDS = ('src_mac', 'dst_mac', 'mac_proto', 'ip_proto', 'src_ip', 'dst_ip', 'src_port', 'dst_port', 'in_port')
+
+
+class Placement:
+    """
+    The result of `place_firewall_rules`:
+    `rules` are the placed (switch-specific) rules,
+    `entries_per_switch` maps a switch id to its number of placed rules,
+    `replicated` lists (rule, list of switch ids) for the host rules replicated at the neighbours of a full switch,
+    `unplaced` lists the rules that did not fit: the policy is not enforced for them.
+    """
+    def __init__(self):
+        self.rules = []
+        self.entries_per_switch = {}
+        self.replicated = []
+        self.unplaced = []
+
+    def add(self, rule):
+        self.rules.append(rule)
+        self.entries_per_switch[rule.switch_id] = self.entries_per_switch.get(rule.switch_id, 0) + 1
+
+    # True if every rule of the policy is placed
+    def complete(self):
+        return not self.unplaced
+
+    def __str__(self):
+        return 'Placement: %d entries on %d switches, %d rules replicated, %d unplaced' % (
+            len(self.rules), len(self.entries_per_switch), len(self.replicated), len(self.unplaced))
+
+
+def covers(broad, narrow):
+    """ Returns True if every pkt matching the `narrow` pattern matches the `broad` pattern
+    """
+    return all(getattr(broad, field) is None or getattr(broad, field) == getattr(narrow, field)
+               for field in MATCH_FIELDS)
+
+
+def remove_redundant_rules(rules):
+    """ Removes duplicated rules, and DROP rules covered by another DROP rule
+    """
+    unique = {}
+    for rule in rules:
+        unique.setdefault((rule.match_pattern.key(), rule.action.key()), rule)
+    rules = list(unique.values())
+    drops = [rule for rule in rules if rule.action.action_type == ActionType.DROP]
+    return [rule for rule in rules
+            if rule.action.action_type != ActionType.DROP or
+            not any(other is not rule and covers(other.match_pattern, rule.match_pattern) for other in drops)]
+
+
+def place_firewall_rules(graph, rules, reserved=None):
+    """ Places switch-agnostic firewall `rules` (their `switch_id` is None) in `graph`
+
+    Duplicated and covered rules are removed first. The rules matching the traffic of one host come next,
+    as they need a single entry: a rule is placed at the switch of its `src_ip` host, else of its `dst_ip` host.
+    If both are full, the rule is replicated at all the neighbours of one of them, which carry all the traffic
+    of its host. The rules matching the traffic of all the hosts are placed last, at a vertex cover of the links.
+    A switch holds at most its `table_capacity` node attribute (unlimited if absent) minus `reserved` entries.
+    A rule that does not fit is reported in the `unplaced` rules of the placement, and has no entry at all.
+
+    Args:
+        graph (Graph): the topology
+        rules (list): the switch-agnostic Rule objects
+        reserved (dict): switch id -> entries already used by other rules
+
+    Returns:
+        A Placement
+    """
+    reserved = reserved or {}
+    free = {}
+    for node, capacity in graph.nodes(data='table_capacity'):
+        if capacity is not None:
+            free[node] = int(capacity) - reserved.get(int(node), 0)
+    host_switches = {mn_get_host_ip(node): node for node in graph.nodes()}
+
+    host_rules = []
+    network_rules = []
+    for rule in remove_redundant_rules(rules):
+        hosts = [host_switches[ip] for ip in (rule.match_pattern.src_ip, rule.match_pattern.dst_ip)
+                 if ip in host_switches]
+        if hosts:
+            host_rules.append((rule, hosts))
+        else:
+            network_rules.append(rule)
+
+    placement = Placement()
+    for rule, hosts in host_rules:
+        switches = _host_switches(graph, free, hosts)
+        if switches is None:
+            placement.unplaced.append(rule)
+            continue
+        if switches != hosts[:1] and switches != hosts[1:2]:
+            placement.replicated.append((rule, [int(switch) for switch in switches]))
+        for switch in switches:
+            _place(placement, free, switch, rule)
+    for rule in network_rules:
+        switches = _cover(graph, free)
+        if switches is None:
+            placement.unplaced.append(rule)
+            continue
+        for switch in switches:
+            _place(placement, free, switch, rule)
+    return placement
+
+
+def _fits(free, switch):
+    return free.get(switch, 1) > 0
+
+
+# The switches holding a rule of the traffic of the host switches `hosts`: one of them, else all the neighbours
+# of one of them; None if none of these fit
+def _host_switches(graph, free, hosts):
+    for host in hosts:
+        if _fits(free, host):
+            return [host]
+    for neighbors in sorted((sorted(graph.neighbors(host), key=int) for host in hosts), key=len):
+        if all(_fits(free, switch) for switch in neighbors):
+            return neighbors
+    return None
+
+
+# A vertex cover of the links of `graph` with free entries, None if a link joins two full switches
+# The switches covering the most links are picked first; the picks whose neighbours all ended up in the cover
+# are dropped again (e.g., the core switches of a fat tree, once its aggregation switches are picked)
+def _cover(graph, free):
+    forced = set()
+    for u, v in graph.edges():
+        if not _fits(free, u) and not _fits(free, v):
+            return None
+        if not _fits(free, u):
+            forced.add(v)
+        elif not _fits(free, v):
+            forced.add(u)
+    cover = set(forced)
+    remaining = [(u, v) for u, v in graph.edges() if u not in cover and v not in cover]
+    while remaining:
+        degrees = {}
+        for u, v in remaining:
+            degrees[u] = degrees.get(u, 0) + 1
+            degrees[v] = degrees.get(v, 0) + 1
+        switch = max(degrees, key=lambda n: (degrees[n], free.get(n, float('inf')), -int(n)))
+        cover.add(switch)
+        remaining = [(u, v) for u, v in remaining if switch not in (u, v)]
+    for switch in sorted(cover - forced, key=int):
+        if all(neighbor in cover for neighbor in graph.neighbors(switch)):
+            cover.discard(switch)
+    return sorted(cover, key=int)
+
+
+def _place(placement, free, switch, rule):
+    if switch in free:
+        free[switch] -= 1
+    pattern = MatchPattern(**rule.match_pattern.__dict__)
+    placement.add(Rule(switch_id=int(switch), match_pattern=pattern, action=rule.action))
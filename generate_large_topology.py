@@ -0,0 +1,204 @@
+"""
+Generates large synthetic topologies in the same graphml schema as `isp.graphml`
+"""
+import argparse
+import math
+import random
+
+import networkx as nx
+
+# A node *may* have the following attributes:
+#   udp_server and udp_port to create a UDP server
+#   tcp_server and tcp_port to create a TCP server
+
+# An edge *must* have the following attributes:
+#   bw: link bandwidth (in Mbps)
+#   delay: link delay in milliseconds
+
+# Mininet's TCLink does not accept bandwidths above 1000 Mbps
+MAX_BW = 1000
+
+
+def fat_tree(k):
+    """ Creates a k-ary fat-tree topology
+
+    Args:
+        k (int): number of ports per switch, an even number >= 2
+
+    Returns:
+        A networkx Graph with (k/2)^2 core switches and k pods of k/2 aggregation and k/2 edge switches
+    """
+    assert k >= 2 and k % 2 == 0
+    half = k // 2
+    graph = nx.Graph()
+    node_ids = iter(range(1, 5 * half * half + 1))
+    core = [next(node_ids) for _ in range(half * half)]
+    for _ in range(k):
+        aggs = [next(node_ids) for _ in range(half)]
+        edges = [next(node_ids) for _ in range(half)]
+        for i, agg in enumerate(aggs):
+            for edge in edges:
+                graph.add_edge(agg, edge, delay=1, bw=MAX_BW)
+            for core_sw in core[i * half:(i + 1) * half]:
+                graph.add_edge(core_sw, agg, delay=2, bw=MAX_BW)
+    return graph
+
+
+def leaf_spine(spines, leaves):
+    """ Creates a two-tier leaf-spine topology, every leaf is connected to every spine
+
+    Args:
+        spines (int): number of spine switches
+        leaves (int): number of leaf switches
+
+    Returns:
+        A networkx Graph with switches 1..spines as spines and the rest as leaves
+    """
+    assert spines > 0 and leaves > 0
+    graph = nx.Graph()
+    for spine in range(1, spines + 1):
+        for leaf in range(spines + 1, spines + leaves + 1):
+            graph.add_edge(spine, leaf, delay=1, bw=MAX_BW)
+    return graph
+
+
+def isp_like(n, radius=None, seed=None):
+    """ Creates an ISP-like topology from a random geometric graph
+
+    Nodes are placed in a unit square (a 2000km x 2000km region), and nodes closer than `radius` are linked.
+    The link delay is the propagation delay of its length; short links get more bandwidth.
+    Disconnected components are joined through their closest pair of nodes.
+
+    Args:
+        n (int): number of switches
+        radius (float): link distance threshold, defaults to the connectivity threshold of a random geometric graph
+        seed (int): random seed
+
+    Returns:
+        A connected networkx Graph with switches 1..n
+    """
+    assert n > 0
+    if radius is None:
+        radius = min(1.0, math.sqrt(2.0 * math.log(n + 1) / (math.pi * n)))
+    rgg = nx.random_geometric_graph(n, radius, seed=seed)
+    pos = nx.get_node_attributes(rgg, 'pos')
+
+    def distance(u, v):
+        return math.dist(pos[u], pos[v])
+
+    components = [list(c) for c in nx.connected_components(rgg)]
+    for comp, next_comp in zip(components, components[1:]):
+        u, v = min(((u, v) for u in comp for v in next_comp), key=lambda uv: distance(*uv))
+        rgg.add_edge(u, v)
+
+    graph = nx.Graph()
+    graph.add_nodes_from(node + 1 for node in rgg.nodes())
+    for u, v in rgg.edges():
+        # 2000km per unit at ~200km/ms in fiber
+        delay = max(1, int(round(distance(u, v) * 10)))
+        bw = 1000 if delay <= 2 else (100 if delay <= 5 else 10)
+        graph.add_edge(u + 1, v + 1, delay=delay, bw=bw)
+    return graph
+
+
+def scale_free(n, m=2, seed=None):
+    """ Creates a scale-free topology using the Barabasi-Albert preferential attachment model
+
+    Links between high-degree hubs get more bandwidth and lower delays than the links at the periphery.
+
+    Args:
+        n (int): number of switches
+        m (int): number of links of every newly attached switch
+        seed (int): random seed
+
+    Returns:
+        A connected networkx Graph with switches 1..n
+    """
+    assert n > m >= 1
+    ba = nx.barabasi_albert_graph(n, m, seed=seed)
+    rng = random.Random(seed)
+    graph = nx.Graph()
+    graph.add_nodes_from(node + 1 for node in ba.nodes())
+    for u, v in ba.edges():
+        hub_degree = min(ba.degree(u), ba.degree(v))
+        bw = 1000 if hub_degree > 2 * m else (100 if hub_degree > m else 10)
+        delay = rng.randint(1, 5) if hub_degree > m else rng.randint(5, 20)
+        graph.add_edge(u + 1, v + 1, delay=delay, bw=bw)
+    return graph
+
+
+def annotate_servers(graph, tcp_fraction=0.1, udp_fraction=0.1, seed=None):
+    """ Marks a random subset of hosts as TCP and UDP servers
+
+    Args:
+        graph (Graph): a graph created by one of the generators
+        tcp_fraction (float): fraction of hosts running a TCP server
+        udp_fraction (float): fraction of hosts running a UDP server
+        seed (int): random seed
+
+    Returns:
+        The annotated graph
+    """
+    rng = random.Random(seed)
+    nodes = sorted(graph.nodes())
+    for node in rng.sample(nodes, int(len(nodes) * tcp_fraction)):
+        graph.nodes[node]['tcp_server'] = True
+        graph.nodes[node]['tcp_port'] = rng.choice([80, 443, 5050])
+    for node in rng.sample(nodes, int(len(nodes) * udp_fraction)):
+        graph.nodes[node]['udp_server'] = True
+        graph.nodes[node]['udp_port'] = rng.choice([53, 5050, 8080])
+    return graph
+
+
+def annotate_table_capacity(graph, capacity):
+    """ Sets the flow table capacity (number of entries) of every switch, as the node attribute `table_capacity`
+    """
+    for node in graph.nodes():
+        graph.nodes[node]['table_capacity'] = capacity
+    return graph
+
+
+GENERATORS = {
+    'fat_tree': lambda args: fat_tree(args.k),
+    'leaf_spine': lambda args: leaf_spine(args.spines, args.leaves),
+    'isp': lambda args: isp_like(args.n, seed=args.seed),
+    'scale_free': lambda args: scale_free(args.n, args.m, seed=args.seed),
+}
+
+
+def generate_topology(kind, k=4, spines=4, leaves=16, n=100, m=2, seed=None, table_capacity=None):
+    """ Creates and annotates a topology of the given `kind`
+
+    Args:
+        kind (str): one of the keys of GENERATORS
+        k, spines, leaves, n, m (int): the generator parameters
+        seed (int): random seed
+        table_capacity (int): flow table capacity of every switch, unlimited if None
+
+    Returns:
+        A networkx Graph
+    """
+    args = argparse.Namespace(k=k, spines=spines, leaves=leaves, n=n, m=m, seed=seed)
+    graph = GENERATORS[kind](args)
+    if table_capacity is not None:
+        annotate_table_capacity(graph, table_capacity)
+    return annotate_servers(graph, seed=seed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generates a large topology graphml file')
+    parser.add_argument('kind', choices=sorted(GENERATORS))
+    parser.add_argument('output', help='path of the graphml file')
+    parser.add_argument('--k', type=int, default=4, help='fat_tree: number of ports per switch')
+    parser.add_argument('--spines', type=int, default=4, help='leaf_spine: number of spine switches')
+    parser.add_argument('--leaves', type=int, default=16, help='leaf_spine: number of leaf switches')
+    parser.add_argument('--n', type=int, default=100, help='isp/scale_free: number of switches')
+    parser.add_argument('--m', type=int, default=2, help='scale_free: links per attached switch')
+    parser.add_argument('--seed', type=int, default=471)
+    parser.add_argument('--table-capacity', type=int, help='flow table capacity of every switch')
+    args = parser.parse_args()
+
+    graph = generate_topology(args.kind, args.k, args.spines, args.leaves, args.n, args.m, seed=args.seed,
+                              table_capacity=args.table_capacity)
+    nx.write_graphml(graph, args.output)
+    print('%s: %d switches, %d links -> %s' % (args.kind, graph.number_of_nodes(), graph.number_of_edges(), args.output))
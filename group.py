@@ -0,0 +1,70 @@
+from enum import Enum
+
+
+class GroupType(str, Enum):
+    FAST_FAILOVER = 'FAST_FAILOVER'
+    SELECT = 'SELECT'
+
+
+class Bucket:
+    """
+    A group bucket forwarding pkts to `out_port`.
+    In a FAST_FAILOVER group, the bucket is live as long as `watch_port` is up.
+    In a SELECT group, pkts are spread over the buckets in proportion to their `weight`.
+    """
+    def __init__(self, out_port, watch_port=None, weight=0):
+        self.out_port = out_port
+        self.watch_port = watch_port
+        self.weight = weight
+
+    # A hashable key identifying the bucket
+    def key(self):
+        return (self.out_port, self.watch_port, self.weight)
+
+    def __str__(self):
+        if self.watch_port:
+            return 'OutPort=%d (watch %d)' % (self.out_port, self.watch_port)
+        if self.weight:
+            return 'OutPort=%d (weight %d)' % (self.out_port, self.weight)
+        return 'OutPort=%d' % self.out_port
+
+
+class Group:
+    """
+    A Group object represents an OpenFlow group `group_id` at switch `switch_id`.
+    Rules use it through an Action of type GROUP.
+    For a FAST_FAILOVER group, the first live bucket (in order) is used.
+    """
+    def __init__(self, switch_id, group_id, group_type, buckets):
+        self.switch_id = switch_id
+        self.group_id = group_id
+        self.group_type = group_type
+        self.buckets = buckets
+
+    def __str__(self):
+        buckets = ', '.join(str(bucket) for bucket in self.buckets)
+        return 'Switch: %s\n\r\tGroup: %d, %s\n\r\tBuckets: %s' % (self.switch_id, self.group_id, self.group_type, buckets)
+
+
+class GroupIdAllocator:
+    """
+    Allocates group ids per switch.
+    Identical groups (same type and buckets) at a switch share one group id,
+    so destinations with the same next hops use a single group table entry.
+    One allocator should be shared by all the apps of a controller to avoid id collisions.
+    The ids start at `first_id`, e.g., to give the instances of a sharded controller distinct ranges.
+    """
+    def __init__(self, first_id=1):
+        self.first_id = first_id
+        self.next_ids = {} # switch id -> next free group id
+        self.groups = {} # (switch id, group type, bucket keys) -> Group
+
+    def get_group(self, switch_id, group_type, buckets):
+        key = (switch_id, group_type, tuple(bucket.key() for bucket in buckets))
+        group = self.groups.get(key)
+        if group is None:
+            group_id = self.next_ids.get(switch_id, self.first_id)
+            self.next_ids[switch_id] = group_id + 1
+            group = Group(switch_id, group_id, group_type, buckets)
+            self.groups[key] = group
+        return group
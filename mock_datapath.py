@@ -0,0 +1,992 @@
+"""
+An in-process fake OpenFlow 1.3 datapath/switch layer to measure rule installation without Mininet.
+
+`FakeDatapath` looks like a Ryu datapath to the controller and the apps (`id`, `ofproto`, `ofproto_parser`,
+`send_msg`), and serializes every message with Ryu's `ofproto_v1_3_parser`.
+`FakeSwitch` parses the bytes back, keeps flow and group tables, and answers barrier, flow stats
+and group description requests. Entries flagged with OFPFF_SEND_FLOW_REM are reported in FlowRemoved messages
+when they are deleted or expire (see `FakeSwitch.expire`).
+The bytes either go to the switch directly, or loop back over local TCP sockets through a `FakeFabric`
+with a configurable one-way latency.
+`measure_sharding` runs the instances of a sharded controller (see sharding.py) in separate processes.
+"""
+import argparse
+import heapq
+import itertools
+import multiprocessing
+import os
+import random
+import selectors
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+import networkx as nx
+
+from ryu.ofproto import ofproto_common
+from ryu.ofproto import ofproto_parser
+from ryu.ofproto import ofproto_v1_3
+from ryu.ofproto import ofproto_v1_3_parser
+
+from app_l2 import L2ConnectivityApp
+from bench_apps import TOPOLOGIES
+from flow_lifecycle import ReactiveFlows
+from flowmod_cache import FlowModCache
+from group import GroupIdAllocator
+from generate_large_topology import generate_topology
+from sharding import Shard
+from utils_net import mn_get_host_mac
+from utils_ports import get_neighbor_for_port
+from snapshot import SNAPSHOT_FORMAT, Reconciliation, dump_snapshot, parse_snapshot, request_tables, restore_app
+from snapshot import save_app
+from start_controller import SDNController
+
+OFP_HEADER_SIZE = ofproto_common.OFP_HEADER_SIZE
+
+
+class FlowEntry:
+    """
+    An entry in the flow table of a `FakeSwitch`
+    """
+    def __init__(self, flow_mod):
+        self.table_id = flow_mod.table_id
+        self.priority = flow_mod.priority
+        self.match = flow_mod.match
+        self.instructions = flow_mod.instructions
+        self.cookie = flow_mod.cookie
+        self.idle_timeout = flow_mod.idle_timeout
+        self.hard_timeout = flow_mod.hard_timeout
+        self.flags = flow_mod.flags
+        self.packet_count = 0
+        self.byte_count = 0
+        self.install_time = time.time()
+        self.last_used = self.install_time
+
+    def match_fields(self):
+        return dict(self.match.items())
+
+
+def match_key(match):
+    return tuple(sorted(match.items()))
+
+
+class FakeSwitch:
+    """
+    The switch side of a fake datapath.
+    It parses the serialized OpenFlow messages, applies FlowMods and GroupMods to its tables,
+    and returns the replies to barrier, flow stats and group description requests.
+    """
+    ofproto = ofproto_v1_3
+    ofproto_parser = ofproto_v1_3_parser
+
+    # A switch with a `capacity` rejects the new entries of a full flow table
+    def __init__(self, dpid, capacity=None):
+        self.id = dpid
+        self.capacity = capacity
+        self.flow_table = {} # (table_id, priority, match_key) -> FlowEntry
+        self.group_table = {} # group_id -> (group type, list of OFPBucket)
+        self.rejected = 0
+        self.flow_mods = 0
+        self.barriers = 0
+        self.connections = 0
+
+    def handle(self, buf):
+        """ Handles one serialized OpenFlow message
+
+        Args:
+            buf (bytes): the message, starting with its OpenFlow header
+
+        Returns:
+            A list of reply messages (Ryu parser objects) with their xid set
+        """
+        version, msg_type, msg_len, xid = ofproto_parser.header(buf)
+        ofp = self.ofproto
+        if msg_type == ofp.OFPT_FLOW_MOD:
+            msg = ofproto_parser.msg(self, version, msg_type, msg_len, xid, buf)
+            return self.apply_flow_mod(msg)
+        if msg_type == ofp.OFPT_GROUP_MOD:
+            self.apply_group_mod(buf)
+            return []
+        if msg_type == ofp.OFPT_BARRIER_REQUEST:
+            self.barriers += 1
+            reply = self.ofproto_parser.OFPBarrierReply(self)
+        elif msg_type == ofp.OFPT_MULTIPART_REQUEST:
+            reply = self.handle_multipart(buf)
+        else:
+            return []
+        if reply is None:
+            return []
+        reply.xid = xid
+        return [reply]
+
+    def handle_multipart(self, buf):
+        ofp = self.ofproto
+        stats_type, _flags = struct.unpack_from(ofp.OFP_MULTIPART_REQUEST_PACK_STR, buf, OFP_HEADER_SIZE)
+        if stats_type == ofp.OFPMP_GROUP_DESC:
+            return self.ofproto_parser.OFPGroupDescStatsReply(self, flags=0, body=self.group_descs())
+        if stats_type != ofp.OFPMP_FLOW:
+            return None
+        table_id = struct.unpack_from('!B', buf, ofp.OFP_MULTIPART_REQUEST_SIZE)[0]
+        return self.ofproto_parser.OFPFlowStatsReply(self, flags=0, body=self.flow_stats(table_id))
+
+    def flow_stats(self, table_id):
+        now = time.time()
+        stats = []
+        for entry in self.flow_table.values():
+            if table_id not in (self.ofproto.OFPTT_ALL, entry.table_id):
+                continue
+            duration = now - entry.install_time
+            stats.append(self.ofproto_parser.OFPFlowStats(
+                table_id=entry.table_id, duration_sec=int(duration),
+                duration_nsec=int((duration % 1) * 1e9), priority=entry.priority,
+                idle_timeout=entry.idle_timeout, hard_timeout=entry.hard_timeout,
+                flags=entry.flags, cookie=entry.cookie, packet_count=entry.packet_count,
+                byte_count=entry.byte_count, match=entry.match, instructions=entry.instructions))
+        return stats
+
+    def group_descs(self):
+        return [self.ofproto_parser.OFPGroupDescStats(group_type, group_id, buckets)
+                for group_id, (group_type, buckets) in self.group_table.items()]
+
+    # Returns the FlowRemoved messages of the deleted entries
+    def apply_flow_mod(self, msg):
+        ofp = self.ofproto
+        self.flow_mods += 1
+        key = (msg.table_id, msg.priority, match_key(msg.match))
+        if msg.command in (ofp.OFPFC_ADD, ofp.OFPFC_MODIFY, ofp.OFPFC_MODIFY_STRICT):
+            if self.capacity is not None and key not in self.flow_table and len(self.flow_table) >= self.capacity:
+                self.rejected += 1
+                return []
+            self.flow_table[key] = FlowEntry(msg)
+            return []
+        removed = []
+        if msg.command == ofp.OFPFC_DELETE_STRICT:
+            entry = self.flow_table.get(key)
+            if entry is not None and (entry.cookie & msg.cookie_mask) == (msg.cookie & msg.cookie_mask):
+                removed.append(key)
+        elif msg.command == ofp.OFPFC_DELETE:
+            fields = dict(msg.match.items())
+            for entry_key, entry in self.flow_table.items():
+                if msg.table_id not in (ofp.OFPTT_ALL, entry.table_id):
+                    continue
+                if (entry.cookie & msg.cookie_mask) != (msg.cookie & msg.cookie_mask):
+                    continue
+                entry_fields = entry.match_fields()
+                if all(entry_fields.get(name) == value for name, value in fields.items()):
+                    removed.append(entry_key)
+        return [msg for msg in (self.remove(key, ofp.OFPRR_DELETE) for key in removed) if msg is not None]
+
+    # Removes an entry; returns its FlowRemoved message if it has the OFPFF_SEND_FLOW_REM flag
+    def remove(self, key, reason):
+        entry = self.flow_table.pop(key)
+        if not entry.flags & self.ofproto.OFPFF_SEND_FLOW_REM:
+            return None
+        duration = time.time() - entry.install_time
+        msg = self.ofproto_parser.OFPFlowRemoved(
+            self, cookie=entry.cookie, priority=entry.priority, reason=reason, table_id=entry.table_id,
+            duration_sec=int(duration), duration_nsec=int((duration % 1) * 1e9), idle_timeout=entry.idle_timeout,
+            hard_timeout=entry.hard_timeout, packet_count=entry.packet_count, byte_count=entry.byte_count,
+            match=entry.match)
+        msg.xid = 0
+        return msg
+
+    # Counts a pkt of `size` bytes on the entry `key`
+    def hit(self, key, size=64, now=None):
+        entry = self.flow_table[key]
+        entry.packet_count += 1
+        entry.byte_count += size
+        entry.last_used = time.time() if now is None else now
+
+    # Removes the entries idle for their `idle_timeout` at the time `now`; returns their FlowRemoved messages
+    def expire(self, now=None):
+        now = time.time() if now is None else now
+        expired = [key for key, entry in self.flow_table.items()
+                   if entry.idle_timeout and now - entry.last_used >= entry.idle_timeout]
+        return [msg for msg in (self.remove(key, self.ofproto.OFPRR_IDLE_TIMEOUT) for key in expired)
+                if msg is not None]
+
+    # Ryu has no parser for OFPGroupMod, so its fixed fields are unpacked here, and its buckets by OFPBucket
+    def apply_group_mod(self, buf):
+        ofp = self.ofproto
+        msg_len = struct.unpack_from('!H', buf, 2)[0]
+        command, group_type, group_id = struct.unpack_from(ofp.OFP_GROUP_MOD_PACK_STR, buf, OFP_HEADER_SIZE)
+        if command == ofp.OFPGC_DELETE:
+            if group_id == ofp.OFPG_ALL:
+                self.group_table = {}
+            else:
+                self.group_table.pop(group_id, None)
+            return
+        buckets = []
+        offset = ofp.OFP_GROUP_MOD_SIZE
+        while offset < msg_len:
+            bucket = self.ofproto_parser.OFPBucket.parser(buf, offset)
+            buckets.append(bucket)
+            offset += bucket.len
+        self.group_table[group_id] = (group_type, buckets)
+
+    def clear(self):
+        self.flow_table = {}
+        self.group_table = {}
+
+
+class FakeDatapath:
+    """
+    The controller side of a fake datapath. It can be registered in `of_controller.datapaths`.
+    Messages are serialized with Ryu's parser and handled by `switch`,
+    directly (in-process) or through the `fabric` sockets if the datapath is connected to one.
+    Every reply is passed to `on_reply(datapath, msg)`.
+    """
+    def __init__(self, dpid, switch=None, on_reply=None):
+        self.id = dpid
+        self.ofproto = ofproto_v1_3
+        self.ofproto_parser = ofproto_v1_3_parser
+        self.xid = 0
+        self.switch = switch or FakeSwitch(dpid)
+        self.on_reply = on_reply
+        self.fabric = None
+        self.sock = None
+        self.is_active = True
+        self.msgs_sent = 0
+        self.bytes_sent = 0
+        self.mods_sent = 0 # FlowMods and GroupMods
+
+    def set_xid(self, msg):
+        self.xid += 1
+        self.xid &= self.ofproto.MAX_XID
+        msg.set_xid(self.xid)
+        return self.xid
+
+    def send_msg(self, msg):
+        assert isinstance(msg, self.ofproto_parser.MsgBase)
+        if msg.xid is None:
+            self.set_xid(msg)
+        msg.serialize()
+        self.send(msg.buf)
+
+    def send(self, buf):
+        self.msgs_sent += 1
+        self.bytes_sent += len(buf)
+        # The message type is the second byte of the OpenFlow header
+        if buf[1] in (self.ofproto.OFPT_FLOW_MOD, self.ofproto.OFPT_GROUP_MOD):
+            self.mods_sent += 1
+        if self.sock is not None:
+            self.sock.sendall(buf)
+        else:
+            for reply in self.switch.handle(buf):
+                self.deliver(reply)
+
+    def deliver(self, reply):
+        if self.on_reply:
+            self.on_reply(self, reply)
+
+    def send_barrier(self):
+        msg = self.ofproto_parser.OFPBarrierRequest(self)
+        self.send_msg(msg)
+        return msg.xid
+
+    def request_flow_stats(self, table_id=None):
+        ofp = self.ofproto
+        table_id = ofp.OFPTT_ALL if table_id is None else table_id
+        msg = self.ofproto_parser.OFPFlowStatsRequest(self, 0, table_id, ofp.OFPP_ANY, ofp.OFPG_ANY)
+        self.send_msg(msg)
+        return msg.xid
+
+
+class FakeFabric:
+    """
+    Connects fake datapaths to their fake switches over local TCP sockets.
+    One thread serves the switch side of every connection and delays each message by `latency` seconds,
+    and one thread reads the replies on the controller side, so thousands of switches fit in one process.
+    The switch side answers with the reply headers only; the parsed replies are handed over in memory.
+    """
+    def __init__(self, latency=0.0, clear_on_reconnect=False):
+        self.latency = latency
+        self.clear_on_reconnect = clear_on_reconnect
+        self.datapaths = {} # dpid -> FakeDatapath
+        self.replies = {} # (dpid, xid) -> reply
+        self.pending = [] # heap of (due_time, seq, conn, switch, buf)
+        self.seq = itertools.count()
+        self.running = True
+
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(socket.SOMAXCONN)
+        self.address = self.listener.getsockname()
+        self.switch_sel = selectors.DefaultSelector()
+        self.switch_sel.register(self.listener, selectors.EVENT_READ, None)
+
+        # Datapath sockets are (un)registered by the reader thread itself, it is woken up through `wakeup_w`
+        self.dp_sel = selectors.DefaultSelector()
+        self.dp_changes = []
+        self.wakeup_r, self.wakeup_w = socket.socketpair()
+        self.dp_sel.register(self.wakeup_r, selectors.EVENT_READ, None)
+
+        self.switch_thread = threading.Thread(target=self._serve_switches, daemon=True)
+        self.dp_thread = threading.Thread(target=self._serve_datapaths, daemon=True)
+        self.switch_thread.start()
+        self.dp_thread.start()
+
+    def add_datapath(self, datapath):
+        self.datapaths[datapath.id] = datapath
+        datapath.fabric = self
+        self.connect(datapath)
+
+    def connect(self, datapath):
+        sock = socket.create_connection(self.address)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # The switch side learns the dpid from the first 8 bytes, as it would from the features reply
+        sock.sendall(struct.pack('!Q', datapath.id))
+        datapath.sock = sock
+        datapath.is_active = True
+        self._change_dp_sel('register', sock, datapath)
+
+    def disconnect(self, datapath):
+        sock = datapath.sock
+        datapath.sock = None
+        datapath.is_active = False
+        sock.shutdown(socket.SHUT_RDWR)
+        self._change_dp_sel('unregister', sock, datapath)
+
+    def reconnect(self, datapath):
+        self.disconnect(datapath)
+        self.connect(datapath)
+
+    def close(self):
+        for datapath in list(self.datapaths.values()):
+            if datapath.sock is not None:
+                self.disconnect(datapath)
+        self.running = False
+        self.wakeup_w.send(b'\0')
+        self.switch_thread.join()
+        self.dp_thread.join()
+        self.listener.close()
+
+    def _change_dp_sel(self, op, sock, datapath):
+        self.dp_changes.append((op, sock, datapath))
+        self.wakeup_w.send(b'\0')
+
+    def _serve_switches(self):
+        while self.running:
+            timeout = 0.05
+            if self.pending:
+                timeout = max(0.0, min(timeout, self.pending[0][0] - time.perf_counter()))
+            for key, _mask in self.switch_sel.select(timeout):
+                if key.data is None:
+                    conn, _addr = self.listener.accept()
+                    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    self.switch_sel.register(conn, selectors.EVENT_READ, [None, b''])
+                else:
+                    self._read_switch_conn(key.fileobj, key.data)
+            now = time.perf_counter()
+            while self.pending and self.pending[0][0] <= now:
+                _due, _seq, conn, switch, buf = heapq.heappop(self.pending)
+                for reply in switch.handle(buf):
+                    self.replies[(switch.id, reply.xid)] = reply
+                    header = struct.pack(ofproto_common.OFP_HEADER_PACK_STR, switch.ofproto.OFP_VERSION,
+                                         reply.cls_msg_type, OFP_HEADER_SIZE, reply.xid)
+                    try:
+                        conn.sendall(header)
+                    except OSError:
+                        pass
+
+    def _read_switch_conn(self, conn, state):
+        try:
+            data = conn.recv(1 << 16)
+        except OSError:
+            data = b''
+        if not data:
+            self.switch_sel.unregister(conn)
+            conn.close()
+            return
+        buf = state[1] + data
+        if state[0] is None:
+            if len(buf) < 8:
+                state[1] = buf
+                return
+            dpid = struct.unpack_from('!Q', buf)[0]
+            state[0] = self.datapaths[dpid].switch
+            state[0].connections += 1
+            # A reconnecting switch may have restarted with an empty flow table
+            if state[0].connections > 1 and self.clear_on_reconnect:
+                state[0].clear()
+            buf = buf[8:]
+        due = time.perf_counter() + self.latency
+        while len(buf) >= OFP_HEADER_SIZE:
+            msg_len = struct.unpack_from('!H', buf, 2)[0]
+            if len(buf) < msg_len:
+                break
+            heapq.heappush(self.pending, (due, next(self.seq), conn, state[0], buf[:msg_len]))
+            buf = buf[msg_len:]
+        state[1] = buf
+
+    def _serve_datapaths(self):
+        while self.running:
+            for key, _mask in self.dp_sel.select(0.05):
+                if key.data is None:
+                    self.wakeup_r.recv(4096)
+                    continue
+                datapath, buf = key.data
+                try:
+                    data = key.fileobj.recv(1 << 16)
+                except OSError:
+                    data = b''
+                if not data:
+                    continue
+                buf += data
+                while len(buf) >= OFP_HEADER_SIZE:
+                    _version, _msg_type, _msg_len, xid = ofproto_parser.header(buf)
+                    buf = buf[OFP_HEADER_SIZE:]
+                    reply = self.replies.pop((datapath.id, xid), None)
+                    if reply is not None:
+                        datapath.deliver(reply)
+                key.data[1] = buf
+            while self.dp_changes:
+                op, sock, datapath = self.dp_changes.pop(0)
+                if op == 'register':
+                    self.dp_sel.register(sock, selectors.EVENT_READ, [datapath, b''])
+                else:
+                    self.dp_sel.unregister(sock)
+                    sock.close()
+
+
+class HarnessController:
+    """
+    A minimal `of_controller` for the apps, backed by fake datapaths.
+    It shares `add_flow` with `SDNController`, so the FlowMods are exactly the ones the controller sends.
+    """
+    add_flow = SDNController.add_flow
+    build_flow_mod = SDNController.build_flow_mod
+    add_group = SDNController.add_group
+    delete_group = SDNController.delete_group
+    apps = SDNController.apps
+    reserved_entries = SDNController.reserved_entries
+
+    def __init__(self, dpids, fabric=None, pipeline=False, flowmod_cache=None):
+        self.pipeline = pipeline
+        self.flowmod_cache = flowmod_cache
+        self.group_ids = GroupIdAllocator()
+        self.groups_installed = {}
+        self.barrier_events = {} # (dpid, xid) -> (threading.Event, reply time)
+        self.stats_replies = {} # (dpid, xid) -> OFPFlowStatsReply
+        self.reconciling = {} # dpid -> (Reconciliation, threading.Event set when it is ready)
+        self.datapaths = {}
+        self.fabric = fabric
+        self.shard = None # a Shard when the harness runs one instance of a sharded controller
+        self.reactive_flows = ReactiveFlows(self)
+        self.app_fw = None
+        self.app_te = None
+        self.app_l2 = None
+        for dpid in dpids:
+            datapath = FakeDatapath(dpid, on_reply=self.on_reply)
+            if fabric:
+                fabric.add_datapath(datapath)
+            self.datapaths[dpid] = datapath
+
+    def on_reply(self, datapath, msg):
+        key = (datapath.id, msg.xid)
+        if isinstance(msg, ofproto_v1_3_parser.OFPBarrierReply):
+            if key in self.barrier_events:
+                event, _ = self.barrier_events[key]
+                self.barrier_events[key] = (event, time.perf_counter())
+                event.set()
+        elif isinstance(msg, ofproto_v1_3_parser.OFPFlowRemoved):
+            self.reactive_flows.on_flow_removed(datapath.id, msg.cookie)
+        elif isinstance(msg, ofproto_v1_3_parser.OFPFlowStatsReply):
+            more = msg.flags & datapath.ofproto.OFPMPF_REPLY_MORE
+            if self.reactive_flows.on_flow_stats(datapath.id, msg.xid, msg.body, more):
+                return
+            self.stats_replies[key] = msg
+            if datapath.id in self.reconciling:
+                reconciliation, event = self.reconciling[datapath.id]
+                reconciliation.add_flow_stats(msg.body, msg.flags & datapath.ofproto.OFPMPF_REPLY_MORE)
+                if reconciliation.ready():
+                    event.set()
+        elif isinstance(msg, ofproto_v1_3_parser.OFPGroupDescStatsReply):
+            if datapath.id in self.reconciling:
+                reconciliation, event = self.reconciling[datapath.id]
+                reconciliation.add_group_descs(msg.body, msg.flags & datapath.ofproto.OFPMPF_REPLY_MORE)
+                if reconciliation.ready():
+                    event.set()
+
+    def reconcile(self, datapath, apps, timeout=30.0):
+        """ Dumps the tables of `datapath` and sends the differences with the rules of `apps`, as
+        `SDNController` does after a warm restart
+
+        Returns:
+            The change counts of `Reconciliation.apply`
+        """
+        reconciliation = Reconciliation(datapath)
+        event = threading.Event()
+        self.reconciling[datapath.id] = (reconciliation, event)
+        request_tables(datapath)
+        if not event.wait(timeout):
+            raise TimeoutError('No tables from datapath %016x' % datapath.id)
+        del self.reconciling[datapath.id]
+        return reconciliation.apply(self, apps)
+
+    def send_barriers(self, datapaths):
+        """ Sends a barrier to every datapath in `datapaths` and returns the keys to wait for
+        """
+        keys = []
+        for datapath in datapaths:
+            msg = datapath.ofproto_parser.OFPBarrierRequest(datapath)
+            datapath.set_xid(msg)
+            # Registered before sending, as the reply may be delivered before `send_msg` returns
+            key = (datapath.id, msg.xid)
+            self.barrier_events[key] = (threading.Event(), None)
+            datapath.send_msg(msg)
+            keys.append(key)
+        return keys
+
+    def wait_barriers(self, keys, timeout=30.0):
+        """ Waits for the barrier replies of `keys`
+
+        Returns:
+            A dict of dpid -> time of the barrier reply (time.perf_counter)
+        """
+        deadline = time.perf_counter() + timeout
+        reply_times = {}
+        try:
+            for key in keys:
+                event, _ = self.barrier_events[key]
+                if not event.wait(max(0.0, deadline - time.perf_counter())):
+                    raise TimeoutError('No barrier reply from datapath %016x' % key[0])
+                reply_times[key[0]] = self.barrier_events[key][1]
+        finally:
+            for key in keys:
+                self.barrier_events.pop(key, None)
+        return reply_times
+
+
+def synthetic_flow_mods(controller, flows_per_switch):
+    """ Returns a function that sends `flows_per_switch` distinct FlowMods to a datapath through `controller.add_flow`
+    """
+    def send(datapath):
+        parser = datapath.ofproto_parser
+        for i in range(flows_per_switch):
+            match = parser.OFPMatch(eth_type=0x800, ipv4_dst='10.%d.%d.%d' % ((i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff))
+            actions = [parser.OFPActionOutput(2 + i % 4)]
+            controller.add_flow(datapath, match=match, actions=actions, priority=1)
+    return send
+
+
+def measure_install(controller, send_flows, datapaths=None, timeout=60.0):
+    """ Sends the flows of every datapath, followed by a barrier, and waits for all the barrier replies
+
+    Args:
+        controller (HarnessController): the controller of the fake datapaths
+        send_flows (function): called with a datapath, sends its FlowMods
+        datapaths (list): the datapaths to install, defaults to all datapaths of `controller`
+        timeout (float): seconds to wait for the barrier replies
+
+    Returns:
+        A dict with the total FlowMods (and GroupMods), FlowMods/sec, and the end-to-end install latency
+        percentiles in ms (from the first message to a datapath to its barrier reply); the other messages,
+        e.g., the table dumps of a reconciliation, are not counted
+    """
+    datapaths = list(controller.datapaths.values()) if datapaths is None else datapaths
+    mods_before = sum(dp.mods_sent for dp in datapaths)
+    start_times = {}
+    keys = []
+    start = time.perf_counter()
+    for datapath in datapaths:
+        start_times[datapath.id] = time.perf_counter()
+        send_flows(datapath)
+        keys.extend(controller.send_barriers([datapath]))
+    reply_times = controller.wait_barriers(keys, timeout)
+    elapsed = time.perf_counter() - start
+
+    flow_mods = sum(dp.mods_sent for dp in datapaths) - mods_before
+    latencies = sorted((reply_times[dpid] - start_times[dpid]) * 1000.0 for dpid in reply_times)
+    return {
+        'datapaths': len(datapaths),
+        'flow_mods': flow_mods,
+        'elapsed_s': elapsed,
+        'flow_mods_per_s': flow_mods / elapsed if elapsed > 0 else 0.0,
+        'latency_ms_p50': percentile(latencies, 50),
+        'latency_ms_p99': percentile(latencies, 99),
+        'latency_ms_max': latencies[-1] if latencies else 0.0,
+    }
+
+
+def measure_reconnect(controller, resync, datapaths=None, timeout=60.0):
+    """ Reconnects every datapath through the fabric and calls `resync(datapath)` to reinstall its flows
+
+    Returns:
+        The `measure_install` metrics of the resync, the latency includes the reconnection
+    """
+    fabric = controller.fabric
+    assert fabric is not None, 'Reconnecting requires a FakeFabric'
+
+    def reconnect_and_resync(datapath):
+        fabric.reconnect(datapath)
+        resync(datapath)
+    return measure_install(controller, reconnect_and_resync, datapaths, timeout)
+
+
+def app_flow_sender(app):
+    """ Returns a function that sends the stored rules of `app` that belong to a datapath
+    """
+    def send(datapath):
+        app.send_openflow_rules_for_dp(datapath)
+    return send
+
+
+def measure_warm_restart(controller, app, drift=0.1, seed=471):
+    """ Restarts `app` from a snapshot and reconciles every datapath, after changing the flow tables of a `drift`
+    fraction of the switches (one flow deleted, one stray flow added)
+
+    Returns:
+        (the `measure_install` metrics of the reconciliation, the snapshot size in bytes, the summed change counts)
+    """
+    rng = random.Random(seed)
+    datapaths = list(controller.datapaths.values())
+    for datapath in rng.sample(datapaths, int(len(datapaths) * drift)):
+        table = datapath.switch.flow_table
+        del table[rng.choice(sorted(key for key in table if key[1] != 0))]
+        parser = datapath.ofproto_parser
+        controller.add_flow(datapath, match=parser.OFPMatch(eth_type=0x800, ipv4_dst='192.0.2.1'),
+                            actions=[], priority=app.priority)
+
+    blob = dump_snapshot({'format': SNAPSHOT_FORMAT, 'apps': {'app_l2': save_app(app)}})
+    restored = restore_app('app_l2', parse_snapshot(blob)['apps']['app_l2'], controller)
+    totals = {}
+
+    def reconcile(datapath):
+        for change, count in controller.reconcile(datapath, [restored]).items():
+            totals[change] = totals.get(change, 0) + count
+    return measure_install(controller, reconcile, datapaths), len(blob), totals
+
+
+def measure_reactive(controller, app, packets=20000, skew=1.0, shifts=3, poll_every=1000, seed=471):
+    """ Sends `packets` pkts from random switches to destinations of Zipf-like popularity (exponent `skew`)
+    through the fake switches of `controller`, with a reactive L2 `app` (see flow_lifecycle.py)
+    The popularity of the destinations is shuffled `shifts` times along the way.
+
+    A pkt follows the entries of the switches; at a switch without an entry for it, it is a packet-in,
+    and the controller installs the reactive rule of the switch (the pkt continues as a packet-out).
+    Every `poll_every` pkts, the switches expire their idle entries and the reactive counters are polled.
+
+    Returns:
+        A dict of metrics
+    """
+    rng = random.Random(seed)
+    nodes = sorted(app.topo.nodes(), key=int)
+    popular = list(nodes)
+    rng.shuffle(popular)
+    weights = [1.0 / (rank + 1) ** skew for rank in range(len(popular))]
+    reactive_flows = controller.reactive_flows
+    keys = {} # (switch, destination) -> flow table key of the reactive rule
+    packet_ins = hits = max_entries = 0
+    start = time.perf_counter()
+    for i in range(packets):
+        if i and i % (packets // (shifts + 1)) == 0:
+            rng.shuffle(popular)
+        switch, dst = rng.choice(nodes), rng.choices(popular, weights)[0]
+        dst_mac = mn_get_host_mac(dst)
+        for _hop in range(len(nodes)):
+            datapath = controller.datapaths[int(switch)]
+            rule = app.reactive_rule(datapath.id, dst_mac)
+            if rule is None:
+                break
+            key = keys.get((switch, dst))
+            if key is None:
+                mod = app.build_rule_flow_mod(rule, datapath)
+                key = keys[switch, dst] = (mod.table_id, mod.priority, match_key(mod.match))
+            if key in datapath.switch.flow_table:
+                hits += 1
+                datapath.switch.hit(key)
+            else:
+                packet_ins += 1
+                reactive_flows.install(app, rule, datapath)
+            out_port = rule.action.out_port
+            if out_port is None:
+                out_port = app.groups_by_dpid[rule.switch_id][rule.action.group_id].buckets[0].out_port
+            if out_port == 1:
+                break
+            switch = get_neighbor_for_port(app.topo, switch, out_port)
+        if (i + 1) % poll_every == 0:
+            for datapath in controller.datapaths.values():
+                max_entries = max(max_entries, len(datapath.switch.flow_table))
+                for msg in datapath.switch.expire():
+                    datapath.deliver(msg)
+                if reactive_flows.entries.get(datapath.id):
+                    reactive_flows.request_stats(datapath)
+    tracked = sum(len(entries) for entries in reactive_flows.entries.values())
+    actual = sum(len(datapath.switch.flow_table) for datapath in controller.datapaths.values())
+    return {
+        'elapsed_s': time.perf_counter() - start,
+        'lookups': hits + packet_ins,
+        'hit_ratio': hits / float(hits + packet_ins) if hits + packet_ins else 0.0,
+        'packet_ins': packet_ins,
+        'installs': reactive_flows.installs,
+        'evictions': reactive_flows.evictions,
+        'flows_removed': reactive_flows.removals,
+        'rejected': sum(datapath.switch.rejected for datapath in controller.datapaths.values()),
+        'max_entries': max_entries,
+        'in_sync': tracked == actual,
+    }
+
+
+def shard_worker(name, members, authkey, topo_file, pipe):
+    """ Runs the instance `name` of a sharded controller with fake datapaths for every switch of `topo_file`,
+    and answers the commands of `measure_sharding` on `pipe`
+    """
+    dpids = [int(node) for node in nx.read_graphml(topo_file).nodes()]
+    controller = HarnessController(dpids)
+    controller.shard = Shard(controller, name, members, authkey)
+    controller.group_ids = GroupIdAllocator(controller.shard.first_group_id())
+    controller.shard.start()
+    while True:
+        command = pipe.recv()
+        if command == 'members':
+            pipe.send(sorted(controller.shard.ring.members))
+        elif command == 'l2':
+            start = time.perf_counter()
+            controller.app_l2 = L2ConnectivityApp(topo_file, controller)
+            controller.app_l2.calculate_connectivity_rules()
+            pipe.send((time.perf_counter() - start, len(controller.app_l2.destinations())))
+        elif command == 'tables':
+            pipe.send({dpid: len(datapath.switch.flow_table) for dpid, datapath in controller.datapaths.items()
+                       if controller.shard.owns(dpid)})
+        elif command == 'stop':
+            controller.shard.stop()
+            pipe.send(None)
+            return
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ShardProcesses:
+    """
+    The worker processes of `measure_sharding`, one per member of `members`
+    """
+    def __init__(self, members, topo_file):
+        self.members = members
+        self.authkey = os.urandom(32) # the secret of the members, new on every run
+        self.topo_file = topo_file
+        self.workers = {} # member -> (Process, Pipe)
+
+    def start(self, name):
+        pipe, child_pipe = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=shard_worker, args=(name, self.members, self.authkey, self.topo_file, child_pipe),
+                                          daemon=True)
+        process.start()
+        self.workers[name] = (process, pipe)
+
+    def stop(self, name):
+        process, pipe = self.workers.pop(name)
+        pipe.send('stop')
+        pipe.recv()
+        process.join()
+
+    def kill(self, name):
+        process, _pipe = self.workers.pop(name)
+        process.kill()
+        process.join()
+
+    def ask(self, command):
+        for _process, pipe in self.workers.values():
+            pipe.send(command)
+        return {name: pipe.recv() for name, (_process, pipe) in self.workers.items()}
+
+    # Waits until every worker sees the same members
+    def wait_ring(self, timeout=30.0):
+        deadline = time.perf_counter() + timeout
+        while any(members != sorted(self.workers) for members in self.ask('members').values()):
+            if time.perf_counter() > deadline:
+                raise TimeoutError('The shard members do not agree on the ring')
+            time.sleep(0.05)
+
+    # Waits until every switch has one owner, whose table holds `rules_per_switch` rules
+    # Returns the seconds waited
+    def wait_converged(self, dpids, rules_per_switch, timeout=60.0):
+        start = time.perf_counter()
+        while True:
+            owned = {}
+            for tables in self.ask('tables').values():
+                for dpid, size in tables.items():
+                    owned.setdefault(dpid, []).append(size)
+            if sorted(owned) == sorted(dpids) and all(sizes == [rules_per_switch] for sizes in owned.values()):
+                return time.perf_counter() - start
+            if time.perf_counter() - start > timeout:
+                raise TimeoutError('The shard members did not converge')
+            time.sleep(0.05)
+
+    def close(self):
+        for process, _pipe in self.workers.values():
+            process.kill()
+            process.join()
+        self.workers = {}
+
+
+def measure_sharding(topo_file, instances=3):
+    """ Runs `instances` processes of a sharded controller and starts the L2 app on all of them,
+    then makes one instance leave, kills another, and adds a new one.
+    After every change, waits until the owner of every switch holds all its L2 rules.
+
+    Returns:
+        (the calculation seconds and destinations per instance, a list of (change, seconds to converge))
+    """
+    assert instances >= 3, 'The leave and kill steps need 3 instances'
+    names = ['shard%d' % i for i in range(instances + 1)]
+    members = {name: ('127.0.0.1', _free_port()) for name in names}
+    dpids = [int(node) for node in nx.read_graphml(topo_file).nodes()]
+    processes = ShardProcesses(members, topo_file)
+    steps = []
+    try:
+        for name in names[:instances]:
+            processes.start(name)
+        processes.wait_ring()
+        calculation = processes.ask('l2')
+        steps.append(('start', processes.wait_converged(dpids, len(dpids))))
+
+        processes.stop(names[instances - 1])
+        processes.wait_ring()
+        steps.append(('leave %s' % names[instances - 1], processes.wait_converged(dpids, len(dpids))))
+
+        processes.kill(names[0])
+        processes.wait_ring()
+        steps.append(('kill %s' % names[0], processes.wait_converged(dpids, len(dpids))))
+
+        processes.start(names[instances])
+        processes.wait_ring()
+        steps.append(('join %s' % names[instances], processes.wait_converged(dpids, len(dpids))))
+    finally:
+        processes.close()
+    return calculation, steps
+
+
+def l2_app_on_topology(name, work_dir, seed=471):
+    """ Creates the L2 app on one of the benchmark topologies and calculates its rules without sending them
+
+    Returns:
+        (the app, the list of dpids)
+    """
+    kind, params = TOPOLOGIES[name]
+    topo_file = os.path.join(work_dir, '%s.graphml' % name)
+    nx.write_graphml(generate_topology(kind, seed=seed, **params), topo_file)
+    app = L2ConnectivityApp(topo_file)
+    app.calculate_connectivity_rules()
+    return app, [int(node) for node in app.topo.nodes()]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def print_metrics(title, metrics):
+    print('%s: %d datapaths, %d FlowMods in %.3fs -> %.0f FlowMods/s, latency p50=%.2fms p99=%.2fms max=%.2fms' % (
+        title, metrics['datapaths'], metrics['flow_mods'], metrics['elapsed_s'], metrics['flow_mods_per_s'],
+        metrics['latency_ms_p50'], metrics['latency_ms_p99'], metrics['latency_ms_max']))
+
+
+def print_sharding(topology, shards):
+    with tempfile.TemporaryDirectory() as work_dir:
+        kind, params = TOPOLOGIES[topology]
+        topo_file = os.path.join(work_dir, '%s.graphml' % topology)
+        nx.write_graphml(generate_topology(kind, seed=471, **params), topo_file)
+        controller = HarnessController([int(node) for node in nx.read_graphml(topo_file).nodes()])
+        start = time.perf_counter()
+        L2ConnectivityApp(topo_file, controller).calculate_connectivity_rules()
+        print('Single instance: L2 rules calculated and installed in %.3fs' % (time.perf_counter() - start))
+        calculation, steps = measure_sharding(topo_file, shards)
+    for name, (elapsed, destinations) in sorted(calculation.items()):
+        print('%s: %d destinations calculated and routed in %.3fs' % (name, destinations, elapsed))
+    for change, elapsed in steps:
+        print('%s: converged in %.3fs' % (change, elapsed))
+
+
+def print_reactive(args):
+    with tempfile.TemporaryDirectory() as work_dir:
+        kind, params = TOPOLOGIES[args.topology]
+        topo_file = os.path.join(work_dir, '%s.graphml' % args.topology)
+        graph = generate_topology(kind, seed=471, table_capacity=args.table_capacity, **params)
+        nx.write_graphml(graph, topo_file)
+        controller = HarnessController([int(node) for node in graph.nodes()])
+        app = L2ConnectivityApp(topo_file, controller, reactive=True)
+    controller.app_l2 = app
+    controller.reactive_flows = ReactiveFlows(controller, idle_timeout=args.idle_timeout, evict=not args.no_evict)
+    for datapath in controller.datapaths.values():
+        datapath.switch.capacity = args.table_capacity
+    app.calculate_connectivity_rules()
+    metrics = measure_reactive(controller, app, args.packets)
+    print('Reactive: %d lookups in %.3fs, hit ratio %.3f, %d packet-ins, %d installs, %d evictions, '
+          '%d flows removed, %d rejected, max %d entries per switch, controller view in sync: %s' % (
+              metrics['lookups'], metrics['elapsed_s'], metrics['hit_ratio'], metrics['packet_ins'],
+              metrics['installs'], metrics['evictions'], metrics['flows_removed'], metrics['rejected'],
+              metrics['max_entries'], metrics['in_sync']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measures FlowMod installation on fake OpenFlow datapaths')
+    parser.add_argument('--switches', type=int, default=1000)
+    parser.add_argument('--flows', type=int, default=100, help='FlowMods per switch')
+    parser.add_argument('--loopback', action='store_true', help='send the FlowMods over local TCP sockets')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='one-way latency of the loopback sockets')
+    parser.add_argument('--reconnect', action='store_true', help='measure reconnecting and resyncing every switch')
+    parser.add_argument('--warm-restart', action='store_true',
+                        help='measure reconciling the switches with a restarted app (requires --topology)')
+    parser.add_argument('--cache', action='store_true', help='send the app rules through a FlowModCache')
+    parser.add_argument('--topology', choices=sorted(TOPOLOGIES),
+                        help='install the L2 rules of a benchmark topology instead of synthetic FlowMods')
+    parser.add_argument('--reactive', action='store_true',
+                        help='measure a reactive L2 app of --topology under a table capacity')
+    parser.add_argument('--table-capacity', type=int, default=64, help='flow table capacity with --reactive')
+    parser.add_argument('--idle-timeout', type=int, default=1, help='idle timeout of the reactive flows (s)')
+    parser.add_argument('--packets', type=int, default=20000, help='pkts sent with --reactive')
+    parser.add_argument('--no-evict', action='store_true', help='reject new reactive flows at full tables')
+    parser.add_argument('--shards', type=int, default=0,
+                        help='run the L2 app of --topology on this many sharded controller processes')
+    args = parser.parse_args()
+    for option in ('warm_restart', 'reactive', 'shards'):
+        if getattr(args, option) and not args.topology:
+            parser.error('--%s requires --topology' % option.replace('_', '-'))
+
+    if args.shards:
+        print_sharding(args.topology, args.shards)
+        raise SystemExit(0)
+    if args.reactive:
+        print_reactive(args)
+        raise SystemExit(0)
+
+    fabric = None
+    if args.loopback or args.reconnect:
+        fabric = FakeFabric(latency=args.latency_ms / 1000.0, clear_on_reconnect=True)
+    # The topology file is read again by the app restored from a snapshot
+    work_dir = tempfile.TemporaryDirectory()
+    if args.topology:
+        app, dpids = l2_app_on_topology(args.topology, work_dir.name)
+        controller = HarnessController(dpids, fabric, flowmod_cache=FlowModCache() if args.cache else None)
+        app.of_controller = controller
+        send_flows = app_flow_sender(app)
+    else:
+        controller = HarnessController(range(1, args.switches + 1), fabric)
+        send_flows = synthetic_flow_mods(controller, args.flows)
+    try:
+        print_metrics('Install', measure_install(controller, send_flows))
+        if args.reconnect:
+            print_metrics('Reconnect', measure_reconnect(controller, send_flows))
+        if args.warm_restart:
+            metrics, size, totals = measure_warm_restart(controller, app)
+            print_metrics('Warm restart', metrics)
+            print('Snapshot: %d bytes, %s' % (size, ', '.join('%s=%d' % item for item in totals.items())))
+        if controller.flowmod_cache:
+            cache = controller.flowmod_cache
+            print('FlowMod cache: %d hits, %d misses, %d entries, %d bytes' % (
+                cache.hits, cache.misses, len(cache.entries), cache.size))
+        tables = [len(dp.switch.flow_table) for dp in controller.datapaths.values()]
+        print('Flow table sizes: min=%d max=%d' % (min(tables), max(tables)))
+    finally:
+        work_dir.cleanup()
+        if fabric:
+            fabric.close()
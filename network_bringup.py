@@ -0,0 +1,155 @@
+"""
+Plans and applies the configuration of the Mininet hosts and switches of a project topology.
+Every host gets its whole neighbor table from one `ip -batch` file and all its settings in one shell round-trip,
+and the nodes are configured concurrently.
+The plans only depend on the graph, so running this module generates (and times) them without Mininet, as a dry run.
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import networkx as nx
+
+from utils_net import mn_get_host_ip, mn_get_host_mac
+
+DEFAULT_TCP_PORT = 80
+DEFAULT_UDP_PORT = 8080
+DISABLE_IPV6 = ('sysctl -w net.ipv6.conf.all.disable_ipv6=1 net.ipv6.conf.default.disable_ipv6=1 '
+                'net.ipv6.conf.lo.disable_ipv6=1')
+
+
+class BringupPlan:
+    """
+    The commands to run on every host and switch, and the neighbor files to write before running them.
+    `host_cmds` and `switch_cmds` map a node name to its list of shell commands,
+    `files` maps a file path to its content.
+    """
+    def __init__(self):
+        self.host_cmds = {}
+        self.switch_cmds = {}
+        self.files = {}
+
+    def host_script(self, name):
+        return ' ; '.join(self.host_cmds[name])
+
+    def switch_script(self, name):
+        return ' ; '.join(self.switch_cmds[name])
+
+
+def plan_bringup(graph, neigh_dir):
+    """ Creates the bring-up plan of the hosts and switches in `graph`
+
+    For every host:
+        1. Run the iperf3 TCP and UDP servers of its node attributes
+        2. Install static ARP entries for every other host, from the batch file `<neigh_dir>/<host>.neigh`
+        3. Add a default route
+        4. Disable IPv6
+    For every switch:
+        1. Disable IPv6
+
+    Args:
+        graph (Graph): the project topology
+        neigh_dir (str): directory of the neighbor batch files
+
+    Returns:
+        A BringupPlan
+    """
+    plan = BringupPlan()
+    nodes = sorted(graph.nodes(), key=int)
+    neighbors = [(node, mn_get_host_ip(node), mn_get_host_mac(node)) for node in nodes]
+    for node in nodes:
+        host = 'h%s' % node
+        intf = '%s-eth1' % host
+        node_data = graph.nodes[node]
+        cmds = []
+        if node_data.get('tcp_server', False):
+            tcp_port = node_data.get('tcp_port', DEFAULT_TCP_PORT)
+            cmds.append('iperf3 -s -p %d -D --logfile %s-tcp-server.log' % (tcp_port, host))
+        if node_data.get('udp_server', False):
+            udp_port = node_data.get('udp_port', DEFAULT_UDP_PORT)
+            cmds.append('iperf3 -s -p %d -D --logfile %s-udp-server.log' % (udp_port, host))
+
+        # Set up ARP rules; no need for our switches to forward ARP pkts
+        neigh_file = os.path.join(neigh_dir, '%s.neigh' % host)
+        plan.files[neigh_file] = ''.join('neigh replace %s lladdr %s dev %s nud permanent\n' % (ip, mac, intf)
+                                         for other, ip, mac in neighbors if other != node)
+        cmds.append('ip -batch %s' % neigh_file)
+        cmds.append('ip route add default via %s' % mn_get_host_ip(node))
+        cmds.append(DISABLE_IPV6)
+        plan.host_cmds[host] = cmds
+
+        plan.switch_cmds['s%s' % node] = [DISABLE_IPV6]
+    return plan
+
+
+def write_plan_files(plan):
+    for path, content in plan.files.items():
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+
+def apply_bringup(network, plan, workers=32):
+    """ Applies `plan` to the hosts and switches of a Mininet `network`, configuring the nodes concurrently
+
+    Switches that are not in their own network namespace share the root namespace,
+    so their commands run only once.
+
+    Returns:
+        A dict of phase name -> seconds
+    """
+    timings = {}
+    start = time.perf_counter()
+    write_plan_files(plan)
+    timings['write neighbor files'] = time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        start = time.perf_counter()
+        list(executor.map(lambda h: h.cmd(plan.host_script(h.name)), network.hosts))
+        timings['configure hosts'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        switches = [sw for sw in network.switches if sw.inNamespace]
+        root_switches = [sw for sw in network.switches if not sw.inNamespace]
+        switches.extend(root_switches[:1])
+        list(executor.map(lambda sw: sw.cmd(plan.switch_script(sw.name)), switches))
+        timings['configure switches'] = time.perf_counter() - start
+    return timings
+
+
+def print_timings(timings):
+    for phase, seconds in timings.items():
+        print('%-22s %8.3fs' % (phase, seconds))
+
+
+if __name__ == '__main__':
+    # Dry run: start_network.py applies the same plan to Mininet
+    parser = argparse.ArgumentParser(description='Prints the bring-up plan of a topology without Mininet')
+    parser.add_argument('topo_file')
+    parser.add_argument('--neigh-dir', help='write the neighbor batch files to this directory')
+    parser.add_argument('--summary', action='store_true', help='print the plan size instead of every command')
+    args = parser.parse_args()
+
+    graph = nx.read_graphml(args.topo_file)
+    neigh_dir = args.neigh_dir or tempfile.gettempdir()
+    timings = {}
+    start = time.perf_counter()
+    plan = plan_bringup(graph, neigh_dir)
+    timings['plan'] = time.perf_counter() - start
+    if args.neigh_dir:
+        start = time.perf_counter()
+        write_plan_files(plan)
+        timings['write neighbor files'] = time.perf_counter() - start
+
+    if args.summary:
+        neigh_entries = sum(content.count('\n') for content in plan.files.values())
+        print('%d hosts, %d switches, %d neighbor entries in %d files' % (
+            len(plan.host_cmds), len(plan.switch_cmds), neigh_entries, len(plan.files)))
+    else:
+        for host in plan.host_cmds:
+            print('%s: %s' % (host, plan.host_script(host)))
+        for switch in plan.switch_cmds:
+            print('%s: %s' % (switch, plan.switch_script(switch)))
+    print_timings(timings)
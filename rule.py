@@ -5,7 +5,8 @@ def parse_action(d):
     if 'action_type' in d:
         return {
             'action_type': getattr(ActionType, d['action_type']),
-            'out_port': d.get('out_port', None)
+            'out_port': d.get('out_port', None),
+            'group_id': d.get('group_id', None)
             }
     return d
 
@@ -33,6 +34,11 @@ class MatchPattern:
         self.dst_port = dst_port
         self.in_port = in_port
     
+    # A hashable key identifying the pattern
+    def key(self):
+        return (self.src_mac, self.dst_mac, self.mac_proto, self.ip_proto,
+                self.src_ip, self.dst_ip, self.src_port, self.dst_port, self.in_port)
+
     def __str__(self):
         return format_without_nones('src_mac={}, dst_mac={}, mac_proto={}, ip_proto={}, src_ip={}, dst_ip={}, src_port={}, dst_port={}, in_port={}', 
                                     self.src_mac, self.dst_mac, 
@@ -45,21 +51,31 @@ class ActionType(str, Enum):
     FORWARD = 'FORWARD'
     DROP = 'DROP'
     CONTROLLER = 'CONTROLLER'
+    GROUP = 'GROUP'
 
 class Action:
     """
-    Our APIs support three actions (check ActionType): 
+    Our APIs support four actions (check ActionType): 
     1. Forward a pkt to a specific `out_port`
     2. Drop a pkt
     3. Send the pkt to the controller for further processing
+    4. Process the pkt by the group `group_id` of the switch (e.g., a fast-failover group)
     if `action_type` is DROP or CONTROLLER, `out_port` is always None
     if `action_type` is FORWARD, `out_port` must be an integer value > 0
+    if `action_type` is GROUP, `group_id` must be an integer value > 0
     """
-    def __init__(self, action_type, out_port=None):
+    def __init__(self, action_type, out_port=None, group_id=None):
         self.action_type = action_type
         self.out_port = out_port
+        self.group_id = group_id
+
+    # A hashable key identifying the action
+    def key(self):
+        return (self.action_type, self.out_port, self.group_id)
 
     def __str__(self):
+        if self.group_id:
+            return '%s, GroupId=%d' % (self.action_type, self.group_id)
         if self.out_port:
             return '%s, OutPort=%d' % (self.action_type, self.out_port) 
         return '%s' % self.action_type
@@ -0,0 +1,122 @@
+"""
+Aggregates the rules of a rule set (e.g., the TE rules of several objectives) into fewer, wider rules.
+All the rules of a set have the same priority, so a pkt gets the same action from the aggregated rules
+as from the original ones:
+- identical rules (e.g., of overlapping or symmetric objectives) are kept once
+- rules covered by a rule with the same action, i.e., equal to it but for a field it does not match, are dropped
+- rules equal but for their `src_ip` (or `dst_ip`) are merged into the CIDR prefixes covering exactly their addresses
+- rules equal but for their `in_port` are merged into a rule matching any port if they cover every port of the switch
+"""
+from functools import lru_cache
+
+from netaddr import cidr_merge, IPAddress
+
+from rule import MatchPattern, Rule
+
+MERGED_FIELDS = ('in_port', 'src_ip', 'dst_ip')
+# The index of the merged fields in `MatchPattern.key`
+KEY_INDEX = {'src_ip': 4, 'dst_ip': 5, 'in_port': 8}
+
+
+class Aggregation:
+    """
+    The result of `aggregate_rules`:
+    `rules` are the aggregated rules, in the order of the first rule each of them replaces,
+    `saved_per_switch` maps a switch id to its number of rules saved by the aggregation.
+    """
+    def __init__(self, rules, saved_per_switch):
+        self.rules = rules
+        self.saved_per_switch = saved_per_switch
+
+    def saved(self):
+        return sum(self.saved_per_switch.values())
+
+    def __str__(self):
+        return 'Aggregation: %d rules, %d saved on %d switches' % (
+            len(self.rules), self.saved(), len(self.saved_per_switch))
+
+
+def _copy_rule(rule, **fields):
+    pattern = MatchPattern(**rule.match_pattern.__dict__)
+    for field, value in fields.items():
+        setattr(pattern, field, value)
+    return Rule(switch_id=rule.switch_id, match_pattern=pattern, action=rule.action)
+
+
+# The same host addresses appear in the rules of many switches
+@lru_cache(maxsize=65536)
+def _ip_int(ip):
+    return int(IPAddress(ip))
+
+
+# Addresses (without prefixes) only merge if two of them share their /31 prefix
+def _merge_ips(rules, field):
+    ips = [getattr(rule.match_pattern, field) for rule in rules]
+    if not any('/' in ip for ip in ips) and len({_ip_int(ip) >> 1 for ip in ips}) == len(ips):
+        return rules
+    prefixes = cidr_merge(ips)
+    if len(prefixes) == len(rules):
+        return rules
+    return [_copy_rule(rules[0], **{field: str(prefix.ip) if prefix.prefixlen == 32 else str(prefix)})
+            for prefix in prefixes]
+
+
+# The rules of a TE path match the single port they enter from, so this only merges the rules of hand-written
+# policies (e.g., a drop at every port of a switch) passed to `aggregate_rules`
+# A rule matching any port is only equivalent if the rules cover every port of the switch, the port of its host
+# (1) and the ports of its links; in particular, a rule forwarding to a port also matches the pkts entering
+# from that port, which the switch would drop instead of passing them to the next rules
+def _merge_in_ports(rules, ports):
+    if ports is None or not ports <= {rule.match_pattern.in_port for rule in rules}:
+        return rules
+    return [_copy_rule(rules[0], in_port=None)]
+
+
+def _merge_field(rules, field, ports_by_switch):
+    index = KEY_INDEX[field]
+    groups = {}
+    for rule in rules:
+        key = rule.match_pattern.key()
+        groups.setdefault((rule.switch_id, key[:index] + key[index + 1:], rule.action.key()), []).append(rule)
+
+    merged = []
+    for key, group in groups.items():
+        wildcards = [rule for rule in group if getattr(rule.match_pattern, field) is None]
+        if wildcards:
+            merged.append(wildcards[0])
+        elif len(group) == 1:
+            merged.extend(group)
+        elif field == 'in_port':
+            merged.extend(_merge_in_ports(group, ports_by_switch.get(key[0])))
+        else:
+            merged.extend(_merge_ips(group, field))
+    return merged
+
+
+def aggregate_rules(graph, rules):
+    """ Aggregates `rules`, all of the same priority, at the switches of `graph`
+
+    Returns:
+        An Aggregation
+    """
+    ports_by_switch = {int(node): set(range(1, graph.degree(node) + 2)) for node in graph.nodes()}
+    unique = {}
+    for rule in rules:
+        unique.setdefault((rule.switch_id, rule.match_pattern.key(), rule.action.key()), rule)
+    aggregated = list(unique.values())
+    # Merging one field may make other rules equal but for another field:
+    # the fields are merged in turn until none of them merges rules
+    unchanged = 0
+    field = 0
+    while unchanged < len(MERGED_FIELDS):
+        count = len(aggregated)
+        aggregated = _merge_field(aggregated, MERGED_FIELDS[field], ports_by_switch)
+        unchanged = unchanged + 1 if len(aggregated) == count else 1
+        field = (field + 1) % len(MERGED_FIELDS)
+
+    saved_per_switch = {}
+    for rule in rules:
+        saved_per_switch[rule.switch_id] = saved_per_switch.get(rule.switch_id, 0) + 1
+    for rule in aggregated:
+        saved_per_switch[rule.switch_id] -= 1
+    return Aggregation(aggregated, {switch: saved for switch, saved in saved_per_switch.items() if saved})
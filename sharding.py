@@ -0,0 +1,376 @@
+"""
+Runs several controller instances, each owning a consistent-hash partition of the dpids.
+
+The instances (the shard members) are named in a members table, name -> IPC address, in the same order
+on every instance. The live members form a hash ring with virtual nodes; a dpid is owned by the first
+member after it on the ring, and backed up by the next one. The owner is the OpenFlow MASTER of the switch
+and the only instance that sends it FlowMods; the others are SLAVEs.
+
+The apps of every instance compute rules for any switch (the L2 app only for the destinations of its own
+partition, see `L2ConnectivityApp.calculate_connectivity_rules`), and the rules are routed to the owner and
+the backup of each switch over `multiprocessing.connection`. The routed rules are kept per source instance
+and app in a `ShardStore`, and only their differences are sent to the switches.
+
+When an instance joins or leaves (or stops answering), the ring changes and every live instance routes its
+rules again. The switches an instance takes over are first replayed from the rules it holds as a backup, so
+the rules of an instance that died stay installed; the rules of departed instances are handed over to the
+new owners and backups.
+
+The members exchange pickled messages, and unpickling a message can run any code: a member only accepts
+the connections authenticated with the secret `authkey` shared by the members, which has no default and must
+be kept private (SDN_SHARD_SECRET in start_controller.py).
+"""
+import bisect
+import hashlib
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from app import NetworkApp
+from topology_reload import RuleTables, apply_delta, rule_delta
+
+VNODES = 64 # virtual nodes per member on the hash ring
+REPLICAS = 2 # the owner and the backup of a switch
+HEARTBEAT_INTERVAL = 1.0
+# Every member allocates group ids in its own range, as several members may send groups to one switch
+GROUP_ID_SLOT_BITS = 24
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(str(key).encode()).digest()[:8], 'big')
+
+
+def parse_members(spec):
+    """ Parses a members table 'name=host:port,name=host:port,...'
+
+    Returns:
+        An ordered dict of member name -> (host, port)
+    """
+    members = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        name, address = item.strip().split('=')
+        host, port = address.rsplit(':', 1)
+        members[name] = (host, int(port))
+    return members
+
+
+class HashRing:
+    """
+    A consistent-hash ring of member names with `vnodes` virtual nodes per member.
+    Adding or removing a member only moves the keys of its own virtual nodes.
+    """
+    def __init__(self, members=(), vnodes=VNODES):
+        self.vnodes = vnodes
+        self.members = set()
+        self.points = [] # sorted list of (hash, member)
+        for member in members:
+            self.add(member)
+
+    def add(self, member):
+        if member in self.members:
+            return
+        self.members.add(member)
+        for i in range(self.vnodes):
+            bisect.insort(self.points, (_hash('%s#%d' % (member, i)), member))
+
+    def remove(self, member):
+        if member not in self.members:
+            return
+        self.members.discard(member)
+        self.points = [point for point in self.points if point[1] != member]
+
+    # The first `count` distinct members after `key` on the ring
+    def owners(self, key, count=1):
+        owners = []
+        start = bisect.bisect(self.points, (_hash(key),))
+        for i in range(len(self.points)):
+            member = self.points[(start + i) % len(self.points)][1]
+            if member not in owners:
+                owners.append(member)
+                if len(owners) == count:
+                    break
+        return owners
+
+    def owner(self, key):
+        owners = self.owners(key)
+        return owners[0] if owners else None
+
+    def copy(self):
+        ring = HashRing(vnodes=self.vnodes)
+        ring.members = set(self.members)
+        ring.points = list(self.points)
+        return ring
+
+
+class ThreadHub:
+    """
+    The threading counterpart of `ryu.lib.hub` for a Shard outside of Ryu, e.g., in the mock datapath harness
+    """
+    @staticmethod
+    def spawn(func, *args, **kwargs):
+        thread = threading.Thread(target=func, args=args, kwargs=kwargs, daemon=True)
+        thread.start()
+        return thread
+
+    sleep = staticmethod(time.sleep)
+    Semaphore = threading.Semaphore
+
+
+class ShardStore(NetworkApp):
+    """
+    The rules of one app of one source instance, routed to this instance for the switches it owns or backs up.
+    It has no topology; its `rule_store` and `group_store` are replaced by the routed rules.
+    """
+    def __init__(self, of_controller, priority, table_id):
+        super(ShardStore, self).__init__(None, None, of_controller, priority, table_id)
+
+    def from_json(self, json_file=None):
+        pass
+
+    def to_json(self, json_file):
+        pass
+
+    # The source instance recomputes its rules and routes them again
+    def on_notified(self, **kwargs):
+        pass
+
+
+class Shard:
+    """
+    One instance of a sharded controller: the hash ring of the live members, the IPC with the other members,
+    and the rules routed to this instance.
+    `hub` provides spawn, sleep and Semaphore: `ryu.lib.hub` in the controller, `ThreadHub` elsewhere.
+    `handlers` maps the other message kinds to functions, e.g., to start an app on every member.
+    `authkey` is the secret of the members (bytes); a Shard cannot be created without it.
+    """
+    def __init__(self, of_controller, name, members, authkey, hub=ThreadHub, timeout=30.0):
+        if not authkey:
+            raise ValueError('The members of a shard need a secret authkey')
+        self.of_controller = of_controller
+        self.name = name
+        self.members = dict(members)
+        self.slot = list(self.members).index(name)
+        self.hub = hub
+        self.authkey = authkey
+        self.timeout = timeout
+        self.ring = HashRing([name])
+        self.stores = {} # (source member, app name) -> ShardStore
+        self.handlers = {}
+        self.clients = {} # member -> Connection
+        self.lock = hub.Semaphore() # guards the ring, the stores and the switches
+        self.route_lock = hub.Semaphore() # keeps the shares of a rule set in order
+        self.send_lock = hub.Semaphore()
+        self.listener = None
+        self.running = False
+
+    # The first group id of this member's range
+    def first_group_id(self):
+        return (self.slot << GROUP_ID_SLOT_BITS) + 1
+
+    def owns(self, dpid):
+        return self.ring.owner(dpid) == self.name
+
+    # Listens for the other members, and joins the ones that are up
+    def start(self):
+        self.listener = Listener(self.members[self.name], authkey=self.authkey)
+        self.running = True
+        self.hub.spawn(self._serve)
+        joined = [member for member in self.members
+                  if member != self.name and self._send(member, ('join', self.name))]
+        if joined:
+            self._change_ring(added=joined)
+        self.hub.spawn(self._heartbeat)
+
+    # Leaves the ring; the other members take over the switches of this member
+    def stop(self):
+        self.running = False
+        for member in sorted(self.ring.members - {self.name}):
+            self._send(member, ('leave', self.name))
+        for conn in self.clients.values():
+            conn.close()
+        self.clients = {}
+        self.listener.close()
+
+    # Sends `message` to every other live member
+    def broadcast(self, message):
+        for member in sorted(self.ring.members - {self.name}):
+            self.send(member, message)
+
+    # A member that cannot be reached is removed from the ring
+    def send(self, member, message):
+        if self._send(member, message):
+            return True
+        self.hub.spawn(self._change_ring, removed=[member])
+        return False
+
+    def _send(self, member, message):
+        with self.send_lock:
+            try:
+                conn = self.clients.get(member)
+                if conn is None:
+                    conn = Client(self.members[member], authkey=self.authkey)
+                    self.clients[member] = conn
+                conn.send(message)
+                return True
+            except (OSError, EOFError, AuthenticationError):
+                conn = self.clients.pop(member, None)
+                if conn is not None:
+                    conn.close()
+                return False
+
+    def _serve(self):
+        while self.running:
+            try:
+                conn = self.listener.accept()
+            except (OSError, EOFError, AuthenticationError):
+                continue
+            self.hub.spawn(self._read, conn)
+
+    def _read(self, conn):
+        while self.running:
+            try:
+                message = conn.recv()
+            except (OSError, EOFError):
+                break
+            self.handle(message)
+        conn.close()
+
+    def _heartbeat(self):
+        while self.running:
+            self.hub.sleep(HEARTBEAT_INTERVAL)
+            for member in sorted(self.ring.members - {self.name}):
+                if self.running:
+                    self.send(member, ('ping', self.name))
+
+    # Only the routed rules are handled by the reading thread; the rest may send messages themselves,
+    # and two members sending to each other from their reading threads could block each other
+    def handle(self, message):
+        kind = message[0]
+        if kind in ('rules', 'handover'):
+            self.deliver(message)
+        # A ping from a member that was taken out of the ring (e.g., after a timeout) brings it back
+        elif kind in ('join', 'ping'):
+            if message[1] not in self.ring.members:
+                self.hub.spawn(self._change_ring, added=[message[1]])
+        elif kind == 'leave':
+            self.hub.spawn(self._change_ring, removed=[message[1]])
+        elif kind in self.handlers:
+            self.hub.spawn(self.handlers[kind], *message[1:])
+
+    def _change_ring(self, added=(), removed=()):
+        with self.lock:
+            old_ring = self.ring.copy()
+            for member in added:
+                self.ring.add(member)
+            for member in removed:
+                if member != self.name:
+                    self.ring.remove(member)
+            if self.ring.members == old_ring.members:
+                return
+            self._take_over(old_ring)
+        self.reroute()
+        with self.lock:
+            self._prune()
+
+    # Claims the connected switches this member now owns, and replays the rules it holds for them
+    def _take_over(self, old_ring):
+        for dpid, datapath in list(self.of_controller.datapaths.items()):
+            owner = self.ring.owner(dpid)
+            if owner == old_ring.owner(dpid):
+                continue
+            self._send_role(datapath, owner == self.name)
+            if owner == self.name:
+                for store in self.stores.values():
+                    store.send_openflow_rules_for_dp(datapath)
+
+    # Drops the routed rules of the switches this member neither owns nor backs up
+    def _prune(self):
+        for store in self.stores.values():
+            for table in (store.rule_store, store.group_store):
+                for by_dpid in table.values():
+                    for dpid in [dpid for dpid in by_dpid if self.name not in self.ring.owners(dpid, REPLICAS)]:
+                        del by_dpid[dpid]
+
+    # Routes the rules of the local apps again, and hands over the rules of departed members
+    def reroute(self):
+        for app in self.of_controller.apps():
+            for rule_set in list(app.rule_store):
+                self.route(app, rule_set)
+        for (source, app_name), store in list(self.stores.items()):
+            if source not in self.ring.members:
+                for rule_set in list(store.rule_store):
+                    self._route('handover', source, app_name, store, rule_set)
+
+    # Sends the `rule_set` of a local `app` to the owner and the backup of every switch
+    def route(self, app, rule_set='default'):
+        self._route('rules', self.name, type(app).__name__, app, rule_set)
+
+    # Every member gets its share, even an empty one, as a 'rules' message replaces the previous share
+    def _route(self, kind, source, app_name, app, rule_set):
+        with self.route_lock:
+            self._send_shares(kind, source, app_name, app, rule_set)
+
+    def _send_shares(self, kind, source, app_name, app, rule_set):
+        members = sorted(self.ring.members)
+        shares = {member: ({}, {}) for member in members}
+        for index, by_dpid in enumerate((app.rule_store.get(rule_set, {}), app.group_store.get(rule_set, {}))):
+            for dpid, items in by_dpid.items():
+                for member in self.ring.owners(dpid, REPLICAS):
+                    if member in shares:
+                        shares[member][index][dpid] = items
+        for member in members:
+            rules, groups = shares[member]
+            if kind == 'handover' and not rules and not groups:
+                continue
+            message = (kind, source, app_name, app.priority, app.table_id, rule_set, rules, groups)
+            if member == self.name:
+                self.deliver(message)
+            else:
+                self.send(member, message)
+
+    def deliver(self, message):
+        """ Stores the rules routed to this member and sends their differences to the switches it owns
+        A 'rules' message replaces the rule set of its source app, a 'handover' message adds to it
+        """
+        kind, source, app_name, priority, table_id, rule_set, rules, groups = message
+        with self.lock:
+            store = self.stores.get((source, app_name))
+            if store is None:
+                store = self.stores[source, app_name] = ShardStore(self.of_controller, priority, table_id)
+            before = self._owned_tables(store)
+            if kind == 'handover':
+                store.rule_store.setdefault(rule_set, {}).update(rules)
+                store.group_store.setdefault(rule_set, {}).update(groups)
+            else:
+                store.rule_store[rule_set] = rules
+                store.group_store[rule_set] = groups
+            apply_delta(self.of_controller, rule_delta(before, self._owned_tables(store)), self.timeout)
+
+    def _owned_tables(self, store):
+        tables = RuleTables([store])
+        tables.rules = {key: entry for key, entry in tables.rules.items() if self.owns(key[1])}
+        tables.groups = {key: entry for key, entry in tables.groups.items() if self.owns(key[0])}
+        return tables
+
+    def claim(self, datapath):
+        """ Sets the role of this member at a connecting switch
+        Returns:
+            True if this member owns the switch
+        """
+        owned = self.owns(datapath.id)
+        self._send_role(datapath, owned)
+        return owned
+
+    # Replays the routed rules of a switch this member owns; returns the number of rules sent
+    def resync(self, datapath):
+        with self.lock:
+            return sum(store.send_openflow_rules_for_dp(datapath) for store in self.stores.values())
+
+    # The generation id orders the MASTER claims of the members; the time is increasing on every member
+    def _send_role(self, datapath, master):
+        ofp = datapath.ofproto
+        role = ofp.OFPCR_ROLE_MASTER if master else ofp.OFPCR_ROLE_SLAVE
+        datapath.send_msg(datapath.ofproto_parser.OFPRoleRequest(datapath, role, time.time_ns()))
@@ -0,0 +1,267 @@
+"""
+Snapshots of the controller state, and the reconciliation of a switch against the state restored from a snapshot.
+
+A snapshot is a zlib-compressed pickle of plain data: the topology file and its version, the group id allocator,
+and for every app the arguments it is created with and the state it cannot rebuild (its objectives and stored
+rule tables, see `NetworkApp.SNAPSHOT_STATE`). The apps are created anew on restore, so the attributes they get
+after a snapshot was taken start with their defaults.
+A controller restarted from a snapshot does not reprogram the switches:
+it dumps the flow and group tables of every connecting switch and only sends the differences.
+
+Unpickling calls the classes named in the data, so a snapshot from an untrusted source could run any code:
+snapshots are only unpickled with the rule, group and objective classes of the apps (`SNAPSHOT_CLASSES`),
+and the snapshot path should only be writable by the controller.
+"""
+import hashlib
+import io
+import os
+import pickle
+import zlib
+
+from app_fw import FirewallApp
+from app_l2 import L2ConnectivityApp
+from app_te import TEApp
+from flow_lifecycle import is_reactive
+
+# Bumped on every change of the snapshot layout: snapshots of another format are ignored
+SNAPSHOT_FORMAT = 3
+APP_CLASSES = {'app_fw': FirewallApp, 'app_te': TEApp, 'app_l2': L2ConnectivityApp}
+APP_NAMES = tuple(APP_CLASSES)
+# The only classes a snapshot may hold: module -> class names
+SNAPSHOT_CLASSES = {
+    'rule': ('MatchPattern', 'ActionType', 'Action', 'Rule'),
+    'group': ('GroupType', 'Bucket', 'Group', 'GroupIdAllocator'),
+    'te_objs': ('PassByPathObjective', 'MinLatencyObjective', 'MaxBandwidthObjective'),
+    'fw_placement': ('Placement',),
+    'rule_aggregation': ('Aggregation',),
+}
+
+
+# The version of a topology file is the digest of its content
+def topology_version(topo_file):
+    with open(topo_file, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def take_snapshot(controller, topo_file):
+    """ Returns the snapshot state of `controller`, a dict
+    """
+    return {
+        'format': SNAPSHOT_FORMAT,
+        'topo_file': topo_file,
+        'topology': topology_version(topo_file),
+        'pipeline': controller.pipeline,
+        'group_ids': controller.group_ids,
+        'apps': {name: save_app(getattr(controller, name)) for name in APP_NAMES},
+    }
+
+
+def save_app(app):
+    """ Returns the snapshot data of `app`, a dict, or None if there is no app
+    """
+    if app is None:
+        return None
+    return {
+        'config': {name: getattr(app, name) for name in app.SNAPSHOT_CONFIG},
+        'state': {name: getattr(app, name) for name in app.SNAPSHOT_STATE},
+    }
+
+
+def restore_app(name, data, controller):
+    """ Creates the app `name` (see `APP_CLASSES`) of `controller` from its snapshot `data`
+    """
+    if data is None:
+        return None
+    app = APP_CLASSES[name](of_controller=controller, **data['config'])
+    for attribute, value in data['state'].items():
+        setattr(app, attribute, value)
+    return app
+
+
+def restore_snapshot(controller, state):
+    """ Restores the apps and group ids of a snapshot `state` in `controller`
+    """
+    controller.pipeline = state['pipeline']
+    controller.group_ids = state['group_ids']
+    for name, data in state['apps'].items():
+        setattr(controller, name, restore_app(name, data, controller))
+
+
+class _SnapshotUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if name not in SNAPSHOT_CLASSES.get(module, ()):
+            raise pickle.UnpicklingError('%s.%s is not allowed in a snapshot' % (module, name))
+        return super(_SnapshotUnpickler, self).find_class(module, name)
+
+
+def dump_snapshot(state):
+    return zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+
+
+def parse_snapshot(blob):
+    """ Returns the snapshot state of the bytes `blob`, or None if they are not a snapshot of the current format
+    """
+    try:
+        state = _SnapshotUnpickler(io.BytesIO(zlib.decompress(blob))).load()
+    except (zlib.error, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+    if not isinstance(state, dict) or state.get('format') != SNAPSHOT_FORMAT:
+        return None
+    return state
+
+
+def load_snapshot(path):
+    """ Reads the snapshot at `path`
+
+    Returns:
+        The snapshot state, or None if there is no readable snapshot of the current format
+    """
+    try:
+        with open(path, 'rb') as f:
+            return parse_snapshot(f.read())
+    except OSError:
+        return None
+
+
+class SnapshotWriter:
+    """
+    Writes snapshots to `path`, skipping the snapshots identical to the last one written.
+    The file is replaced atomically, so a crash while writing keeps the previous snapshot.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.digest = None
+
+    # Returns the number of bytes written, 0 if the snapshot did not change
+    def save(self, state):
+        blob = dump_snapshot(state)
+        digest = hashlib.sha1(blob).digest()
+        if digest == self.digest:
+            return 0
+        tmp_path = '%s.tmp' % self.path
+        with open(tmp_path, 'wb') as f:
+            f.write(blob)
+        os.replace(tmp_path, self.path)
+        self.digest = digest
+        return len(blob)
+
+
+# Canonical keys of flows and groups: the same for the messages the controller builds and the stats it reads back
+def action_key(action):
+    return (action.cls_action_type, getattr(action, 'port', None), getattr(action, 'group_id', None))
+
+
+# A drop rule may be reported with or without its empty apply-actions instruction
+def instructions_key(instructions):
+    key = []
+    for inst in instructions:
+        actions = getattr(inst, 'actions', None)
+        if actions is None:
+            key.append((inst.type, getattr(inst, 'table_id', None)))
+        elif actions:
+            key.append((inst.type, tuple(action_key(action) for action in actions)))
+    return tuple(sorted(key))
+
+
+def flow_key(table_id, priority, match, instructions):
+    return (table_id, priority, tuple(sorted(match.items())), instructions_key(instructions))
+
+
+def group_key(group_type, buckets):
+    return (group_type, tuple((bucket.weight, bucket.watch_port, bucket.watch_group,
+                               tuple(action_key(action) for action in bucket.actions)) for bucket in buckets))
+
+
+class Reconciliation:
+    """
+    Brings the tables of one switch to the state of the apps.
+    The flow stats and group descriptions of the switch are collected with `add_flow_stats` and `add_group_descs`
+    (a multipart reply may come in several messages); once `ready`, `apply` sends the differences only.
+    Table-miss entries (priority 0) are owned by the controller and left alone, and so are the reactive entries
+    (see flow_lifecycle.py), which the controller adopts instead.
+    """
+    def __init__(self, datapath):
+        self.datapath = datapath
+        self.flow_stats = []
+        self.group_descs = []
+        self.flows_done = False
+        self.groups_done = False
+
+    def add_flow_stats(self, body, more=False):
+        self.flow_stats.extend(body)
+        self.flows_done = not more
+
+    def add_group_descs(self, body, more=False):
+        self.group_descs.extend(body)
+        self.groups_done = not more
+
+    def ready(self):
+        return self.flows_done and self.groups_done
+
+    def apply(self, of_controller, apps):
+        """ Sends the group and flow changes of the switch: groups first, as the added flows may point to them,
+        then the missing flows, the extra flows, and the extra groups last
+        A flow with the same table, priority and match as a missing flow but other actions is replaced by the ADD
+        of the missing flow; it is not deleted, as a DELETE_STRICT of it would delete the added flow as well
+
+        Returns:
+            A dict of change -> count
+        """
+        datapath = self.datapath
+        ofp = datapath.ofproto
+        ofp_parser = datapath.ofproto_parser
+        counts = {'groups_sent': 0, 'flows_added': 0, 'flows_replaced': 0, 'flows_deleted': 0, 'groups_deleted': 0,
+                  'flows_kept': 0}
+
+        actual_groups = {desc.group_id: group_key(desc.type, desc.buckets) for desc in self.group_descs}
+        of_controller.groups_installed[datapath.id] = set(actual_groups)
+        desired_groups = set()
+        for app in apps:
+            for groups_by_dpid in app.group_store.values():
+                for group in groups_by_dpid.get(datapath.id, []):
+                    desired_groups.add(group.group_id)
+                    if actual_groups.get(group.group_id) != group_key(*app.translate_group(group, datapath)):
+                        app.send_group_to_dp(group, datapath)
+                        counts['groups_sent'] += 1
+
+        actual_flows = {flow_key(stats.table_id, stats.priority, stats.match, stats.instructions): stats
+                        for stats in self.flow_stats if stats.priority != 0 and not is_reactive(stats.cookie)}
+        # A flow entry is identified by its table, priority and match: key[:3]
+        actual_entries = {key[:3] for key in actual_flows}
+        desired_entries = set()
+        for app in apps:
+            for rules_by_dpid in app.rule_store.values():
+                for rule in rules_by_dpid.get(datapath.id, []):
+                    mod = app.build_rule_flow_mod(rule, datapath)
+                    if mod is None:
+                        continue
+                    key = flow_key(mod.table_id, mod.priority, mod.match, mod.instructions)
+                    desired_entries.add(key[:3])
+                    if actual_flows.pop(key, None) is not None:
+                        counts['flows_kept'] += 1
+                    else:
+                        app.send_openflow_rules_to_dp(rule, datapath)
+                        counts['flows_replaced' if key[:3] in actual_entries else 'flows_added'] += 1
+
+        for key, stats in actual_flows.items():
+            if key[:3] in desired_entries:
+                continue
+            mod = ofp_parser.OFPFlowMod(datapath=datapath, table_id=stats.table_id, command=ofp.OFPFC_DELETE_STRICT,
+                                        priority=stats.priority, out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY,
+                                        match=stats.match)
+            datapath.send_msg(mod)
+            counts['flows_deleted'] += 1
+
+        for group_id in set(actual_groups) - desired_groups:
+            of_controller.delete_group(datapath, group_id)
+            counts['groups_deleted'] += 1
+        return counts
+
+
+def request_tables(datapath):
+    """ Requests the flow stats and group descriptions of `datapath` for a Reconciliation
+    """
+    ofp = datapath.ofproto
+    ofp_parser = datapath.ofproto_parser
+    datapath.send_msg(ofp_parser.OFPFlowStatsRequest(datapath, 0, ofp.OFPTT_ALL, ofp.OFPP_ANY, ofp.OFPG_ANY))
+    datapath.send_msg(ofp_parser.OFPGroupDescStatsRequest(datapath, 0))
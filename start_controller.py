@@ -1,20 +1,53 @@
+import os
+import time
+
+import networkx as nx
+
 from ryu.base import app_manager
 from ryu.controller import ofp_event
 from ryu.controller.handler import CONFIG_DISPATCHER, DEAD_DISPATCHER
 from ryu.controller.handler import MAIN_DISPATCHER
 from ryu.controller.handler import set_ev_cls
+from ryu.lib import hub
 from ryu.ofproto import ofproto_v1_3
 from ryu.lib.packet import packet
 from ryu.lib.packet import ethernet
 from ryu.app.wsgi import ControllerBase, WSGIApplication, route
 from webob import Response
 
+from app import FW_TABLE, TE_TABLE, L2_TABLE
 from app_fw import FirewallApp
 from app_l2 import L2ConnectivityApp
 from app_te import TEApp
+from flow_lifecycle import ReactiveFlows
+from flowmod_cache import FlowModCache
+from group import GroupIdAllocator
+from sharding import Shard, parse_members
+from snapshot import Reconciliation, SnapshotWriter, load_snapshot, request_tables, restore_snapshot
+from snapshot import take_snapshot, topology_version
+from topology_reload import reload_topology
 
 INSTANCE_NAME = 'prj_api'
 GRAPH_PATH = './test_case/isp.graphml'
+# If True, the apps install their rules in a multi-table pipeline (firewall -> TE -> L2)
+# instead of stacking their priorities in table 0
+PIPELINE_MODE = False
+# Memory bound of the cache of serialized FlowMods
+FLOWMOD_CACHE_BYTES = 16 * 1024 * 1024
+# The controller state is saved to SNAPSHOT_PATH every SNAPSHOT_INTERVAL seconds, and restored from it on startup
+SNAPSHOT_PATH = './controller.snapshot'
+SNAPSHOT_INTERVAL = 30
+# If True, the L2 app installs its rules on packet-ins, with idle timeouts, instead of ahead of the traffic;
+# the counters of these reactive flows are polled every FLOW_STATS_INTERVAL seconds (see flow_lifecycle.py)
+REACTIVE_L2 = False
+FLOW_STATS_INTERVAL = 5
+# In sharded mode, SDN_SHARD names this instance in the members table SDN_SHARD_MEMBERS
+# ('name=host:port,...', the same on every instance), and the instances split the switches (see sharding.py)
+# The instances authenticate each other with the secret SDN_SHARD_SECRET, which is required in sharded mode:
+# they exchange pickled messages, so anyone knowing the secret and reaching a member port can run code in it
+SHARD_NAME = os.environ.get('SDN_SHARD')
+SHARD_MEMBERS = parse_members(os.environ.get('SDN_SHARD_MEMBERS', ''))
+SHARD_SECRET = os.environ.get('SDN_SHARD_SECRET', '').encode()
 
 class SDNController(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
@@ -23,6 +56,20 @@ class SDNController(app_manager.RyuApp):
     def __init__(self, *args, **kwargs):
         super(SDNController, self).__init__(*args, **kwargs)
         self.datapaths = {}
+        self.pipeline = PIPELINE_MODE
+        # Serialized FlowMods of the app rules, shared by all apps and switches
+        self.flowmod_cache = FlowModCache(FLOWMOD_CACHE_BYTES)
+        self.shard = None
+        if SHARD_NAME:
+            self.shard = Shard(self, SHARD_NAME, SHARD_MEMBERS, SHARD_SECRET, hub=hub)
+            self.shard.handlers = {'start_l2': self.start_l2, 'reload_topology': self.on_shard_reload}
+        self.group_ids = GroupIdAllocator(self.shard.first_group_id() if self.shard else 1) # shared by all apps
+        self.groups_installed = {} # dpid -> set of group ids
+        self.barrier_events = {} # (dpid, xid) -> hub.Event set by the barrier reply
+        self.reload_lock = hub.Semaphore()
+        # The live topology; the apps are created on `graph_path`, which changes when the topology is reloaded
+        self.graph_path = GRAPH_PATH
+        self.topo = None
         wsgi = kwargs['wsgi']
         wsgi.register(ControllerInterface, {INSTANCE_NAME: self})
         
@@ -31,41 +78,303 @@ class SDNController(app_manager.RyuApp):
         self.app_l2 = None
         self.app_te = None
 
-    def add_flow(self, datapath, match, actions, priority, hard_timeout=0):
+        # After a restart from a snapshot, connecting switches are reconciled instead of reprogrammed
+        # The instances of a sharded controller get their rules back from the other instances instead
+        self.warm_restart = False
+        self.reconciling = {} # dpid -> Reconciliation
+        self.snapshots = SnapshotWriter(SNAPSHOT_PATH)
+        self.reactive_flows = ReactiveFlows(self)
+        hub.spawn(self._flow_stats_loop)
+        if self.shard is not None:
+            self.shard.start()
+        else:
+            self.warm_restart = self._restore_snapshot()
+            hub.spawn(self._snapshot_loop)
+
+    def _restore_snapshot(self):
+        state = load_snapshot(SNAPSHOT_PATH)
+        if state is None:
+            return False
+        # The topology file of the snapshot, which may have been reloaded (see topology_reload.py)
+        topo_file = state.get('topo_file', GRAPH_PATH)
+        if state['topology'] != topology_version(topo_file):
+            self.logger.warning('Ignoring the snapshot %s of another topology version', SNAPSHOT_PATH)
+            return False
+        restore_snapshot(self, state)
+        self.graph_path = topo_file
+        self.logger.info('Restored the snapshot %s', SNAPSHOT_PATH)
+        return True
+
+    def save_snapshot(self):
+        if not self.apps():
+            return
+        size = self.snapshots.save(take_snapshot(self, self.graph_path))
+        if size:
+            self.logger.info('Saved a snapshot of %d bytes', size)
+
+    def _snapshot_loop(self):
+        while True:
+            hub.sleep(SNAPSHOT_INTERVAL)
+            self.save_snapshot()
+
+    def _flow_stats_loop(self):
+        while True:
+            hub.sleep(FLOW_STATS_INTERVAL)
+            for dpid, entries in list(self.reactive_flows.entries.items()):
+                if entries and dpid in self.datapaths:
+                    self.reactive_flows.request_stats(self.datapaths[dpid])
+
+    # If `goto_table` is set, the packet continues to that table after `actions` are applied
+    # Reactive rules set `idle_timeout`, `flags` and `cookie` (see flow_lifecycle.py)
+    def add_flow(self, datapath, match, actions, priority, hard_timeout=0, table_id=0, goto_table=None,
+                 idle_timeout=0, flags=0, cookie=0):
+        mod = self.build_flow_mod(datapath, match, actions, priority, hard_timeout, table_id, goto_table,
+                                  idle_timeout, flags, cookie)
+        datapath.send_msg(mod)
+
+    def build_flow_mod(self, datapath, match, actions, priority, hard_timeout=0, table_id=0, goto_table=None,
+                       idle_timeout=0, flags=0, cookie=0):
         ofp = datapath.ofproto
         ofp_parser = datapath.ofproto_parser
 
-        inst = [ofp_parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions)]
-        mod = ofp_parser.OFPFlowMod(datapath=datapath, priority=priority,
-                                    hard_timeout=hard_timeout,
+        inst = []
+        if actions or goto_table is None:
+            inst.append(ofp_parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions))
+        if goto_table is not None:
+            inst.append(ofp_parser.OFPInstructionGotoTable(goto_table))
+        mod = ofp_parser.OFPFlowMod(datapath=datapath, cookie=cookie, table_id=table_id, priority=priority,
+                                    idle_timeout=idle_timeout, hard_timeout=hard_timeout, flags=flags,
                                     match=match, instructions=inst)
+        return mod
+
+    # A group is added the first time it is sent to a switch and modified afterwards
+    def add_group(self, datapath, group_type, group_id, buckets):
+        ofp = datapath.ofproto
+        ofp_parser = datapath.ofproto_parser
+
+        installed = self.groups_installed.setdefault(datapath.id, set())
+        command = ofp.OFPGC_MODIFY if group_id in installed else ofp.OFPGC_ADD
+        installed.add(group_id)
+        mod = ofp_parser.OFPGroupMod(datapath, command, group_type, group_id, buckets)
         datapath.send_msg(mod)
 
+    # A connecting switch may still hold groups from an earlier connection; they are deleted so
+    # the controller knows the group table is empty
+    def _clear_groups(self, datapath):
+        ofp = datapath.ofproto
+        ofp_parser = datapath.ofproto_parser
+
+        self.groups_installed[datapath.id] = set()
+        mod = ofp_parser.OFPGroupMod(datapath, ofp.OFPGC_DELETE, 0, ofp.OFPG_ALL)
+        datapath.send_msg(mod)
+
+    def delete_group(self, datapath, group_id):
+        ofp = datapath.ofproto
+        ofp_parser = datapath.ofproto_parser
+
+        self.groups_installed.setdefault(datapath.id, set()).discard(group_id)
+        datapath.send_msg(ofp_parser.OFPGroupMod(datapath, ofp.OFPGC_DELETE, 0, group_id))
+
+    # Sends a barrier to every datapath in `datapaths` and returns the keys to wait for
+    def send_barriers(self, datapaths):
+        keys = []
+        for datapath in datapaths:
+            msg = datapath.ofproto_parser.OFPBarrierRequest(datapath)
+            datapath.set_xid(msg)
+            key = (datapath.id, msg.xid)
+            self.barrier_events[key] = hub.Event()
+            datapath.send_msg(msg)
+            keys.append(key)
+        return keys
+
+    # Waits for the barrier replies of `keys`; the events of all of them are dropped, even on a timeout
+    def wait_barriers(self, keys, timeout=30.0):
+        deadline = time.time() + timeout
+        try:
+            for key in keys:
+                if not self.barrier_events[key].wait(max(0.0, deadline - time.time())):
+                    raise TimeoutError('No barrier reply from datapath %016x' % key[0])
+        finally:
+            for key in keys:
+                self.barrier_events.pop(key, None)
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def on_barrier_reply(self, ev):
+        event = self.barrier_events.get((ev.msg.datapath.id, ev.msg.xid))
+        if event is not None:
+            event.set()
+
+    # Loads the topology `topo_file` (unless it is given as `new_topo`) and moves the apps to it
+    # with a make-before-break rule delta; reloads run one at a time
+    # The apps move to the new topology before the switches confirm the delta, so the controller commits
+    # the topology with them even if a switch does not confirm it: the connected switches are then reconciled
+    # with the rules of the apps (as after a warm restart), and the TimeoutError is raised again
+    def reload_topology(self, topo_file, new_topo=None):
+        with self.reload_lock:
+            old_topo = self.topo if self.topo is not None else nx.read_graphml(self.graph_path)
+            new_topo = new_topo if new_topo is not None else nx.read_graphml(topo_file)
+            start = time.perf_counter()
+            try:
+                diff, delta = reload_topology(self, old_topo, new_topo, topo_file)
+            except TimeoutError:
+                self.topo = new_topo
+                self.graph_path = topo_file
+                self._reconcile_switches()
+                raise
+            self.topo = new_topo
+            self.graph_path = topo_file
+            self.logger.info('Reloaded the topology %s in %.2fms: %s; %s', topo_file,
+                             (time.perf_counter() - start) * 1000.0, diff, delta)
+            self.report_placement()
+
+    # Dumps the tables of the connected switches and sends the differences with the rules of the apps
+    def _reconcile_switches(self):
+        for dpid, datapath in list(self.datapaths.items()):
+            if self.shard is None or self.shard.owns(dpid):
+                self.reconciling[dpid] = Reconciliation(datapath)
+                request_tables(datapath)
+
+    # A topology reload requested through the REST API, run in the background
+    # The other instances of a sharded controller reload the topology once this one did
+    def reload_in_background(self, topo_file, new_topo):
+        if self._try_reload(topo_file, new_topo) and self.shard is not None:
+            self.shard.broadcast(('reload_topology', topo_file))
+
+    # The topology reload of another instance of a sharded controller
+    def on_shard_reload(self, topo_file):
+        self._try_reload(topo_file)
+
+    # Returns False if the reload failed; the error is logged
+    def _try_reload(self, topo_file, new_topo=None):
+        try:
+            self.reload_topology(topo_file, new_topo)
+        except (OSError, nx.NetworkXError, TimeoutError) as e:
+            self.logger.error('Cannot reload the topology %s: %s', topo_file, e)
+            return False
+        return True
+
+    # Logs the placement of the switch-agnostic firewall rules, and every rule that could not be placed
+    # Returns False if the firewall policy is not fully enforced
+    def report_placement(self):
+        placement = self.app_fw.placement if self.app_fw is not None else None
+        if placement is None:
+            return True
+        self.logger.info('Firewall: %s', placement)
+        for rule in placement.unplaced:
+            self.logger.error('Firewall rule not placed, the policy is not enforced: %s', rule)
+        return placement.complete()
+
+    # Starts the L2 app on the live topology; a sharded instance calculates the destinations of its partition
+    def start_l2(self):
+        self.app_l2 = L2ConnectivityApp(self.graph_path, self, reactive=REACTIVE_L2)
+        self.app_l2.calculate_connectivity_rules()
+
+    # The running apps, in the order their rules are replayed
+    def apps(self):
+        return [app for app in (self.app_fw, self.app_te, self.app_l2) if app is not None]
+
+    # Number of entries the other apps hold in the table of `app`, per switch id
+    # In pipeline mode every app has its own table
+    def reserved_entries(self, app):
+        reserved = {}
+        if self.pipeline:
+            return reserved
+        for other in self.apps():
+            if other is app:
+                continue
+            for rules_by_dpid in other.rule_store.values():
+                for dpid, rules in rules_by_dpid.items():
+                    reserved[dpid] = reserved.get(dpid, 0) + len(rules)
+        return reserved
+
+    # A (re)connecting switch always replaces a stale datapath object, and gets its own stored rules replayed,
+    # or only the differences with its dumped tables after a warm restart
+    # The DEAD event of an old connection may arrive after the new connection is registered; it is ignored
     @set_ev_cls(ofp_event.EventOFPStateChange, [MAIN_DISPATCHER, DEAD_DISPATCHER])
     def on_state_change(self, ev):
         datapath = ev.datapath
         if ev.state == MAIN_DISPATCHER:
-            if not datapath.id in self.datapaths:
-                self.logger.info('Register datapath: %016x', datapath.id)
-                self.datapaths[datapath.id] = datapath
+            self.logger.info('Register datapath: %016x', datapath.id)
+            self.datapaths[datapath.id] = datapath
+            if self.shard is not None and not self.shard.claim(datapath):
+                return
+            if self.warm_restart:
+                self.reconciling[datapath.id] = Reconciliation(datapath)
+                request_tables(datapath)
+            else:
+                self._resync_datapath(datapath)
         elif ev.state == DEAD_DISPATCHER:
-            if datapath.id in self.datapaths:
+            if self.datapaths.get(datapath.id) is datapath:
                 self.logger.info('Unregister datapath: %016x', datapath.id)
                 del self.datapaths[datapath.id]
 
+    def _resync_datapath(self, datapath):
+        start = time.perf_counter()
+        if self.shard is not None:
+            count = self.shard.resync(datapath)
+        else:
+            count = sum(app.send_openflow_rules_for_dp(datapath) for app in self.apps())
+        if count:
+            self.logger.info('Resynced %d rules to datapath %016x in %.2fms',
+                             count, datapath.id, (time.perf_counter() - start) * 1000.0)
+
+    # The flow and group tables dumped by a switch after a warm restart
+    # or the counters of its reactive flows
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def on_flow_stats_reply(self, ev):
+        msg = ev.msg
+        more = msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE
+        if self.reactive_flows.on_flow_stats(msg.datapath.id, msg.xid, msg.body, more):
+            return
+        reconciliation = self.reconciling.get(msg.datapath.id)
+        if reconciliation is not None:
+            reconciliation.add_flow_stats(msg.body, more)
+            self._finish_reconciliation(reconciliation)
+
+    @set_ev_cls(ofp_event.EventOFPGroupDescStatsReply, MAIN_DISPATCHER)
+    def on_group_desc_stats_reply(self, ev):
+        msg = ev.msg
+        reconciliation = self.reconciling.get(msg.datapath.id)
+        if reconciliation is not None:
+            reconciliation.add_group_descs(msg.body, msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE)
+            self._finish_reconciliation(reconciliation)
+
+    def _finish_reconciliation(self, reconciliation):
+        if not reconciliation.ready():
+            return
+        datapath = reconciliation.datapath
+        del self.reconciling[datapath.id]
+        counts = reconciliation.apply(self, self.apps())
+        self.reactive_flows.adopt(datapath.id, reconciliation.flow_stats)
+        self.logger.info('Reconciled datapath %016x: %s', datapath.id,
+                         ', '.join('%s=%d' % item for item in counts.items()))
+
+    # After a warm restart, the groups of a switch are reconciled instead of deleted
+    # In sharded mode, only the owner of a switch sets it up
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def on_switch_features(self, ev):
         datapath = ev.msg.datapath
+        if self.shard is not None and not self.shard.owns(datapath.id):
+            return
+        if not self.warm_restart:
+            self._clear_groups(datapath)
         self._install_table_miss(datapath)
         self.logger.info('Switch: %s Connected', datapath.id)
 
+    # In pipeline mode, a miss in the firewall and TE tables continues to the next stage,
+    # and only a miss in the L2 table is sent to the controller
     def _install_table_miss(self, datapath):
         ofp = datapath.ofproto
         ofp_parser = datapath.ofproto_parser
 
         match = ofp_parser.OFPMatch()
         actions = [ofp_parser.OFPActionOutput(ofp.OFPP_CONTROLLER, ofp.OFPCML_NO_BUFFER)]
-        self.add_flow(datapath, match=match, actions=actions, priority=0)
+        if not self.pipeline:
+            self.add_flow(datapath, match=match, actions=actions, priority=0)
+            return
+        self.add_flow(datapath, match=match, actions=[], priority=0, table_id=FW_TABLE, goto_table=TE_TABLE)
+        self.add_flow(datapath, match=match, actions=[], priority=0, table_id=TE_TABLE, goto_table=L2_TABLE)
+        self.add_flow(datapath, match=match, actions=actions, priority=0, table_id=L2_TABLE)
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def on_packet_in(self, ev):
@@ -82,6 +391,27 @@ class SDNController(app_manager.RyuApp):
 
         self.logger.info('Received a packet!')
 
+        # A reactive L2 app installs the rule of the switch towards the destination, and the pkt continues with it
+        app = self.app_l2
+        if app is None or not app.reactive:
+            return
+        rule = app.reactive_rule(dpid, dst_mac)
+        if rule is None:
+            return
+        evicted = self.reactive_flows.install(app, rule, datapath)
+        if evicted:
+            self.logger.info('Evicted %d reactive flows from datapath %016x', evicted, dpid)
+        data = msg.data if msg.buffer_id == ofproto.OFP_NO_BUFFER else None
+        out = parser.OFPPacketOut(datapath=datapath, buffer_id=msg.buffer_id, in_port=in_port,
+                                  actions=app.translate_rule(rule, datapath)[1], data=data)
+        datapath.send_msg(out)
+
+    # A reactive flow expired or was deleted
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def on_flow_removed(self, ev):
+        msg = ev.msg
+        self.reactive_flows.on_flow_removed(msg.datapath.id, msg.cookie)
+
 
 class ControllerInterface(ControllerBase):
     def __init__(self, req, link, data, **config):
@@ -94,20 +424,23 @@ class ControllerInterface(ControllerBase):
         input_file = req.POST.get('input_file', './test_case/firewall.json')
         # Initializes `app_fw` in `controller` and calls `from_json`
         # Calls `calculate_firewall_rules`
-        # Returns status code 200
-        controller.app_fw = FirewallApp(input_file, controller)
+        # Returns status code 200, or 500 if switch-agnostic rules do not fit the tables of the switches
+        controller.app_fw = FirewallApp(input_file, controller, topo_file=controller.graph_path)
         controller.app_fw.from_json()
-        controller.app_fw.calculate_firewall_rules()
+        controller.app_fw.calculate_firewall_rules(controller.reserved_entries(controller.app_fw))
+        if not controller.report_placement():
+            return Response(status=500)
         return Response(status=200)
 
     @route('prj', '/l2/start', methods=['GET', 'POST'])
     def l2_start(self, req, **kwargs):
         controller = self.controller
         # Initializes `app_l2` in `controller`
-        # Calls `calculate_connectivity_rules`
+        # Calls `calculate_connectivity_rules`, on every instance of a sharded controller
         # Returns status code 200
-        controller.app_l2 = L2ConnectivityApp(GRAPH_PATH, controller)
-        controller.app_l2.calculate_connectivity_rules()
+        controller.start_l2()
+        if controller.shard is not None:
+            controller.shard.broadcast(('start_l2',))
         return Response(status=200)
 
     @route('prj', '/te/start', methods=['POST'])
@@ -116,7 +449,7 @@ class ControllerInterface(ControllerBase):
         input_file = req.POST.get('input_file', './test_case/te.json')
         # Initializes `app_te` in `controller` and calls `from_json`
         # Returns status code 200
-        controller.app_te = TEApp(GRAPH_PATH, input_file, controller)
+        controller.app_te = TEApp(controller.graph_path, input_file, controller, aggregate=True)
         controller.app_te.from_json()
         return Response(status=200)
 
@@ -131,6 +464,8 @@ class ControllerInterface(ControllerBase):
         if controller.app_te is None:
             return Response(status=500)
         controller.app_te.provision_pass_by_paths()
+        if 'pass_by_paths' in controller.app_te.aggregations:
+            controller.logger.info('TE pass_by_paths: %s', controller.app_te.aggregations['pass_by_paths'])
         return Response(status=200)
         
     @route('prj', '/te/provision_min_latency_paths', methods=['GET', 'POST'])
@@ -144,6 +479,8 @@ class ControllerInterface(ControllerBase):
         if controller.app_te is None:
             return Response(status=500)
         controller.app_te.provision_min_latency_paths()
+        if 'min_latency' in controller.app_te.aggregations:
+            controller.logger.info('TE min_latency: %s', controller.app_te.aggregations['min_latency'])
         return Response(status=200)
 
     @route('prj', '/te/provision_max_bandwidth_paths', methods=['GET'])
@@ -158,4 +495,19 @@ class ControllerInterface(ControllerBase):
         if controller.app_te is None:
             return Response(status=500)
         controller.app_te.provision_max_bandwidth_paths()
-        return Response(status=200)
\ No newline at end of file
+        return Response(status=200)
+
+    @route('prj', '/topology/reload', methods=['POST'])
+    def topology_reload(self, req, **kwargs):
+        controller = self.controller
+        topo_file = req.POST.get('topo_file', controller.graph_path)
+        # Loads the graphml `topo_file`, and sends the rule delta of the running apps in the background,
+        # as the switches may take up to 30s to confirm it (the outcome is logged)
+        # Returns status code 202, or 500 if the file cannot be loaded
+        try:
+            new_topo = nx.read_graphml(topo_file)
+        except (OSError, nx.NetworkXError) as e:
+            controller.logger.error('Cannot reload the topology %s: %s', topo_file, e)
+            return Response(status=500)
+        hub.spawn(controller.reload_in_background, topo_file, new_topo)
+        return Response(status=202)
@@ -3,7 +3,10 @@ Creates a project topology using Mininet
 """
 import sys
 import atexit
+import tempfile
+import time
 
+from network_bringup import plan_bringup, apply_bringup, print_timings
 from utils_net import mn_get_host_ip, mn_get_host_mac
 from utils_ports import get_out_port_for_src, get_in_port_for_dst
 
@@ -11,7 +14,6 @@ import networkx as nx
 from mininet.topo import Topo
 from mininet.node import RemoteController
 from mininet.link import TCLink
-from mininet.util import custom
 from mininet.net import Mininet
 from mininet.cli import CLI
 from mininet.clean import cleanup
@@ -177,43 +179,17 @@ if __name__ == '__main__':
     #       The default server port values are:
     #           TCP server: 80
     #           UDP server: 8080
-    # 3. The iperf3 commands are (use the cmd() function in Mininet APIs):
-    #       For a TCP server:
-    #           'iperf3 -s -p %d -D --logfile %s-tcp-server.log' % (tcp_port, h.name)
-    #       For a UDP server:
-    #           'iperf3 -s -p %d -D --logfile %s-udp-server.log' % (udp_port, h.name)
-    # 4. Add default gateways for hosts
-    # 5. Diable IPv6 for hosts and switches
-    graph = network.topo.graph
-    for h in network.hosts:
-        node_id = h.name[1:]
-        has_tcp_server = graph.nodes[node_id].get('tcp_server', False)
-        has_udp_server = graph.nodes[node_id].get('udp_server', False)
-        
-        if has_tcp_server:
-            tcp_port = graph.nodes[node_id].get('tcp_port', 80)
-            h.cmd('iperf3 -s -p %d -D --logfile %s-tcp-server.log' % (tcp_port, h.name))
-        
-        if has_udp_server:
-            udp_port = graph.nodes[node_id].get('udp_port', 8080)
-            h.cmd('iperf3 -s -p %d -D --logfile %s-udp-server.log' % (udp_port, h.name))
-
-        # Set up ARP rules; no need for our switches to forward ARP pkts
-        for h_other in network.hosts:
-            if h != h_other:
-                h.cmd('arp -s %s -i %s-eth1 %s' % (h_other.IP(), h, h_other.MAC()))
-        # Add default gateways for h1 and h2, as they are in separate subnets
-        h.cmd("ip route add default via %s" % h.IP())
-
-        # Diable IPv6 for hosts and switches
-        h.cmd("sysctl -w net.ipv6.conf.all.disable_ipv6=1")
-        h.cmd("sysctl -w net.ipv6.conf.default.disable_ipv6=1")
-        h.cmd("sysctl -w net.ipv6.conf.lo.disable_ipv6=1")
-    
-    for sw in network.switches:
-        sw.cmd("sysctl -w net.ipv6.conf.all.disable_ipv6=1")
-        sw.cmd("sysctl -w net.ipv6.conf.default.disable_ipv6=1")
-        sw.cmd("sysctl -w net.ipv6.conf.lo.disable_ipv6=1")
+    # 3. Add default gateways for hosts
+    # 4. Diable IPv6 for hosts and switches
+    # The commands of every node are planned by `plan_bringup` (see network_bringup.py),
+    # then each node runs its commands in one shell round-trip, concurrently with the other nodes
+    # The neighbor files are only read while the hosts run their commands
+    with tempfile.TemporaryDirectory(prefix='cmpt471-neigh-') as neigh_dir:
+        start = time.perf_counter()
+        plan = plan_bringup(network.topo.graph, neigh_dir)
+        timings = {'plan': time.perf_counter() - start}
+        timings.update(apply_bringup(network, plan))
+    print_timings(timings)
 
     network.start()
     ProjectCLI(mininet=network)
@@ -0,0 +1,43 @@
+from rule import Rule, Action, ActionType, MatchPattern
+from app_fw import FirewallApp
+
+GRAPH_FILE = './test_case/isp.graphml'
+
+def drop_rule(**fields):
+    return Rule(switch_id=None, match_pattern=MatchPattern(**fields), action=Action(action_type=ActionType.DROP))
+
+# Switch-agnostic rules (switch_id is null) are placed by the app in the topology
+app_fw = FirewallApp(json_file=None, topo_file=GRAPH_FILE)
+app_fw.topo.nodes['6']['table_capacity'] = 1
+# Rule 1: Drop all TCP traffic to '10.0.0.5' port 22, placed once at switch 5
+app_fw.add_rule(drop_rule(ip_proto=6, dst_ip='10.0.0.5', dst_port=22))
+# Rule 2: A duplicate of rule 1, removed
+app_fw.add_rule(drop_rule(ip_proto=6, dst_ip='10.0.0.5', dst_port=22))
+# Rule 3: Drop all UDP traffic from '10.0.0.6' to port 53, placed at switch 6, which is full afterwards
+app_fw.add_rule(drop_rule(ip_proto=17, src_ip='10.0.0.6', dst_port=53))
+# Rule 4: Drop all TCP traffic from '10.0.0.6' to port 80, replicated at the neighbours of switch 6
+app_fw.add_rule(drop_rule(ip_proto=6, src_ip='10.0.0.6', dst_port=80))
+# Rule 5: Drop all UDP traffic to port 161, placed at a vertex cover of the links
+app_fw.add_rule(drop_rule(ip_proto=17, dst_port=161))
+app_fw.calculate_firewall_rules()
+print(app_fw.placement)
+for rule in app_fw.rules:
+    print(rule)
+
+print()
+
+# Switches 1 and 4 are full: no switch on the link between them can hold rule 5,
+# and the rule from '10.0.0.4' to '10.0.0.1' fits neither these switches nor all their neighbours
+app_fw = FirewallApp(json_file=None, topo_file=GRAPH_FILE)
+app_fw.topo.nodes['1']['table_capacity'] = 0
+app_fw.topo.nodes['4']['table_capacity'] = 0
+app_fw.add_rule(drop_rule(ip_proto=6, src_ip='10.0.0.4', dst_ip='10.0.0.1'))
+app_fw.add_rule(drop_rule(ip_proto=17, dst_port=161))
+app_fw.add_rule(drop_rule(ip_proto=6, dst_ip='10.0.0.3', dst_port=22))
+app_fw.calculate_firewall_rules()
+print(app_fw.placement)
+for rule in app_fw.rules:
+    print(rule)
+print('Unplaced:')
+for rule in app_fw.placement.unplaced:
+    print(rule)
@@ -0,0 +1,60 @@
+from app_fw import FirewallApp
+from app_l2 import L2ConnectivityApp
+from app_te import TEApp
+from flowmod_cache import FlowModCache
+from mock_datapath import HarnessController
+
+GRAPH_FILE = './test_case/isp.graphml'
+TE_FILE = './test_case/te.json'
+FW_FILE = './test_case/firewall.json'
+
+
+# A controller whose datapaths record the bytes of every message they send
+def start_controller(flowmod_cache=None):
+    controller = HarnessController(list(range(1, 7)), flowmod_cache=flowmod_cache)
+    controller.sent = {}
+    for datapath in controller.datapaths.values():
+        controller.sent[datapath.id] = sent = []
+
+        def send(buf, send=datapath.send, sent=sent):
+            sent.append(bytes(buf))
+            send(buf)
+        datapath.send = send
+    controller.app_fw = FirewallApp(FW_FILE, controller, topo_file=GRAPH_FILE)
+    controller.app_te = TEApp(GRAPH_FILE, TE_FILE, controller)
+    controller.app_l2 = L2ConnectivityApp(GRAPH_FILE, controller)
+    return controller
+
+
+def run(controller):
+    controller.app_l2.calculate_connectivity_rules()
+    controller.app_te.from_json()
+    controller.app_te.provision_pass_by_paths()
+    controller.app_te.provision_min_latency_paths()
+    controller.app_fw.from_json()
+    controller.app_fw.calculate_firewall_rules(controller.reserved_entries(controller.app_fw))
+    yield 'Install'
+    # Every switch reconnects, and gets the stored rules replayed from the cache
+    for datapath in controller.datapaths.values():
+        datapath.switch.clear()
+        for app in controller.apps():
+            app.send_openflow_rules_for_dp(datapath)
+    yield 'Replay to every switch'
+    # The L2 rules are calculated again: the unchanged ones hit the cache
+    controller.app_l2.calculate_connectivity_rules()
+    yield 'Recalculate the L2 rules'
+
+
+uncached = start_controller()
+cache = FlowModCache()
+cached = start_controller(cache)
+# A cache too small for the L2 rules of a switch evicts entries, which are encoded again on their next send
+small_cache = FlowModCache(max_bytes=1024)
+small = start_controller(small_cache)
+
+for step, _, _ in zip(run(uncached), run(cached), run(small)):
+    print('%s: %d hits, %d misses, %d entries, %d bytes' % (step, cache.hits, cache.misses, len(cache.entries),
+                                                           cache.size))
+    print('\tWith a 1024-byte cache: %d hits, %d misses, %d entries, %d bytes' % (
+        small_cache.hits, small_cache.misses, len(small_cache.entries), small_cache.size))
+    print('\tBytes sent identical to the uncached path: %s' % (uncached.sent == cached.sent == small.sent))
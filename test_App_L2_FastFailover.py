@@ -0,0 +1,28 @@
+from app_l2 import L2ConnectivityApp
+
+GRAPH_FILE = './test_case/isp.graphml'
+
+# Every rule forwards through a fast-failover group whose backup bucket leads to a loop-free alternate
+app_l2 = L2ConnectivityApp(topo_file=GRAPH_FILE, fast_failover=True)
+app_l2.calculate_connectivity_rules()
+
+print('Fast-failover L2 Rules:')
+for rule in app_l2.rules:
+    print(rule)
+
+print()
+
+print('Fast-failover Groups:')
+for dpid in sorted(app_l2.groups_by_dpid):
+    for group_id in sorted(app_l2.groups_by_dpid[dpid]):
+        print(app_l2.groups_by_dpid[dpid][group_id])
+
+print()
+
+# The loop-free alternates towards switch 6: a neighbour no farther from switch 6 than the switch itself,
+# the nearest one first; None if every other neighbour is farther
+dist = app_l2.hop_distances('6')
+print('Loop-free Alternates to Switch 6:')
+for switch in sorted(app_l2.topo.nodes()):
+    for primary in sorted(app_l2.topo.neighbors(switch)):
+        print('Switch %s, primary %s: %s' % (switch, primary, app_l2.loop_free_alternate(switch, primary, dist)))
@@ -0,0 +1,104 @@
+from netaddr import IPAddress, IPNetwork
+from ryu.ofproto import ofproto_v1_3
+
+from app import FW_TABLE, TE_TABLE, L2_TABLE
+from app_fw import FirewallApp
+from app_l2 import L2ConnectivityApp
+from app_te import TEApp
+from mock_datapath import HarnessController
+from start_controller import SDNController
+from utils_net import mn_get_host_ip, mn_get_host_mac
+
+GRAPH_FILE = './test_case/isp.graphml'
+TE_FILE = './test_case/te.json'
+FW_FILE = './test_case/firewall.json'
+
+
+# Starts the firewall, TE and L2 apps of `controller` and installs their rules after the table-miss entries
+def start_apps(controller):
+    for datapath in controller.datapaths.values():
+        SDNController._install_table_miss(controller, datapath)
+    controller.app_fw = FirewallApp(FW_FILE, controller, topo_file=GRAPH_FILE)
+    controller.app_te = TEApp(GRAPH_FILE, TE_FILE, controller)
+    controller.app_l2 = L2ConnectivityApp(GRAPH_FILE, controller)
+    controller.app_l2.calculate_connectivity_rules()
+    controller.app_te.from_json()
+    controller.app_te.provision_pass_by_paths()
+    controller.app_te.provision_min_latency_paths()
+    controller.app_fw.from_json()
+    controller.app_fw.calculate_firewall_rules(controller.reserved_entries(controller.app_fw))
+
+
+def matches(entry, packet):
+    for field, value in entry.match_fields().items():
+        if isinstance(value, tuple):
+            if IPAddress(packet.get(field, '0.0.0.0')) not in IPNetwork('%s/%s' % value):
+                return False
+        elif packet.get(field) != value:
+            return False
+    return True
+
+
+# The tables a packet goes through at `switch`, and what the last one does with it
+def walk(switch, packet):
+    steps = []
+    table_id = 0
+    while table_id is not None:
+        entries = [entry for entry in switch.flow_table.values()
+                   if entry.table_id == table_id and matches(entry, packet)]
+        if not entries:
+            steps.append('table %d: miss, drop' % table_id)
+            break
+        entry = max(entries, key=lambda entry: entry.priority)
+        table_id = None
+        actions = []
+        for inst in entry.instructions:
+            if hasattr(inst, 'table_id'):
+                table_id = inst.table_id
+            else:
+                for action in inst.actions:
+                    port = action.port
+                    actions.append('controller' if port == ofproto_v1_3.OFPP_CONTROLLER else 'output %d' % port)
+        if table_id is not None:
+            actions.append('goto table %d' % table_id)
+        steps.append('table %d (priority %d): %s' % (entry.table_id, entry.priority, ', '.join(actions) or 'drop'))
+    return steps
+
+
+def flows_per_table(controller):
+    counts = {}
+    for datapath in controller.datapaths.values():
+        for entry in datapath.switch.flow_table.values():
+            counts[entry.table_id] = counts.get(entry.table_id, 0) + 1
+    return counts
+
+
+controller = HarnessController(list(range(1, 7)), pipeline=True)
+start_apps(controller)
+single = HarnessController(list(range(1, 7)))
+start_apps(single)
+
+print('Flows per table, pipeline: %s' % sorted(flows_per_table(controller).items()))
+print('Flows per table, single table: %s' % sorted(flows_per_table(single).items()))
+# Every app's rules are in its own table, with the table-miss entry of that table
+for app, table_id in ((controller.app_fw, FW_TABLE), (controller.app_te, TE_TABLE), (controller.app_l2, L2_TABLE)):
+    print('%s in table %d only: %s' % (type(app).__name__, table_id, all(
+        entry.table_id == table_id for datapath in controller.datapaths.values()
+        for entry in datapath.switch.flow_table.values() if entry.priority == app.priority)))
+
+print()
+
+# Packets from the host of switch 1 to the host of switch 6
+switch = controller.datapaths[1].switch
+base = {'in_port': 1, 'eth_type': 0x800, 'eth_src': mn_get_host_mac('1'), 'eth_dst': mn_get_host_mac('6'),
+        'ipv4_src': mn_get_host_ip('1'), 'ipv4_dst': mn_get_host_ip('6')}
+packets = [
+    ('UDP to port 80 (dropped by the firewall)', dict(base, ip_proto=17, udp_dst=80)),
+    ('UDP to port 53 (min-latency TE path)', dict(base, ip_proto=17, udp_dst=53)),
+    ('TCP (L2 forwarding)', dict(base, ip_proto=6, tcp_dst=22)),
+    ('Unknown destination MAC', dict(base, eth_dst='00:00:00:00:00:99', ip_proto=6, tcp_dst=22)),
+]
+for name, packet in packets:
+    print('Switch 1, %s:' % name)
+    for step in walk(switch, packet):
+        print('\t%s' % step)
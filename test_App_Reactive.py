@@ -0,0 +1,81 @@
+from app_l2 import L2ConnectivityApp
+from flow_lifecycle import REACTIVE_COOKIE, ReactiveFlows
+from mock_datapath import HarnessController, match_key
+from utils_net import mn_get_host_mac
+
+GRAPH_FILE = './test_case/isp.graphml'
+CAPACITY = 5
+
+
+# The reactive entries of the view of a switch, by the destination of their pkts and their cookie number
+def view(reactive_flows, dpid):
+    return sorted((int(entry.match['eth_dst'].replace(':', ''), 16), entry.cookie & ~REACTIVE_COOKIE)
+                  for entry in reactive_flows.entries.get(dpid, {}).values())
+
+
+def entries(datapath):
+    return sorted((int(entry.match['eth_dst'].replace(':', ''), 16), entry.cookie & ~REACTIVE_COOKIE)
+                  for entry in datapath.switch.flow_table.values() if entry.cookie & REACTIVE_COOKIE)
+
+
+def install(dst):
+    reactive_flows.install(app_l2, app_l2.reactive_rule(2, mn_get_host_mac(dst)), datapath)
+
+
+def key(dst):
+    mod = app_l2.build_rule_flow_mod(app_l2.reactive_rule(2, mn_get_host_mac(dst)), datapath)
+    return (mod.table_id, mod.priority, match_key(mod.match))
+
+
+def show(step):
+    print('%s: switch %s, view %s, %d installs, %d evictions, %d removals' % (
+        step, entries(datapath), view(reactive_flows, 2), reactive_flows.installs, reactive_flows.evictions,
+        reactive_flows.removals))
+
+
+controller = HarnessController([2, 3])
+app_l2 = L2ConnectivityApp(topo_file=GRAPH_FILE, of_controller=controller, reactive=True)
+controller.app_l2 = app_l2
+app_l2.calculate_connectivity_rules()
+# Switch 2 holds CAPACITY entries; with the table-miss entry counted, up to 3 reactive entries stay below HIGH_WATER
+app_l2.topo.nodes['2']['table_capacity'] = CAPACITY
+reactive_flows = controller.reactive_flows = ReactiveFlows(controller, idle_timeout=10)
+datapath = controller.datapaths[2]
+datapath.switch.capacity = CAPACITY
+
+for dst in ('1', '3', '4'):
+    install(dst)
+show('Install 1, 3, 4')
+
+# The entries to 1 and 4 get pkts, which the next poll sees: the entry to 3 is the least recently hit
+datapath.switch.hit(key('1'))
+datapath.switch.hit(key('4'))
+reactive_flows.request_stats(datapath)
+install('5')
+show('Poll, then install 5 (evicts the entry to 3)')
+
+# Only the entry to 5 gets pkts in the last idle timeout
+now = max(entry.last_used for entry in datapath.switch.flow_table.values())
+datapath.switch.hit(key('5'), now=now + 8)
+for msg in datapath.switch.expire(now=now + 10):
+    datapath.deliver(msg)
+show('Idle timeout of the entries to 1 and 4')
+
+# An entry removed without a FlowRemoved message is dropped from the view by the next poll
+install('6')
+del datapath.switch.flow_table[key('6')]
+reactive_flows.request_stats(datapath)
+show('Install 6, lost FlowRemoved, then poll')
+
+# A warm-restarted controller adopts the reactive entries of the switch, and numbers the next ones after them
+install('1')
+restarted = ReactiveFlows(controller)
+restarted.adopt(2, datapath.switch.flow_stats(datapath.ofproto.OFPTT_ALL))
+print('Adopted after a warm restart: view %s, next cookie %d' % (view(restarted, 2), restarted.next_cookie))
+
+# A flush deletes the reactive entries only (by their cookie bit), and not the permanent ones
+parser = datapath.ofproto_parser
+controller.add_flow(datapath, match=parser.OFPMatch(eth_type=0x800, ipv4_dst='192.0.2.1'), actions=[], priority=1)
+reactive_flows.flush(datapath)
+show('Flush')
+print('Switch 2 flows after the flush: %d' % len(datapath.switch.flow_table))
@@ -0,0 +1,46 @@
+from app_l2 import L2ConnectivityApp
+from mock_datapath import HarnessController, match_key
+from rule import Action, ActionType, MatchPattern, Rule
+from snapshot import SNAPSHOT_FORMAT, dump_snapshot, flow_key, parse_snapshot, restore_app, save_app
+from utils_net import mn_get_host_mac
+
+GRAPH_FILE = './test_case/isp.graphml'
+
+
+def table(switch):
+    return sorted(flow_key(entry.table_id, entry.priority, entry.match, entry.instructions)
+                  for entry in switch.flow_table.values())
+
+
+app_l2 = L2ConnectivityApp(topo_file=GRAPH_FILE)
+app_l2.calculate_connectivity_rules()
+controller = HarnessController(sorted(int(node) for node in app_l2.topo.nodes()))
+app_l2.of_controller = controller
+for datapath in controller.datapaths.values():
+    app_l2.send_openflow_rules_for_dp(datapath)
+expected = {dpid: table(datapath.switch) for dpid, datapath in controller.datapaths.items()}
+
+# Switch 2 drifts from the rules of the app while the controller is down:
+# the flow to the host of switch 1 is missing, a flow to an unknown host is extra,
+# and the flow to the host of switch 6 forwards to the host port instead of its next hop
+datapath = controller.datapaths[2]
+rules = {rule.match_pattern.dst_mac: rule for rule in app_l2.rules_by_dpid[2]}
+mod = app_l2.build_rule_flow_mod(rules[mn_get_host_mac('1')], datapath)
+del datapath.switch.flow_table[mod.table_id, mod.priority, match_key(mod.match)]
+extra = Rule(switch_id=2, match_pattern=MatchPattern(dst_mac='00:00:00:00:00:99'), action=Action(ActionType.DROP))
+app_l2.send_openflow_rules_to_dp(extra, datapath)
+pattern = rules[mn_get_host_mac('6')].match_pattern
+changed = Rule(switch_id=2, match_pattern=pattern, action=Action(ActionType.FORWARD, out_port=1))
+app_l2.send_openflow_rules_to_dp(changed, datapath)
+print('Switch 2 before: %d flows' % len(datapath.switch.flow_table))
+
+# The app restarts from a snapshot, and every switch is reconciled with its rules
+blob = dump_snapshot({'format': SNAPSHOT_FORMAT, 'apps': {'app_l2': save_app(app_l2)}})
+restored = restore_app('app_l2', parse_snapshot(blob)['apps']['app_l2'], controller)
+for dpid, datapath in sorted(controller.datapaths.items()):
+    counts = controller.reconcile(datapath, [restored])
+    print('Switch %d: %s' % (dpid, ', '.join('%s=%d' % item for item in counts.items())))
+
+print('Switch 2 after: %d flows' % len(controller.datapaths[2].switch.flow_table))
+print('Tables equal to the rules of the app: %s' % all(
+    table(datapath.switch) == expected[dpid] for dpid, datapath in controller.datapaths.items()))
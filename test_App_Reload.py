@@ -0,0 +1,79 @@
+import networkx as nx
+
+from app_fw import FirewallApp
+from app_l2 import L2ConnectivityApp
+from app_te import TEApp
+from mock_datapath import FakeDatapath, HarnessController
+from snapshot import flow_key
+from topology_reload import reload_topology
+
+GRAPH_FILE = './test_case/isp.graphml'
+TE_FILE = './test_case/te.json'
+FW_FILE = './test_case/firewall.json'
+
+
+def table(switch):
+    return sorted(flow_key(entry.table_id, entry.priority, entry.match, entry.instructions)
+                  for entry in switch.flow_table.values())
+
+
+# Starts the firewall, TE and L2 apps of `controller` on `topo`, and installs their rules
+def start_apps(controller, topo):
+    controller.app_l2 = L2ConnectivityApp(GRAPH_FILE, controller)
+    controller.app_te = TEApp(GRAPH_FILE, TE_FILE, controller)
+    controller.app_fw = FirewallApp(FW_FILE, controller, topo_file=GRAPH_FILE)
+    for app in controller.apps():
+        app.set_topology(topo)
+    controller.app_l2.calculate_connectivity_rules()
+    controller.app_te.from_json()
+    controller.app_te.provision_pass_by_paths()
+    controller.app_te.provision_min_latency_paths()
+    controller.app_fw.from_json()
+    controller.app_fw.calculate_firewall_rules(controller.reserved_entries(controller.app_fw))
+
+
+# A new switch connects to the controller and gets the rules of the apps
+def connect(controller, dpid):
+    datapath = controller.datapaths[dpid] = FakeDatapath(dpid, on_reply=controller.on_reply)
+    for app in controller.apps():
+        app.send_openflow_rules_for_dp(datapath)
+
+
+topo = nx.read_graphml(GRAPH_FILE)
+controller = HarnessController(sorted(int(node) for node in topo.nodes()))
+start_apps(controller, topo)
+
+# Every change is reloaded into the running apps, whose switch tables must equal the ones of apps started
+# on the new topology
+changes = []
+delay = topo.copy()
+delay.edges['1', '4']['delay'] = 100
+changes.append(('Delay of link 1-4 (on the min-latency path 1->6) raised to 100', delay))
+removed = delay.copy()
+removed.remove_edge('4', '5')
+changes.append(('Link 4-5 removed', removed))
+added = removed.copy()
+added.add_edge('3', '7', delay=1, bw=100)
+added.add_edge('6', '7', delay=1, bw=100)
+changes.append(('Switch 7 added, linked to 3 and 6', added))
+
+for name, new_topo in changes:
+    diff, delta = reload_topology(controller, topo, new_topo)
+    for node in sorted(diff.added_nodes, key=int):
+        connect(controller, int(node))
+    topo = new_topo
+    fresh = HarnessController(sorted(int(node) for node in topo.nodes()))
+    start_apps(fresh, topo)
+    print('%s: %s' % (name, diff))
+    print('\t%s' % delta)
+    print('\tTables equal to apps started on the new topology: %s' % all(
+        table(controller.datapaths[dpid].switch) == table(datapath.switch)
+        for dpid, datapath in fresh.datapaths.items()))
+
+# A reload whose delta times out is followed by the reconciliation of every switch with the apps,
+# which keeps every flow of a reloaded table
+totals = {}
+for dpid, datapath in sorted(controller.datapaths.items()):
+    for change, count in controller.reconcile(datapath, controller.apps()).items():
+        totals[change] = totals.get(change, 0) + count
+print('Reconciliation after the reloads: %s' % ', '.join('%s=%d' % item for item in totals.items()))
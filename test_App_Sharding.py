@@ -0,0 +1,125 @@
+import threading
+
+import networkx as nx
+
+from app_l2 import L2ConnectivityApp
+from group import GroupIdAllocator
+from mock_datapath import FakeDatapath, FakeSwitch, HarnessController
+from sharding import REPLICAS, Shard
+from snapshot import flow_key
+
+GRAPH_FILE = './test_case/isp.graphml'
+NAMES = ['shard0', 'shard1', 'shard2', 'shard3']
+
+
+class SyncHub:
+    """
+    Runs the spawned functions right away, so the members of the shard handle every message in a fixed order
+    The locks are re-entrant, as a member may handle a message while it is sending one
+    """
+    @staticmethod
+    def spawn(func, *args, **kwargs):
+        func(*args, **kwargs)
+
+    @staticmethod
+    def sleep(seconds):
+        pass
+
+    Semaphore = threading.RLock
+
+
+class LocalShard(Shard):
+    """
+    A member of a shard whose other members run in the same process: a message is handled by the member
+    it is sent to before `send` returns, and a failed member is not reachable
+    """
+    def __init__(self, of_controller, name, members, peers):
+        super(LocalShard, self).__init__(of_controller, name, members, b'test-secret', hub=SyncHub)
+        self.peers = peers
+
+    def _send(self, member, message):
+        peer = self.peers.get(member)
+        if peer is None or not peer.running:
+            return False
+        peer.handle(message)
+        return True
+
+
+def table(switch):
+    return sorted(flow_key(entry.table_id, entry.priority, entry.match, entry.instructions)
+                  for entry in switch.flow_table.values())
+
+
+topo = nx.read_graphml(GRAPH_FILE)
+dpids = sorted(int(node) for node in topo.nodes())
+
+# The tables of a single controller are the reference
+single = HarnessController(dpids)
+L2ConnectivityApp(GRAPH_FILE, single).calculate_connectivity_rules()
+expected = {dpid: table(single.datapaths[dpid].switch) for dpid in dpids}
+
+# Every member is connected to the same switches
+switches = {dpid: FakeSwitch(dpid) for dpid in dpids}
+members = {name: None for name in NAMES}
+peers = {}
+
+
+def start_member(name):
+    controller = HarnessController([])
+    controller.datapaths = {dpid: FakeDatapath(dpid, switches[dpid], controller.on_reply) for dpid in dpids}
+    controller.shard = LocalShard(controller, name, members, peers)
+    controller.group_ids = GroupIdAllocator(controller.shard.first_group_id())
+    # As `Shard.start`, without the listener and the heartbeat
+    shard = controller.shard
+    shard.running = True
+    peers[name] = shard
+    joined = [member for member in sorted(peers) if member != name and shard._send(member, ('join', name))]
+    if joined:
+        shard._change_ring(added=joined)
+    return controller
+
+
+# A switch that restarts with empty tables is claimed by its owner, which replays the rules it holds for it
+def reconnect_switches():
+    for dpid in dpids:
+        switches[dpid].clear()
+        for shard in peers.values():
+            datapath = shard.of_controller.datapaths[dpid]
+            if shard.claim(datapath):
+                shard.resync(datapath)
+
+
+def check(step):
+    owned = {name: [dpid for dpid in dpids if shard.owns(dpid)] for name, shard in sorted(peers.items())}
+    print('%s: %s' % (step, ', '.join('%s owns %s' % (name, owned[name]) for name in owned)))
+    print('\tTables equal to a single controller: %s' % all(
+        table(switches[dpid]) == expected[dpid] for dpid in dpids))
+    # After a ring change, a member only holds the rules of the switches it owns or backs up
+    print('\tRules held by owners and backups only: %s' % all(
+        name in shard.ring.owners(dpid, REPLICAS)
+        for name, shard in peers.items() for store in shard.stores.values()
+        for by_dpid in store.rule_store.values() for dpid in by_dpid))
+
+
+# Three members; each one calculates the L2 rules of the destinations it owns
+for name in NAMES[:3]:
+    start_member(name)
+for shard in list(peers.values()):
+    shard.of_controller.app_l2 = L2ConnectivityApp(GRAPH_FILE, shard.of_controller)
+    shard.of_controller.app_l2.calculate_connectivity_rules()
+check('Start')
+
+# shard2 fails: the other members take over its switches and its destinations, from the rules they back up
+failed = peers.pop('shard2')
+failed.running = False
+for shard in list(peers.values()):
+    shard._change_ring(removed=['shard2'])
+check('Fail shard2')
+reconnect_switches()
+check('Reconnect after the failure')
+
+# shard3 joins and takes over some switches; the rules are routed again to the new owners and backups
+start_member('shard3')
+check('Join shard3')
+reconnect_switches()
+check('Reconnect after the join')
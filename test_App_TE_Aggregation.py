@@ -0,0 +1,43 @@
+import networkx as nx
+
+from rule import Action, ActionType, MatchPattern, Rule
+from app_te import TEApp
+from rule_aggregation import aggregate_rules
+from te_objs import PassByPathObjective
+
+GRAPH_FILE = './test_case/ecmp.graphml'
+
+app_te = TEApp(topo_file=GRAPH_FILE, json_file=None, aggregate=True)
+
+# Obj 1 and 2: TCP traffic from '10.0.0.4' and from '10.0.0.5' to '10.0.0.1' shares the path segment 4->2->1
+# The two sources are the CIDR prefix '10.0.0.4/31': switches 2 and 1 get one rule for both
+pattern = MatchPattern(ip_proto=6, src_ip='10.0.0.4', dst_ip='10.0.0.1')
+app_te.add_pass_by_path_obj(PassByPathObjective(match_pattern=pattern, switches=[4, 2, 1]))
+pattern = MatchPattern(ip_proto=6, src_ip='10.0.0.5', dst_ip='10.0.0.1')
+app_te.add_pass_by_path_obj(PassByPathObjective(match_pattern=pattern, switches=[5, 4, 2, 1]))
+
+# Obj 3: the same traffic as Obj 2, through the same switches: its rules are kept once
+app_te.add_pass_by_path_obj(PassByPathObjective(match_pattern=pattern, switches=[5, 4, 2, 1]))
+app_te.provision_pass_by_paths()
+
+print('Aggregated Pass-by Paths Rules:')
+for rule in app_te.rules:
+    print(rule)
+print(app_te.aggregations['pass_by_paths'])
+
+print()
+
+# Rules of switch 5 (port 1 to its host, port 2 to switch 4) dropping the pkts to '10.0.0.9' from every port
+# are merged into one rule matching any port; at switch 4, the rules miss port 4 and are kept
+topo = nx.read_graphml(GRAPH_FILE)
+rules = []
+for switch, in_ports in ((5, [1, 2]), (4, [1, 2, 3])):
+    for in_port in in_ports:
+        pattern = MatchPattern(dst_ip='10.0.0.9', in_port=in_port)
+        rules.append(Rule(switch_id=switch, match_pattern=pattern, action=Action(ActionType.DROP)))
+aggregation = aggregate_rules(topo, rules)
+
+print('Aggregated In-port Rules:')
+for rule in aggregation.rules:
+    print(rule)
+print(aggregation)
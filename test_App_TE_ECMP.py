@@ -0,0 +1,24 @@
+from rule import MatchPattern
+from app_te import TEApp
+from te_objs import MinLatencyObjective
+
+GRAPH_FILE = './test_case/ecmp.graphml'
+
+# Two min-latency paths of equal delay from switch 1 to switch 4: 1->2->4 and 1->3->4
+app_te = TEApp(topo_file=GRAPH_FILE, json_file=None, ecmp=True)
+
+# All UDP traffic from switch 1 to switch 5 and in the reverse direction is spread over the min-latency paths
+pattern = MatchPattern(ip_proto=17)
+app_te.add_min_latency_obj(MinLatencyObjective(pattern, src_switch=1, dst_switch=5, symmetric=True))
+app_te.provision_min_latency_paths()
+
+print('ECMP Min-latency Paths Rules:')
+for rule in app_te.rules:
+    print(rule)
+
+print()
+
+print('ECMP Groups:')
+for dpid in sorted(app_te.groups_by_dpid):
+    for group_id in sorted(app_te.groups_by_dpid[dpid]):
+        print(app_te.groups_by_dpid[dpid][group_id])
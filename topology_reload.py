@@ -0,0 +1,255 @@
+"""
+Reloads the topology of running apps with a minimal, make-before-break rule delta.
+
+The new graph is diffed against the live one, and every app recomputes only what the diff could change
+(see the `on_notified` of the apps). The rule tables of the apps before and after are then compared,
+and the delta is pushed in phases separated by barriers:
+    1. the new groups
+    2. the new and changed rules, the switches closest to the egress of their traffic first,
+       so a switch only starts forwarding on a new path once the rest of the path is in place
+    3. the rules that are no longer needed
+    4. the groups that are no longer needed
+"""
+from utils_ports import get_neighbor_for_port
+
+
+def edge_key(u, v):
+    return (u, v) if u <= v else (v, u)
+
+
+class TopologyDiff:
+    """
+    The differences between two topologies:
+    added/removed nodes and edges (edges as sorted node pairs),
+    `changed_nodes` and `changed_edges` map a node/edge to its {attribute: (old value, new value)},
+    `renumbered` holds the switches whose neighbours changed, i.e., whose ports may be renumbered.
+    """
+    def __init__(self):
+        self.added_nodes = set()
+        self.removed_nodes = set()
+        self.added_edges = set()
+        self.removed_edges = set()
+        self.changed_nodes = {}
+        self.changed_edges = {}
+        self.renumbered = set()
+
+    def empty(self):
+        return not (self.added_nodes or self.removed_nodes or self.added_edges or self.removed_edges or
+                    self.changed_nodes or self.changed_edges)
+
+    # True if links or switches were added or removed
+    def structural(self):
+        return bool(self.added_nodes or self.removed_nodes or self.added_edges or self.removed_edges)
+
+    def node_attr_changed(self, attr):
+        return any(attr in attrs for attrs in self.changed_nodes.values())
+
+    def edge_attr_changed(self, attr):
+        return any(attr in attrs for attrs in self.changed_edges.values())
+
+    # The edges whose `attr` increased, or decreased if `increased` is False
+    def edges_with_changed_attr(self, attr, increased=True):
+        edges = set()
+        for edge, attrs in self.changed_edges.items():
+            if attr in attrs:
+                old, new = attrs[attr]
+                if old is None or new is None or (new > old) == increased:
+                    edges.add(edge)
+        return edges
+
+    def __str__(self):
+        return '+%d/-%d switches, +%d/-%d links, %d switches and %d links changed, %d switches renumbered' % (
+            len(self.added_nodes), len(self.removed_nodes), len(self.added_edges), len(self.removed_edges),
+            len(self.changed_nodes), len(self.changed_edges), len(self.renumbered))
+
+
+def _changed_attrs(old, new):
+    return {attr: (old.get(attr), new.get(attr)) for attr in set(old) | set(new) if old.get(attr) != new.get(attr)}
+
+
+def diff_topologies(old, new):
+    """ Returns the TopologyDiff from the graph `old` to the graph `new`
+    """
+    diff = TopologyDiff()
+    diff.added_nodes = set(new.nodes()) - set(old.nodes())
+    diff.removed_nodes = set(old.nodes()) - set(new.nodes())
+    old_edges = {edge_key(u, v) for u, v in old.edges()}
+    new_edges = {edge_key(u, v) for u, v in new.edges()}
+    diff.added_edges = new_edges - old_edges
+    diff.removed_edges = old_edges - new_edges
+    for node in set(old.nodes()) & set(new.nodes()):
+        attrs = _changed_attrs(old.nodes[node], new.nodes[node])
+        if attrs:
+            diff.changed_nodes[node] = attrs
+        if sorted(old.neighbors(node)) != sorted(new.neighbors(node)):
+            diff.renumbered.add(node)
+    for edge in old_edges & new_edges:
+        attrs = _changed_attrs(old.edges[edge], new.edges[edge])
+        if attrs:
+            diff.changed_edges[edge] = attrs
+    return diff
+
+
+class RuleTables:
+    """
+    The rules and groups the apps want on the switches.
+    `rules` maps (app priority, switch id, match key) -> (app, Rule),
+    `groups` maps (switch id, group id) -> (app, Group).
+    """
+    def __init__(self, apps):
+        self.rules = {}
+        self.groups = {}
+        for app in apps:
+            for rules_by_dpid in app.rule_store.values():
+                for dpid, rules in rules_by_dpid.items():
+                    for rule in rules:
+                        self.rules[app.priority, dpid, rule.match_pattern.key()] = (app, rule)
+            for key, group in app.stored_groups().items():
+                self.groups[key] = (app, group)
+
+
+class RuleDelta:
+    """
+    The changes from one RuleTables to another, in make-before-break order:
+    `group_adds` (app, Group), `add_phases` lists of (app, Rule), `deletes` (app, Rule), `group_deletes` (app, Group)
+    """
+    def __init__(self):
+        self.group_adds = []
+        self.add_phases = []
+        self.deletes = []
+        self.group_deletes = []
+
+    def adds(self):
+        return sum(len(phase) for phase in self.add_phases)
+
+    def __str__(self):
+        return '%d rules added or changed in %d phases, %d rules deleted, %d groups added, %d groups deleted' % (
+            self.adds(), len(self.add_phases), len(self.deletes), len(self.group_adds), len(self.group_deletes))
+
+
+def rule_delta(before, after, topo=None):
+    """ Returns the RuleDelta from the RuleTables `before` to the RuleTables `after` on the graph `topo`
+    Without `topo`, all the new and changed rules are in one phase
+    """
+    delta = RuleDelta()
+    delta.group_adds = [entry for key, entry in after.groups.items() if key not in before.groups]
+    delta.group_deletes = [entry for key, entry in before.groups.items() if key not in after.groups]
+    delta.deletes = [entry for key, entry in before.rules.items() if key not in after.rules]
+
+    depths = egress_depths(after, topo) if topo is not None else {}
+    phases = {}
+    for key, (app, rule) in after.rules.items():
+        old = before.rules.get(key)
+        if old is None or old[1].action.key() != rule.action.key():
+            phases.setdefault(depths.get(key, 0), []).append((app, rule))
+    delta.add_phases = [phases[depth] for depth in sorted(phases)]
+    return delta
+
+
+def egress_depths(tables, topo):
+    """ The number of hops from every rule of `tables` to the egress of its traffic
+
+    The rules of an app matching the same traffic (the same match pattern, whatever the in_port) form
+    a forwarding graph over the switches; the depth of a rule is its longest distance to a switch that
+    sends the traffic out of this graph (to a host, or to a switch without a rule for it).
+
+    Returns:
+        A dict of rule key -> depth
+    """
+    flows = {} # (app priority, match key without in_port) -> (switch id -> set of next-hop switch ids)
+    for (priority, dpid, _), (app, rule) in tables.rules.items():
+        next_hops = flows.setdefault((priority, _traffic_key(rule)), {}).setdefault(dpid, set())
+        for port in _out_ports(rule, tables.groups):
+            neighbor = get_neighbor_for_port(topo, str(dpid), port) if str(dpid) in topo else None
+            if neighbor is not None:
+                next_hops.add(int(neighbor))
+
+    depths = {}
+    for key, (app, rule) in tables.rules.items():
+        graph = flows[key[0], _traffic_key(rule)]
+        depths[key] = _depth(graph, key[1], {}, set())
+    return depths
+
+
+def _traffic_key(rule):
+    key = list(rule.match_pattern.key())
+    key[-1] = None
+    return tuple(key)
+
+
+def _out_ports(rule, groups):
+    if rule.action.out_port is not None:
+        return [rule.action.out_port]
+    if rule.action.group_id is not None and (rule.switch_id, rule.action.group_id) in groups:
+        return [bucket.out_port for bucket in groups[rule.switch_id, rule.action.group_id][1].buckets]
+    return []
+
+
+def _depth(graph, switch, memo, visiting):
+    if switch in memo:
+        return memo[switch]
+    visiting.add(switch)
+    depth = 0
+    for next_hop in graph.get(switch, ()):
+        if next_hop in graph and next_hop not in visiting:
+            depth = max(depth, 1 + _depth(graph, next_hop, memo, visiting))
+    visiting.discard(switch)
+    memo[switch] = depth
+    return depth
+
+
+def apply_delta(of_controller, delta, timeout=30.0):
+    """ Sends `delta` to the connected switches of `of_controller`, waiting for the barrier replies
+    of every switch after each phase
+    """
+    phases = [[('group', app, group) for app, group in delta.group_adds]]
+    phases.extend([('rule', app, rule) for app, rule in phase] for phase in delta.add_phases)
+    phases.append([('delete', app, rule) for app, rule in delta.deletes])
+    phases.append([('delete_group', app, group) for app, group in delta.group_deletes])
+    for phase in phases:
+        datapaths = {}
+        for kind, app, item in phase:
+            datapath = of_controller.datapaths.get(item.switch_id)
+            if datapath is None:
+                continue
+            if kind == 'group':
+                app.send_group_to_dp(item, datapath)
+            elif kind == 'rule':
+                app.send_openflow_rules_to_dp(item, datapath)
+            elif kind == 'delete':
+                app.delete_rule_from_dp(item, datapath)
+            else:
+                of_controller.delete_group(datapath, item.group_id)
+            datapaths[datapath.id] = datapath
+        if datapaths:
+            of_controller.wait_barriers(of_controller.send_barriers(datapaths.values()), timeout)
+
+
+def reload_topology(of_controller, old_topo, new_topo, topo_file=None, timeout=30.0):
+    """ Moves the apps of `of_controller` from `old_topo` to `new_topo` and sends the rule delta
+
+    The firewall is notified last, so its placement sees the new rules of the other apps.
+    A sharded controller routes the new rules to the owners of the switches instead, which send their
+    differences (see sharding.py).
+    The apps are on `new_topo` even if a switch does not confirm the delta (TimeoutError): the caller
+    commits `new_topo` and reconciles the switches with the rules of the apps.
+
+    Returns:
+        (the TopologyDiff, the RuleDelta)
+    """
+    diff = diff_topologies(old_topo, new_topo)
+    if diff.empty():
+        return diff, RuleDelta()
+    apps = of_controller.apps()
+    before = RuleTables(apps)
+    for app in sorted(apps, key=lambda app: app is of_controller.app_fw):
+        kwargs = {'topo': new_topo, 'diff': diff, 'old_topo': old_topo, 'topo_file': topo_file}
+        if app is of_controller.app_fw:
+            kwargs['reserved'] = of_controller.reserved_entries(app)
+        app.on_notified(**kwargs)
+    delta = rule_delta(before, RuleTables(apps), new_topo)
+    if of_controller.shard is not None:
+        of_controller.shard.reroute()
+    else:
+        apply_delta(of_controller, delta, timeout)
+    return diff, delta
@@ -6,6 +6,9 @@ from te_objs import PassByPathObjective, MinLatencyObjective, MaxBandwidthObject
 
 class DefaultEncoder(JSONEncoder):
     def default(self, object):
+        # An action without a group is written as before groups existed, so the policy files do not change
+        if isinstance(object, Action) and object.group_id is None:
+            return {key: value for key, value in object.__dict__.items() if key != 'group_id'}
         if isinstance(object, PassByPathObjective) or \
             isinstance(object, MinLatencyObjective) or \
             isinstance(object, MaxBandwidthObjective) or \
@@ -36,4 +36,13 @@ def find_ports_per_switch(graph, path):
         in_port = get_in_port_for_dst(graph, n1, n2)
     path_with_ports.append((pairs[-1][-1], in_port, 1))
 
-    return path_with_ports
\ No newline at end of file
+    return path_with_ports
+
+
+# For a `port` at `switch`, return the neighbour switch connected to it
+# Port 1 is connected to the host of `switch`, so it returns None
+def get_neighbor_for_port(graph, switch, port):
+    neighbors = sorted(graph.neighbors(switch))
+    if port is not None and 2 <= port < len(neighbors) + 2:
+        return neighbors[port - 2]
+    return None